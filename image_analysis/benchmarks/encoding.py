@@ -0,0 +1,50 @@
+"""
+Microbenchmark for encoding and decoding a 128x6272 batch, the size of the first dense layer input.
+Run from image_analysis with: python -m benchmarks.encoding [backend ...]
+"""
+import sys
+import time
+import numpy as np
+
+import pond.tensor
+from pond.tensor import encode, decode, field_elements, set_backend
+
+SHAPE = (128, 6272)
+
+
+def reference_encode(rationals):
+    return field_elements((rationals * pond.tensor.BASE ** pond.tensor.PRECISION_FRACTIONAL).astype('int'))
+
+
+def reference_decode(elements):
+    Q = pond.tensor.Q
+    map_negative_range = np.vectorize(lambda element: element if element <= Q / 2 else element - Q)
+    return map_negative_range(elements) / pond.tensor.BASE ** pond.tensor.PRECISION_FRACTIONAL
+
+
+def timed(function, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        result = function(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run(backend):
+    set_backend(backend)
+    rationals = np.random.uniform(-1000, 1000, SHAPE)
+    encode_time, elements = timed(encode, rationals)
+    decode_time, decoded = timed(decode, elements)
+    assert np.allclose(decoded, rationals, atol=2. ** -pond.tensor.PRECISION_FRACTIONAL)
+    print("%-7s encode %8.4fs  decode %8.4fs" % (backend, encode_time, decode_time))
+    if backend == 'object':
+        encode_time, elements = timed(reference_encode, rationals, repeat=1)
+        decode_time, _ = timed(reference_decode, elements, repeat=1)
+        print("%-7s encode %8.4fs  decode %8.4fs  (np.vectorize reference)" % (backend, encode_time, decode_time))
+
+
+if __name__ == '__main__':
+    for backend in sys.argv[1:] or ['object', 'rns', 'ring64']:
+        run(backend)
@@ -26,7 +26,9 @@ def im2col_indices(x, field_height, field_width, padding=1, stride=1):
     # Zero-pad the input
     p = padding
     if padding > 0:
-        x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+        # np.zeros rather than np.pad, which pads object arrays with numpy integers instead of Python ones
+        x_padded = np.zeros(x.shape[:2] + (x.shape[2] + 2 * p, x.shape[3] + 2 * p), dtype=x.dtype)
+        x_padded[:, :, p:-p, p:-p] = x
     else:
         x_padded = x
     k, i, j = get_im2col_indices(x.shape, field_height, field_width, padding,
@@ -42,7 +44,7 @@ def col2im_indices(cols, x_shape, field_height=3, field_width=3, padding=1,
     """ An implementation of col2im based on fancy indexing and np.add.at """
     N, C, H, W = x_shape
     H_padded, W_padded = H + 2 * padding, W + 2 * padding
-    x_padded = np.zeros((N, C, H_padded, W_padded))
+    x_padded = np.zeros((N, C, H_padded, W_padded), dtype=cols.dtype)
     k, i, j = get_im2col_indices(x_shape, field_height, field_width, padding,
                                  stride)
     cols_reshaped = cols.reshape(C * field_height * field_width, -1, N)
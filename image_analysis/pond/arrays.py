@@ -0,0 +1,700 @@
+import numpy as np
+from functools import reduce
+from itertools import repeat
+
+
+class LimbArray:
+    """
+    Array of ring elements stored as a stack of fixed-width integer limbs along a leading axis.
+
+    Behaves like the numpy arrays used as shares in pond.tensor: shape, indexing and the shape manipulating
+    methods only ever refer to the data axes, the limb axis is kept in front and is never exposed.
+    """
+
+    # make numpy return NotImplemented from its binary operators so that our reflected operators are used
+    __array_ufunc__ = None
+    # whether the limbs hold canonical representatives, see RNSArray
+    reduced = True
+
+    def __init__(self, limbs):
+        self.limbs = limbs
+
+    @classmethod
+    def reduce(cls, limbs):
+        return limbs
+
+    def wrap(self, limbs):
+        return type(self)(limbs)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, self.limbs)
+
+    @property
+    def shape(self):
+        return self.limbs.shape[1:]
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def ndim(self):
+        return self.limbs.ndim - 1
+
+    @property
+    def dtype(self):
+        return self.limbs.dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def copy(self):
+        return self.wrap(self.limbs.copy())
+
+    def data_axis(self, axis):
+        # translate an axis of the data into the corresponding axis of the limbs
+        if axis is None: return None
+        if isinstance(axis, tuple): return tuple(self.data_axis(a) for a in axis)
+        return axis + 1 if axis >= 0 else axis
+
+    @staticmethod
+    def limb_index(index):
+        if not isinstance(index, tuple): index = (index,)
+        return (slice(None),) + index
+
+    def __getitem__(self, index):
+        return self.wrap(self.limbs[LimbArray.limb_index(index)])
+
+    def __setitem__(self, index, other):
+        assert isinstance(other, type(self)), type(other)
+        self.limbs[LimbArray.limb_index(index)] = align(other.limbs, self.limbs[LimbArray.limb_index(index)].ndim)
+
+    def reshape(self, *shape):
+        if len(shape) == 1 and isinstance(shape[0], (tuple, list)): shape = tuple(shape[0])
+        return self.wrap(self.limbs.reshape((self.limbs.shape[0],) + tuple(shape)))
+
+    def transpose(self, *axes):
+        if len(axes) == 1 and isinstance(axes[0], (tuple, list)): axes = tuple(axes[0])
+        if len(axes) == 0: axes = tuple(reversed(range(self.ndim)))
+        return self.wrap(self.limbs.transpose((0,) + tuple(a % self.ndim + 1 for a in axes)))
+
+    def repeat(self, repeats, axis=None):
+        if axis is None:
+            return self.wrap(np.repeat(self.limbs.reshape(self.limbs.shape[0], -1), repeats, axis=1))
+        return self.wrap(np.repeat(self.limbs, repeats, axis=self.data_axis(axis)))
+
+    def sum(self, axis=None, keepdims=False):
+        if axis is None: axis = tuple(range(self.ndim))
+        return type(self)(self.reduce(self.limbs.sum(axis=self.data_axis(axis), keepdims=keepdims)))
+
+    def map(self, function):
+        # apply a numpy function limb by limb, e.g. im2col
+        return type(self)(self.reduce(np.stack([function(limb) for limb in self.limbs])))
+
+    def __iadd__(self, other):
+        return self.binary(other, np.add, out=self)
+
+    def __isub__(self, other):
+        return self.binary(other, np.subtract, out=self)
+
+    def __imul__(self, other):
+        return self.binary(other, np.multiply, out=self)
+
+
+def split_float(values):
+    """
+    Split integral float64 values exactly into int64 mantissas and non-negative exponents
+    :param values: float64 array without fractional parts
+    :return: (mantissa, exponent) with values == mantissa * 2**exponent and |mantissa| < 2**53
+    """
+    fraction, exponent = np.frexp(values)
+    shift = np.maximum(exponent - 53, 0)
+    return np.ldexp(fraction, exponent - shift).astype(np.int64), shift
+
+
+def align(limbs, ndim):
+    # insert data axes after the limb axis so that limbs broadcast against limbs with `ndim` axes
+    missing = ndim - limbs.ndim
+    if missing <= 0: return limbs
+    return limbs.reshape((limbs.shape[0],) + (1,) * missing + limbs.shape[1:])
+
+
+# We want products of two residues to fit in 52 bits and sums of RNS_DOT_CHUNK products to fit in an int64.
+RNS_MODULI = (67108859, 67108837, 67108819, 67108777, 67108763)
+RNS_MODULUS = reduce(lambda x, y: x * y, RNS_MODULI)
+RNS_DOT_CHUNK = 2 ** 11
+
+assert all(p < 2 ** 26 for p in RNS_MODULI)
+assert RNS_DOT_CHUNK * (max(RNS_MODULI) - 1) ** 2 < 2 ** 63
+
+# RNS_POWERS_OF_TWO[i, e] is 2^e modulo p_i for every exponent a float64 can have
+RNS_POWERS_OF_TWO = np.array([[pow(2, e, p) for e in range(1024)] for p in RNS_MODULI], dtype=np.int64)
+# prefix products p_0 * ... * p_{i-1} used as mixed-radix weights
+RNS_RADICES = [reduce(lambda x, y: x * y, RNS_MODULI[:i], 1) for i in range(len(RNS_MODULI))]
+# RNS_INVERSES[i][j] is the inverse of p_j modulo p_i for j < i
+RNS_INVERSES = [[pow(pj, pi - 2, pi) for pj in RNS_MODULI[:i]] for i, pi in enumerate(RNS_MODULI)]
+
+
+class RNSArray(LimbArray):
+    """
+    Integers modulo RNS_MODULUS in residue number system representation: limb i holds the residues modulo
+    RNS_MODULI[i] as int64 values, reduced into [0, p_i) unless `reduced` is False.
+
+    Addition, subtraction and multiplication leave their results unreduced and reducing modulo RNS_MODULUS
+    brings them back into range, so callers have to keep intermediate residues within int64 (pond.tensor
+    tracks bounds for this). Everything else works on reduced limbs.
+    """
+
+    MODULI = np.array(RNS_MODULI, dtype=np.int64)
+
+    def __init__(self, limbs, reduced=True):
+        super().__init__(limbs)
+        self.reduced = reduced
+
+    def wrap(self, limbs):
+        return RNSArray(limbs, self.reduced)
+
+    def __setitem__(self, index, other):
+        super().__setitem__(index, other)
+        self.reduced = self.reduced and other.reduced
+
+    @classmethod
+    def moduli(cls, ndim):
+        return cls.MODULI.reshape((len(RNS_MODULI),) + (1,) * ndim)
+
+    @classmethod
+    def reduce(cls, limbs):
+        return limbs % cls.moduli(limbs.ndim - 1)
+
+    @staticmethod
+    def from_ints(ints):
+        ints = np.asarray(ints)
+        if ints.dtype == object:
+            return RNSArray(np.stack([np.asarray(ints % p).astype(np.int64) for p in RNS_MODULI]))
+        if ints.dtype != np.uint64: ints = ints.astype(np.int64)
+        # stay within the integer dtype, mixing uint64 with Python ints would go through float64
+        return RNSArray(np.stack([(ints % ints.dtype.type(p)).astype(np.int64) for p in RNS_MODULI]))
+
+    @staticmethod
+    def from_floats(values):
+        # exact for integral float64 values of any magnitude
+        mantissa, exponent = split_float(values)
+        moduli = RNSArray.moduli(mantissa.ndim)
+        powers = RNS_POWERS_OF_TWO[np.arange(len(RNS_MODULI)).reshape(moduli.shape), exponent]
+        return RNSArray(mantissa % moduli * powers % moduli)
+
+    @staticmethod
+    def zeros(shape):
+        if not isinstance(shape, tuple): shape = tuple(shape) if isinstance(shape, list) else (shape,)
+        return RNSArray(np.zeros((len(RNS_MODULI),) + shape, dtype=np.int64))
+
+    @staticmethod
+    def random(shape, prg):
+        # 64 random bits per residue, the bias of reducing them modulo a 26 bit prime is below 2^-38
+        if not isinstance(shape, tuple): shape = tuple(shape) if isinstance(shape, list) else (shape,)
+        words = prg.random_words((len(RNS_MODULI),) + shape)
+        moduli = RNSArray.MODULI.astype(np.uint64).reshape((len(RNS_MODULI),) + (1,) * len(shape))
+        return RNSArray((words % moduli).astype(np.int64))
+
+    def coerce(self, other):
+        if isinstance(other, RNSArray): return other.limbs
+        if isinstance(other, (int, np.integer, np.ndarray)): return RNSArray.from_ints(other).limbs
+        raise TypeError("%s does not support %s" % (type(self), type(other)))
+
+    def binary(self, other, operation, out=None, reflected=False):
+        if isinstance(other, AnalyticArray): return other.binary(self, operation, out, not reflected)
+        x, y = self.limbs, self.coerce(other)
+        if reflected: x, y = y, x
+        ndim = max(x.ndim, y.ndim)
+        if out is None: return RNSArray(operation(align(x, ndim), align(y, ndim)), reduced=False)
+        operation(align(x, ndim), align(y, ndim), out=out.limbs)
+        out.reduced = False
+        return out
+
+    def __add__(self, other):
+        return self.binary(other, np.add)
+
+    def __radd__(self, other):
+        return self.binary(other, np.add)
+
+    def __sub__(self, other):
+        return self.binary(other, np.subtract)
+
+    def __rsub__(self, other):
+        return self.binary(other, np.subtract, reflected=True)
+
+    def __mul__(self, other):
+        return self.binary(other, np.multiply)
+
+    def __rmul__(self, other):
+        return self.binary(other, np.multiply)
+
+    def __neg__(self):
+        return RNSArray((RNSArray.moduli(self.ndim) - self.limbs) % RNSArray.moduli(self.ndim))
+
+    def __mod__(self, modulus):
+        assert modulus == RNS_MODULUS, modulus
+        if self.reduced: return self
+        return RNSArray(RNSArray.reduce(self.limbs))
+
+    def dot(self, other):
+        assert isinstance(other, RNSArray), type(other)
+        n = self.shape[-1]
+        limbs = []
+        for a, b, p in zip((self % RNS_MODULUS).limbs, (other % RNS_MODULUS).limbs, RNS_MODULI):
+            result = 0
+            for start in range(0, n, RNS_DOT_CHUNK):
+                a_chunk = a[..., start:start + RNS_DOT_CHUNK]
+                b_chunk = b[start:start + RNS_DOT_CHUNK] if b.ndim == 1 else b[..., start:start + RNS_DOT_CHUNK, :]
+                result = (result + a_chunk.dot(b_chunk)) % p
+            limbs.append(result)
+        return RNSArray(np.stack(limbs))
+
+    def mixed_radix(self):
+        # digits v_i with x = v_0 + v_1 * p_0 + v_2 * p_0 * p_1 + ... and 0 <= v_i < p_i
+        digits = []
+        limbs = (self % RNS_MODULUS).limbs
+        for i, p in enumerate(RNS_MODULI):
+            digit = limbs[i]
+            for j, inverse in enumerate(RNS_INVERSES[i]):
+                digit = ((digit - digits[j]) % p) * inverse % p
+            digits.append(digit)
+        return digits
+
+    def compare(self, scalar):
+        # -1, 0 or 1 depending on how the canonical representatives compare to the integer `scalar`
+        scalar = int(scalar) % RNS_MODULUS
+        other = [(scalar // radix) % p for radix, p in zip(RNS_RADICES, RNS_MODULI)]
+        result = np.zeros(self.shape, dtype=np.int8)
+        for digit, other_digit in reversed(list(zip(self.mixed_radix(), other))):
+            undecided = result == 0
+            result[undecided & (digit < other_digit)] = -1
+            result[undecided & (digit > other_digit)] = 1
+        return result
+
+    def __le__(self, scalar):
+        return self.compare(scalar) <= 0
+
+    def __lt__(self, scalar):
+        return self.compare(scalar) < 0
+
+    def __ge__(self, scalar):
+        return self.compare(scalar) >= 0
+
+    def __gt__(self, scalar):
+        return self.compare(scalar) > 0
+
+    def __floordiv__(self, divisor):
+        # exact floor division of the canonical representatives by a power of two
+        assert divisor > 0 and divisor & (divisor - 1) == 0 and divisor <= 2 ** 64, divisor
+        remainder = np.zeros(self.shape, dtype=np.uint64)
+        for digit, radix in zip(self.mixed_radix(), RNS_RADICES):
+            remainder += digit.astype(np.uint64) * np.uint64(radix % 2 ** 64)
+        remainder &= np.uint64(divisor - 1)
+        inverses = np.array([pow(divisor, p - 2, p) for p in RNS_MODULI], dtype=np.int64)
+        limbs = (self.limbs - RNSArray.from_ints(remainder).limbs) % RNSArray.moduli(self.ndim)
+        return RNSArray(limbs * inverses.reshape(RNSArray.moduli(self.ndim).shape) % RNSArray.moduli(self.ndim))
+
+    def to_ints(self):
+        ints = np.zeros(self.shape, dtype=object)
+        for digit, radix in zip(self.mixed_radix(), RNS_RADICES):
+            ints = ints + digit.astype(object) * radix
+        return ints
+
+    def signed_float(self):
+        # lift into (-RNS_MODULUS/2, RNS_MODULUS/2] and convert to float64
+        negative = self > RNS_MODULUS // 2
+        magnitude = RNSArray(np.where(negative, (-self).limbs, (self % RNS_MODULUS).limbs))
+        value = np.zeros(self.shape)
+        for digit, radix in zip(magnitude.mixed_radix(), RNS_RADICES):
+            value += digit * float(radix)
+        return np.where(negative, -value, value)
+
+
+RING_MODULUS = 2 ** 64
+
+
+class Ring64Array(LimbArray):
+    """
+    Integers modulo 2^64 stored in a single uint64 limb. Numpy arithmetic on uint64 wraps around, so no
+    modulo reduction is ever needed.
+    """
+
+    @staticmethod
+    def from_ints(ints):
+        ints = np.asarray(ints)
+        if ints.dtype == object: ints = ints % RING_MODULUS
+        # casting int64 to uint64 keeps the two's complement bits, i.e. reduces modulo 2^64
+        return Ring64Array(ints.astype(np.uint64)[np.newaxis])
+
+    @staticmethod
+    def from_floats(values):
+        # exact for integral float64 values of any magnitude; shifts by 64 or more leave nothing modulo 2^64
+        mantissa, exponent = split_float(values)
+        limbs = mantissa.astype(np.uint64) << np.minimum(exponent, 63).astype(np.uint64)
+        return Ring64Array(np.where(exponent < 64, limbs, np.uint64(0))[np.newaxis])
+
+    @staticmethod
+    def zeros(shape):
+        if not isinstance(shape, tuple): shape = tuple(shape) if isinstance(shape, list) else (shape,)
+        return Ring64Array(np.zeros((1,) + shape, dtype=np.uint64))
+
+    @staticmethod
+    def random(shape, prg):
+        if not isinstance(shape, tuple): shape = tuple(shape) if isinstance(shape, list) else (shape,)
+        return Ring64Array(prg.random_words((1,) + shape))
+
+    def coerce(self, other):
+        if isinstance(other, Ring64Array): return other.limbs
+        if isinstance(other, (int, np.integer)): return np.array([int(other) % RING_MODULUS], dtype=np.uint64)
+        if isinstance(other, np.ndarray): return Ring64Array.from_ints(other).limbs
+        raise TypeError("%s does not support %s" % (type(self), type(other)))
+
+    def binary(self, other, operation, out=None, reflected=False):
+        if isinstance(other, AnalyticArray): return other.binary(self, operation, out, not reflected)
+        x, y = self.limbs, self.coerce(other)
+        if reflected: x, y = y, x
+        ndim = max(x.ndim, y.ndim)
+        if out is None: return Ring64Array(operation(align(x, ndim), align(y, ndim)))
+        operation(align(x, ndim), align(y, ndim), out=out.limbs)
+        return out
+
+    def __add__(self, other):
+        return self.binary(other, np.add)
+
+    def __radd__(self, other):
+        return self.binary(other, np.add)
+
+    def __sub__(self, other):
+        return self.binary(other, np.subtract)
+
+    def __rsub__(self, other):
+        return self.binary(other, np.subtract, reflected=True)
+
+    def __mul__(self, other):
+        return self.binary(other, np.multiply)
+
+    def __rmul__(self, other):
+        return self.binary(other, np.multiply)
+
+    def __neg__(self):
+        return Ring64Array(np.uint64(0) - self.limbs)
+
+    def __mod__(self, modulus):
+        assert modulus == RING_MODULUS, modulus
+        return self
+
+    def __rshift__(self, amount):
+        return Ring64Array(self.limbs >> np.uint64(amount))
+
+    def __floordiv__(self, divisor):
+        assert 0 < divisor < RING_MODULUS, divisor
+        return Ring64Array(self.limbs // np.uint64(divisor))
+
+    def dot(self, other):
+        assert isinstance(other, Ring64Array), type(other)
+        return Ring64Array(self.limbs[0].dot(other.limbs[0])[np.newaxis])
+
+    def __le__(self, scalar):
+        return self.limbs[0] <= np.uint64(int(scalar) % RING_MODULUS)
+
+    def __lt__(self, scalar):
+        return self.limbs[0] < np.uint64(int(scalar) % RING_MODULUS)
+
+    def __ge__(self, scalar):
+        return self.limbs[0] >= np.uint64(int(scalar) % RING_MODULUS)
+
+    def __gt__(self, scalar):
+        return self.limbs[0] > np.uint64(int(scalar) % RING_MODULUS)
+
+    def to_ints(self):
+        return self.limbs[0].astype(object)
+
+    def signed_float(self):
+        # two's complement: elements of 2^63 and above are negative
+        return self.limbs[0].view(np.int64).astype(np.float64)
+
+
+# Object arrays are multiplied by splitting every integer into DOT_LIMBS limbs of 16 bits and multiplying the
+# limbs with float64 (BLAS) matrix products, which are exact as long as sums of DOT_BLOCK products of two limbs
+# stay below 2^53. Partial products are gathered per power of 2^16 in int64 and only the results are turned
+# back into Python integers.
+DOT_LIMBS = 8
+DOT_BLOCK = 2 ** 20
+DOT_MAX_PRODUCTS = 2 ** 22
+
+assert DOT_BLOCK * (2 ** 16 - 1) ** 2 < 2 ** 53
+
+
+# width of the fixed-width little-endian representation of Python integers, see to_fixed
+FIXED_BYTES = 2 * DOT_LIMBS
+
+
+def to_fixed(ints):
+    # uint8 array shape + (FIXED_BYTES,) of the little-endian bytes of non-negative integers below 2^128
+    values = ints.ravel().tolist()
+    try:
+        data = b''.join(map(int.to_bytes, values, repeat(FIXED_BYTES), repeat('little')))
+    except TypeError:
+        # numpy integers among the Python integers
+        data = b''.join([int(v).to_bytes(FIXED_BYTES, 'little') for v in values])
+    return np.frombuffer(data, dtype=np.uint8).reshape(ints.shape + (FIXED_BYTES,))
+
+
+def from_fixed(data):
+    # object array of the integers whose bytes to_fixed returned
+    data = np.ascontiguousarray(data)
+    ints = np.empty(data.size // FIXED_BYTES, dtype=object)
+    ints[:] = list(map(int.from_bytes, data.view('S%d' % FIXED_BYTES).ravel().tolist(), repeat('little')))
+    return ints.reshape(data.shape[:-1])
+
+
+def to_limbs(ints):
+    # float64 array (DOT_LIMBS,) + shape of the 16 bit limbs of non-negative integers below 2^128
+    limbs = to_fixed(ints).view('<u2').reshape((ints.size, DOT_LIMBS))
+    return limbs.T.astype(np.float64).reshape((DOT_LIMBS,) + ints.shape)
+
+
+def from_limbs(digits):
+    # Python integers sum_i digits[i] * 2^(16 i) for non-negative int64 digits, as object array
+    carry = np.zeros(digits.shape[1:], dtype=np.int64)
+    words = []
+    for digit in digits:
+        digit = digit + carry
+        words.append((digit & 0xFFFF).astype('<u2'))
+        carry = digit >> 16
+    while carry.any():
+        words.append((carry & 0xFFFF).astype('<u2'))
+        carry = carry >> 16
+    # one little-endian byte string per integer; numpy drops trailing zero bytes which does not change the value
+    data = np.stack(words, axis=-1).view('S%d' % (2 * len(words))).ravel().tolist()
+    ints = np.empty(len(data), dtype=object)
+    ints[:] = list(map(int.from_bytes, data, repeat('little')))
+    return ints.reshape(carry.shape)
+
+
+def dot(x, y, modulus):
+    """
+    Matrix product of share arrays reduced modulo `modulus`; object arrays are multiplied exactly with blocked
+    float64 matrix products of small limbs instead of numpy's element by element object arithmetic
+    """
+    if isinstance(y, AnalyticArray): return AnalyticArray(x.shape).dot(y)
+    if isinstance(x, LimbArray) or x.dtype != object or y.ndim > 2: return x.dot(y) % modulus
+    n = x.shape[-1]
+    shape = x.shape[:-1] + y.shape[1:]
+    try:
+        x_limbs, y_limbs = to_limbs(x.reshape(-1, n)), to_limbs(y.reshape(n, -1))
+    except OverflowError:
+        # negative or unreduced, which is rare enough to just reduce
+        x_limbs, y_limbs = to_limbs(x.reshape(-1, n) % modulus), to_limbs(y.reshape(n, -1) % modulus)
+    m, o = x_limbs.shape[1], y_limbs.shape[2]
+    assert n <= DOT_BLOCK * 2 ** 7, n
+    digits = np.zeros((2 * DOT_LIMBS - 1, m, o), dtype=np.int64)
+    # all pairs of limbs at once, in blocks of output columns to bound the size of the products
+    columns = max(1, DOT_MAX_PRODUCTS // (DOT_LIMBS ** 2 * m))
+    for start in range(0, n, DOT_BLOCK):
+        x_block = x_limbs[:, :, start:start + DOT_BLOCK].reshape(DOT_LIMBS * m, -1)
+        for column in range(0, o, columns):
+            y_block = y_limbs[:, start:start + DOT_BLOCK, column:column + columns]
+            width = y_block.shape[2]
+            products = x_block.dot(y_block.transpose(1, 0, 2).reshape(-1, DOT_LIMBS * width))
+            products = products.reshape(DOT_LIMBS, m, DOT_LIMBS, width).astype(np.int64)
+            for i in range(DOT_LIMBS):
+                digits[i:i + DOT_LIMBS, :, column:column + width] += products[i].transpose(1, 0, 2)
+    return (from_limbs(digits) % modulus).reshape(shape)
+
+
+def is_array(x):
+    return isinstance(x, (np.ndarray, LimbArray))
+
+
+def add(x, y, out=None):
+    # x + y for share arrays and integers, written into `out` if given
+    if isinstance(x, LimbArray): return x.binary(y, np.add, out)
+    if isinstance(y, LimbArray): return y.binary(x, np.add, out, reflected=True)
+    return np.add(x, y, out=out)
+
+
+def subtract(x, y, out=None):
+    # x - y for share arrays and integers, written into `out` if given
+    if isinstance(x, LimbArray): return x.binary(y, np.subtract, out)
+    if isinstance(y, LimbArray): return y.binary(x, np.subtract, out, reflected=True)
+    return np.subtract(x, y, out=out)
+
+
+def broadcast_to(x, shape):
+    # read-only view of x repeated along the axes it is broadcast over, also if it has the shape already, so that
+    # in-place operations on the result copy it first instead of writing into x
+    shape = tuple(shape)
+    if isinstance(x, LimbArray):
+        return x.wrap(np.broadcast_to(align(x.limbs, len(shape) + 1), (x.limbs.shape[0],) + shape))
+    return np.broadcast_to(x, shape)
+
+
+def writeable(x):
+    # broadcast views can not be written in place
+    if isinstance(x, AnalyticArray): return True
+    if isinstance(x, LimbArray): return x.limbs.flags.writeable
+    return x.flags.writeable
+
+
+def stack(arrays, axis=0):
+    if isinstance(arrays[0], AnalyticArray):
+        shape, axis = arrays[0].shape, axis % (arrays[0].ndim + 1)
+        return AnalyticArray(shape[:axis] + (len(arrays),) + shape[axis:])
+    if isinstance(arrays[0], LimbArray):
+        axis = axis if axis < 0 else axis + 1
+        result = arrays[0].wrap(np.stack([a.limbs for a in arrays], axis))
+        result.reduced = all(a.reduced for a in arrays)
+        return result
+    return np.stack(arrays, axis)
+
+
+def concatenate(arrays, axis=0):
+    if isinstance(arrays[0], AnalyticArray):
+        shape, axis = arrays[0].shape, axis % arrays[0].ndim
+        return AnalyticArray(shape[:axis] + (sum(a.shape[axis] for a in arrays),) + shape[axis + 1:])
+    if isinstance(arrays[0], LimbArray):
+        result = arrays[0].wrap(np.concatenate([a.limbs for a in arrays], arrays[0].data_axis(axis)))
+        result.reduced = all(a.reduced for a in arrays)
+        return result
+    return np.concatenate(arrays, axis)
+
+
+def flip(x, axis):
+    if isinstance(x, LimbArray):
+        return x.wrap(np.flip(x.limbs, x.data_axis(axis)))
+    return np.flip(x, axis)
+
+
+def expand_dims(x, axis):
+    if isinstance(x, LimbArray):
+        axis = axis if axis >= 0 else axis + x.ndim + 1
+        return x.wrap(np.expand_dims(x.limbs, axis + 1))
+    return np.expand_dims(x, axis)
+
+
+class AnalyticArray(LimbArray):
+    """
+    Array of which nothing but the shape is known, used by the 'analytic' backend of pond.tensor to dry-run
+    computations, and by pond.runtime for the shares of the other party: every operation only works out the shape
+    of its result. The limbs are a single zero broadcast to the shape, so indexing and the shape manipulating
+    methods of LimbArray take no memory.
+    """
+
+    def __init__(self, shape):
+        if not isinstance(shape, tuple): shape = tuple(shape) if isinstance(shape, list) else (shape,)
+        super().__init__(np.broadcast_to(np.int8(0), (1,) + shape))
+
+    def wrap(self, limbs):
+        return AnalyticArray(limbs.shape[1:])
+
+    def __repr__(self):
+        return "AnalyticArray(%s)" % (self.shape,)
+
+    def copy(self):
+        return AnalyticArray(self.shape)
+
+    def __setitem__(self, index, other):
+        pass
+
+    def repeat(self, repeats, axis=None):
+        # `repeats` is a count, or one count per element along the axis
+        shape = (self.size,) if axis is None else self.shape
+        axis = 0 if axis is None else axis % len(shape)
+        count = int(np.sum(repeats)) if np.ndim(repeats) else shape[axis] * repeats
+        return AnalyticArray(shape[:axis] + (count,) + shape[axis + 1:])
+
+    def sum(self, axis=None, keepdims=False):
+        if axis is None: axis = tuple(range(self.ndim))
+        axis = [a % self.ndim for a in (axis if isinstance(axis, tuple) else (axis,))]
+        return AnalyticArray(tuple(1 if a in axis else n for a, n in enumerate(self.shape)
+                                   if keepdims or a not in axis))
+
+    def map(self, function):
+        raise TypeError("%s does not support %s" % (type(self), function))
+
+    @staticmethod
+    def from_ints(ints):
+        return AnalyticArray(np.shape(ints))
+
+    @staticmethod
+    def from_floats(values):
+        return AnalyticArray(np.shape(values))
+
+    @staticmethod
+    def zeros(shape):
+        return AnalyticArray(shape)
+
+    @staticmethod
+    def random(shape, prg):
+        return AnalyticArray(shape)
+
+    def binary(self, other, operation, out=None, reflected=False):
+        if out is not None: return out
+        # zero-strided arrays of the shapes take no memory, np.broadcast_shapes needs numpy 1.20
+        shapes = [np.broadcast_to(0, shape) for shape in (self.shape, np.shape(other))]
+        return AnalyticArray(np.broadcast(*shapes).shape)
+
+    def __add__(self, other):
+        return self.binary(other, np.add)
+
+    def __radd__(self, other):
+        return self.binary(other, np.add)
+
+    def __sub__(self, other):
+        return self.binary(other, np.subtract)
+
+    def __rsub__(self, other):
+        return self.binary(other, np.subtract)
+
+    def __mul__(self, other):
+        return self.binary(other, np.multiply)
+
+    def __rmul__(self, other):
+        return self.binary(other, np.multiply)
+
+    def __neg__(self):
+        return self
+
+    def __mod__(self, modulus):
+        return self
+
+    def __rshift__(self, amount):
+        return self
+
+    def __floordiv__(self, divisor):
+        return self
+
+    def __le__(self, scalar):
+        return self
+
+    def __lt__(self, scalar):
+        return self
+
+    def __ge__(self, scalar):
+        return self
+
+    def __gt__(self, scalar):
+        return self
+
+    def astype(self, dtype):
+        return self
+
+    def dot(self, other):
+        # numpy's dot: the last axis of self against the second to last of other
+        return AnalyticArray(self.shape[:-1] + (other.shape[:-2] + other.shape[-1:] if other.ndim > 1 else ()))
+
+    def im2col(self, h_filter, w_filter, padding, stride):
+        n, c, h, w = self.shape
+        h_out, w_out = (h + 2 * padding - h_filter) // stride + 1, (w + 2 * padding - w_filter) // stride + 1
+        return AnalyticArray((c * h_filter * w_filter, n * h_out * w_out))
+
+    def col2im(self, imshape, h_filter, w_filter, padding, stride):
+        return AnalyticArray(tuple(imshape))
+
+    def to_ints(self):
+        return np.zeros(self.shape, dtype=object)
+
+    def signed_float(self):
+        return np.zeros(self.shape)
@@ -0,0 +1,249 @@
+"""
+Crypto provider: a process playing the dealer that generates the triples of a TriplePlan and serves them over a
+local TCP or Unix socket, and the client the parties fetch them with.
+
+Protocol: a request is REQUEST (party, step, call), naming a triple by its position in the manifest of a training
+step. The response is SHARES (number of shares of the triple), then per share either a reference to a share
+returned earlier in the same step (REFERENCE) or the arrays of the party, or of both parties, see pond.wire. With
+SEED_COMPRESSION the random parts of triples go out as seeds, so about one array per triple is sent.
+Requests are answered in order, so a client can send many before reading the first response.
+"""
+import os
+import queue
+import socket
+import struct
+import threading
+import socketserver
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import pond.tensor as tensor
+from pond import wire
+from pond.arrays import AnalyticArray
+from pond.prg import PRG
+from pond.triples import TripleQueue, generate_step, start_worker
+
+REQUEST = struct.Struct('<BQI')
+SHARES = struct.Struct('<I')
+# whether a share is a reference, followed by REFERENCE (call, position) if it is
+FLAG = struct.Struct('<B')
+REFERENCE = struct.Struct('<IB')
+# party of a request asking for the shares of both parties, for the runtime in which both live in one process
+BOTH = 2
+
+
+class StepCache:
+    """
+    Triples of the most recent `size` steps of `calls`. Step s is generated from stream s of the PRG seeded with
+    `seed`, so it comes out the same whenever, and by whichever connection, it is asked for.
+    """
+
+    def __init__(self, calls, seed, size):
+        self.calls = calls
+        self.prg = PRG(seed)
+        self.size = size
+        self.steps = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, step):
+        with self.lock:
+            if step not in self.steps:
+                self.steps[step] = generate_step((self.calls, self.prg.stream(step).new_seed(), None))
+                if len(self.steps) > self.size: self.steps.popitem(last=False)
+            self.steps.move_to_end(step)
+            return self.steps[step]
+
+    def response(self, party, step, call):
+        triples = self.get(step)
+        _, _, inputs = self.calls[call]
+        given = {id(triples[c][position]): (c, position) for _, (c, position) in inputs}
+        chunks = [SHARES.pack(len(triples[call]))]
+        for share in triples[call]:
+            if id(share) in given:
+                chunks.append(FLAG.pack(1) + REFERENCE.pack(*given[id(share)]))
+                continue
+            chunks.append(FLAG.pack(0))
+            if party in (0, BOTH): chunks.extend(wire.pack_buffers(share.seed0 or share.expanded0))
+            if party in (1, BOTH): chunks.extend(wire.pack_buffers(share.seed1 or share.expanded1))
+        return chunks
+
+
+class ProviderHandler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        if self.request.family != socket.AF_UNIX: self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        while True:
+            request = self.rfile.read(REQUEST.size)
+            if len(request) < REQUEST.size: return
+            wire.send_buffers(self.request, self.server.steps.response(*REQUEST.unpack(request)))
+
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(calls, address, seed, cache, backend, seed_compression, ready):
+    start_worker(backend, seed_compression)
+    server = (ThreadingUnixServer if isinstance(address, str) else ThreadingTCPServer)(address, ProviderHandler)
+    server.steps = StepCache(calls, seed, cache)
+    ready.send(server.server_address)
+    server.serve_forever()
+
+
+class CryptoProvider:
+    """
+    Dealer process serving the triples of `calls` (TriplePlan.calls, e.g. from pond.triples.trace) for any number
+    of training steps on `address`: a (host, port) pair for TCP, port 0 picking a free one, or the path of a Unix
+    socket. Keeps the triples of the last `cache` steps it was asked for.
+    """
+
+    def __init__(self, calls, address=('127.0.0.1', 0), seed=None, cache=4):
+        self.calls = calls
+        self.address = address
+        self.seed = PRG().new_seed() if seed is None else seed
+        self.cache = cache
+        self.process = None
+
+    def start(self):
+        ready, sender = multiprocessing.Pipe(duplex=False)
+        self.process = multiprocessing.Process(target=serve, daemon=True, args=(
+            self.calls, self.address, self.seed, self.cache, tensor.BACKEND, tensor.SEED_COMPRESSION, sender))
+        self.process.start()
+        self.address = ready.recv()
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+        if isinstance(self.address, str) and os.path.exists(self.address): os.remove(self.address)
+
+
+def connect(address):
+    if isinstance(address, str):
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(address)
+    else:
+        connection = socket.create_connection(address)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return connection, connection.makefile('rb')
+
+
+class ConnectionPool:
+    """
+    Connections to `address`, opened when none is idle and kept open for reuse
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.idle = queue.LifoQueue()
+        self.opened = []
+
+    def get(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            connection = connect(self.address)
+            self.opened.append(connection)
+            return connection
+
+    def put(self, connection):
+        self.idle.put(connection)
+
+    def close(self):
+        for connection, stream in self.opened:
+            stream.close()
+            connection.close()
+        self.opened = []
+
+
+class ProviderClient(TripleQueue):
+    """
+    Fetches the triples of the coming training steps from a CryptoProvider at `address` and serves them like
+    TripleQueue. The triples of up to `depth` steps are in flight at once, each on a connection of its own from a
+    pool, and each connection has up to `window` requests outstanding. Call `step` at the start of every training
+    step, it waits for the triples of the step, and `close` at the end, or pass it to Sequential.fit.
+    :param calls: the TriplePlan.calls the provider serves
+    :param party: party of pond.runtime to fetch the shares of, the shares of the other being AnalyticArrays, or
+        BOTH
+    """
+
+    def __init__(self, address, calls, depth=2, window=16, party=BOTH):
+        super().__init__()
+        self.calls = calls
+        self.party = party
+        self.depth = depth
+        self.window = window
+        self.pool = ConnectionPool(address)
+        self.executor = ThreadPoolExecutor(depth)
+        self.pending = deque()
+        self.next_step = 0
+        self.hits, self.misses = 0, 0
+        # bytes of shares received
+        self.received = 0
+
+    def step(self):
+        while len(self.pending) < self.depth:
+            self.pending.append(self.executor.submit(self.fetch, self.next_step))
+            self.next_step += 1
+        self.put(self.calls, self.pending.popleft().result())
+
+    def fetch(self, step):
+        """
+        :return: the triples of `step`, one per call
+        """
+        connection = self.pool.get()
+        sock, stream = connection
+        try:
+            triples, sent = [], 0
+            while len(triples) < len(self.calls):
+                if sent - len(triples) < self.window and sent < len(self.calls):
+                    end = min(len(triples) + self.window, len(self.calls))
+                    sock.sendall(b''.join(REQUEST.pack(self.party, step, call) for call in range(sent, end)))
+                    sent = end
+                triples.append(self.read_triple(stream, triples))
+        except BaseException:
+            # the responses still on their way would be read as the answers to the next requests
+            sock.close()
+            raise
+        self.pool.put(connection)
+        return triples
+
+    def read_triple(self, stream, triples):
+        count, = SHARES.unpack(wire.read_exactly(stream, SHARES.size))
+        triple = []
+        for _ in range(count):
+            flag, = FLAG.unpack(wire.read_exactly(stream, FLAG.size))
+            if flag:
+                call, position = REFERENCE.unpack(wire.read_exactly(stream, REFERENCE.size))
+                triple.append(triples[call][position])
+                continue
+            shares = [wire.read_array(stream) if self.party in (party, BOTH) else None for party in (0, 1)]
+            self.received += sum(wire.nbytes(array) for array in shares if array is not None)
+            shape = next(array.shape for array in shares if array is not None)
+            shares = [AnalyticArray(shape) if array is None else array for array in shares]
+            triple.append(tensor.PrivateFieldTensor.from_shares(shares[0], shares[1]))
+        return tuple(triple)
+
+    def take(self, kind, params, shares):
+        triple = super().take(kind, params, shares)
+        if triple is None: self.misses += 1
+        else: self.hits += 1
+        return triple
+
+    def close(self):
+        # shutdown(cancel_futures=True) needs Python 3.9
+        for future in self.pending: future.cancel()
+        self.executor.shutdown()
+        self.pending.clear()
+        self.pool.close()
@@ -2,9 +2,9 @@ import numpy as np
 import sys
 from datetime import datetime, timedelta
 from functools import reduce
-from pond.tensor import NativeTensor, PublicEncodedTensor, PrivateEncodedTensor, stack, USE_SPECIALIZED_TRIPLE,\
-    REUSE_MASK, generate_conv_triple, generate_convbw_triple, generate_conv_pool_bw_triple, \
-    generate_conv_pool_delta_triple
+from pond.tensor import NativeTensor, PublicEncodedTensor, PrivateEncodedTensor, LazyPrivateEncodedTensor, stack,\
+    USE_SPECIALIZED_TRIPLE, REUSE_MASK, generate_conv_triple, generate_convbw_triple, generate_conv_pool_bw_triple, \
+    generate_conv_pool_delta_triple, beaver_combine, field_dot, fit_product, interleave
 import math
 import time
 import pond
@@ -14,6 +14,26 @@ class Layer:
     pass
 
 
+def fit_operand(x, parameter):
+    """
+    x truncated the way products with `parameter` truncate it. Layers fit their input and gradient once, so that
+    the masks cached on x by its first product are reused by the next ones, also in the backward pass
+    """
+    encoded = (PublicEncodedTensor, PrivateEncodedTensor)
+    if isinstance(x, encoded) and isinstance(parameter, encoded): return fit_product(x, parameter)[0]
+    return x
+
+
+def descent_step(gradient, learning_rate, parameter):
+    """
+    The gradient scaled by the learning rate, truncated to the precision of `parameter` for encoded tensors so
+    that subtracting it updates the parameter in place without raising its precision
+    """
+    step = gradient * learning_rate
+    if isinstance(step, (PublicEncodedTensor, PrivateEncodedTensor)): step = step.rescale(parameter.precision)
+    return step
+
+
 class Dense(Layer):
 
     def __init__(self, num_nodes, num_features, initial_scale=.01, l2reg_lambda=0.0):
@@ -34,46 +54,69 @@ class Dense(Layer):
         return output_shape
 
     def forward(self, x):
+        x = fit_operand(x, self.weights)
         y = x.dot(self.weights) + self.bias
         self.cache = x
         return y
 
     def backward(self, d_y, learning_rate):
         x = self.cache
+        d_y = fit_operand(d_y, self.weights)
         d_x = d_y.dot(self.weights.transpose())
         d_weights = x.transpose().dot(d_y)
         if self.l2reg_lambda > 0:
             d_weights = d_weights + self.weights * (self.l2reg_lambda / x.shape[0])
 
         d_bias = d_y.sum(axis=0)
-        # update weights and bias
-        self.weights = (d_weights * learning_rate).neg() + self.weights
-        self.bias = (d_bias * learning_rate).neg() + self.bias
+        # update weights and bias in place
+        self.weights -= descent_step(d_weights, learning_rate, self.weights)
+        self.bias -= descent_step(d_bias, learning_rate, self.bias)
 
         return d_x
 
 
-class SigmoidExact(Layer):
+class PolynomialActivation(Layer):
+    """
+    Activation by the polynomial with coefficients `coeffs`, highest degree first as returned by np.polyfit. The
+    powers of the input are computed from as few reveals as its `precision` allows, by default PRECISION_FRACTIONAL
+    fractional digits; pond.tensor.MAX_PRECISION // degree digits take a single reveal but lose accuracy, see
+    PrivateEncodedTensor.powers.
+    """
 
-    def __init__(self):
+    def __init__(self, coeffs, precision=None):
         self.cache = None
+        self.precision = precision
+        self.degree = len(coeffs) - 1
+        self.coeff = NativeTensor(np.asarray(coeffs, dtype=np.float64))
+        self.coeff_der = (self.coeff * NativeTensor(list(range(self.degree + 1))[::-1]))[:-1]
+        assert self.degree > 1
 
     @staticmethod
     def initialize(input_shape, **_):
         return input_shape
 
     def forward(self, x):
-        y = (x.neg().exp() + 1).inv()
-        self.cache = y
+        n_dims = len(x.shape)
+        powers = x.powers(self.degree, self.precision)
+
+        # stack list into tensor
+        forward_powers = stack(powers).flip(axis=n_dims)
+        y = forward_powers.dot(self.coeff[:-1]) + self.coeff[-1]
+
+        # cache all powers except the last
+        self.cache = stack(powers[:-1]).flip(axis=n_dims)
         return y
 
-    def backward(self, d_y, *_):
-        y = self.cache
-        d_x = d_y * y * (y.neg() + 1)
+    def backward(self, d_y, _):
+        # the powers of the forward phase: x^1 ...x^degree-1
+        powers = self.cache
+        c = d_y * self.coeff_der[-1]
+        d_y = d_y.expand_dims(axis=-1)
+        d_x = (d_y * powers).dot(self.coeff_der[:-1]) + c
         return d_x
 
 
-class Sigmoid(Layer):
+class SigmoidExact(Layer):
 
     def __init__(self):
         self.cache = None
@@ -83,29 +126,28 @@ class Sigmoid(Layer):
         return input_shape
 
     def forward(self, x):
-        w0 = 0.5
-        w1 = 0.2159198015
-        w3 = -0.0082176259
-        w5 = 0.0001825597
-        w7 = -0.0000018848
-        w9 = 0.0000000072
-
-        x2 = x * x
-        x3 = x2 * x
-        x5 = x2 * x3
-        x7 = x2 * x5
-        x9 = x2 * x7
-        y = x9 * w9 + x7 * w7 + x5 * w5 + x3 * w3 + x * w1 + w0
-
+        y = (x.neg().exp() + 1).inv()
         self.cache = y
         return y
 
-    def backward(self, d_y, _):
+    def backward(self, d_y, *_):
         y = self.cache
         d_x = d_y * y * (y.neg() + 1)
         return d_x
 
 
+class Sigmoid(PolynomialActivation):
+
+    def __init__(self, precision=None):
+        w0 = 0.5
+        w1 = 0.2159198015
+        w3 = -0.0082176259
+        w5 = 0.0001825597
+        w7 = -0.0000018848
+        w9 = 0.0000000072
+        super().__init__([w9, 0, w7, 0, w5, 0, w3, 0, w1, w0], precision)
+
+
 class SoftmaxStable(Layer):
 
     def __init__(self):
@@ -176,45 +218,13 @@ class ReluExact(Layer):
         return d_x
 
 
-class Relu(Layer):
+class Relu(PolynomialActivation):
 
-    def __init__(self, order=3, domain=(-1, 1), n=1000):
-        self.cache = None
+    def __init__(self, order=3, domain=(-1, 1), n=1000, precision=None):
+        assert order > 2
+        super().__init__(self.compute_coefficients_relu(order, domain, n), precision)
         self.n_coeff = order + 1
         self.order = order
-        self.coeff = NativeTensor(self.compute_coefficients_relu(order, domain, n))
-        self.coeff_der = (self.coeff * NativeTensor(list(range(self.n_coeff))[::-1]))[:-1]
-        self.initializer = None
-        assert order > 2
-
-    @staticmethod
-    def initialize(input_shape, **_):
-        return input_shape
-
-    def forward(self, x):
-        self.initializer = type(x)
-
-        n_dims = len(x.shape)
-
-        powers = [x, x.square()]
-        for i in range(self.order - 2):
-            powers.append(x * powers[-1])
-
-        # stack list into tensor
-        forward_powers = stack(powers).flip(axis=n_dims)
-        y = forward_powers.dot(self.coeff[:-1]) + self.coeff[-1]
-
-        # cache all powers except the last
-        self.cache = stack(powers[:-1]).flip(axis=n_dims)
-        return y
-
-    def backward(self, d_y, _):
-        # the powers of the forward phase: x^1 ...x^order-1
-        powers = self.cache
-        c = d_y * self.coeff_der[-1]
-        d_y.expand_dims(axis=-1)
-        d_x = (d_y * powers).dot(self.coeff_der[:-1]) + c
-        return d_x
 
     @staticmethod
     def compute_coefficients_relu(order, domain, n):
@@ -294,6 +304,7 @@ class Conv2D:
         return [n_x, n_filters, h_out, w_out]
 
     def forward(self, x):
+        x = fit_operand(x, self.filters)
         self.cached_input_shape = x.shape
         self.cache = x
         out, self.cached_x_col = conv2d(x, self.filters, self.strides, self.padding)
@@ -317,8 +328,8 @@ class Conv2D:
         if self.l2reg_lambda > 0:
             d_w = d_w + self.filters * (self.l2reg_lambda / self.cached_input_shape[0])
 
-        self.filters = (d_w * learning_rate).neg() + self.filters
-        self.bias = (d_bias * learning_rate).neg() + self.bias
+        self.filters -= descent_step(d_w, learning_rate, self.filters)
+        self.bias -= descent_step(d_bias, learning_rate, self.bias)
 
         return dx
 
@@ -417,6 +428,7 @@ class ConvAveragePooling2D:
 
     def forward(self, x):
         self.initializer = type(x)
+        x = fit_operand(x, self.filters)
         self.cached_input_shape = x.shape
         self.cache = x
 
@@ -452,8 +464,8 @@ class ConvAveragePooling2D:
         if self.l2reg_lambda > 0:
             d_w = d_w + self.filters * (self.l2reg_lambda / self.cached_input_shape[0])
 
-        self.filters = (d_w * learning_rate).neg() + self.filters
-        self.bias = ((d_bias * learning_rate).neg() + self.bias)
+        self.filters -= descent_step(d_w, learning_rate, self.filters)
+        self.bias -= descent_step(d_bias, learning_rate, self.bias)
 
         return dx
 
@@ -535,6 +547,7 @@ def conv2d(x, y, strides, padding, precomputed=None, save_mask=True):
 
         if isinstance(y, PrivateEncodedTensor):
             if pond.tensor.USE_SPECIALIZED_TRIPLE:
+                x, y = fit_product(x, y)
                 if precomputed is None: precomputed = generate_conv_triple(x.shape, y.shape, strides, padding)
 
                 a, b, a_conv_b, a_col = precomputed
@@ -545,17 +558,14 @@ def conv2d(x, y, strides, padding, precomputed=None, save_mask=True):
                 beta_col = beta.transpose(3, 2, 0, 1).reshape(n_filters, -1)
                 b_col = b.transpose(3, 2, 0, 1).reshape(n_filters, -1)
 
-                alpha_conv_beta = beta_col.dot(alpha_col)
-                alpha_conv_b = b_col.dot(alpha_col)
-                a_conv_beta = beta_col.dot(a_col)
-
-                z = (alpha_conv_beta + alpha_conv_b + a_conv_beta + a_conv_b).reshape(n_filters, h_out, w_out,
-                                                                                      n_x).transpose(3, 0, 1, 2)
+                z = beaver_combine(lambda u, v: field_dot(v, u), alpha_col, beta_col, a_col, b_col, a_conv_b,
+                                   terms=beta_col.shape[1], precision=x.precision + y.precision)
+                z = z.reshape(n_filters, h_out, w_out, n_x).transpose(3, 0, 1, 2)
                 if save_mask:
                     x.mask, x.masked, x.mask_transformed, x.masked_transformed = a, alpha, a_col, alpha_col
                     y.mask, y.masked, y.mask_transformed, y.masked_transformed = b, beta, b_col, beta_col
 
-                return PrivateEncodedTensor.from_shares(z.shares0, z.shares1).truncate(), None
+                return z, None
 
             else:
                 X_col = x.im2col(h_filter, w_filter, padding, strides)
@@ -590,19 +600,19 @@ def conv2d_bw(x, d_y, x_col, filter_shape, padding=None, strides=None):
         if isinstance(d_y, PrivateEncodedTensor):
             if pond.tensor.USE_SPECIALIZED_TRIPLE:
                 if pond.tensor.USE_SPECIALIZED_TRIPLE:
+                    # x was fitted in the forward pass, so this only truncates the gradient and keeps its masks
+                    x, d_y_reshaped = fit_product(x, d_y_reshaped)
                     a, a_col, alpha_col = x.mask, x.mask_transformed, x.masked_transformed
                     a, b, a_convbw_b = generate_convbw_triple(a.shape, d_y_reshaped.shape, shares_a=a,
                                                               shares_a_col=a_col)
                     beta = (d_y_reshaped - b).reveal()
 
-                    alpha_convbw_beta = beta.dot(alpha_col.transpose())
-                    alpha_convbw_b = b.dot(alpha_col.transpose())
-                    a_convbw_beta = beta.dot(a_col.transpose())
-
-                    z = (alpha_convbw_beta + alpha_convbw_b + a_convbw_beta + a_convbw_b).reshape(filter_shape)
-                    return PrivateEncodedTensor.from_shares(z.shares0, z.shares1).truncate()
+                    return beaver_combine(lambda u, v: field_dot(v, u), alpha_col.transpose(), beta, a_col.transpose(), b,
+                                          a_convbw_b, terms=beta.shape[1],
+                                          precision=x.precision + d_y_reshaped.precision).reshape(filter_shape)
 
                 else:
+                    x, d_y_reshaped = fit_product(x, d_y_reshaped)
                     a, b, a_convbw_b = generate_convbw_triple(x.shape, d_y_reshaped.shape)
                     alpha = (x - a).reveal()
                     beta = (d_y_reshaped - b).reveal()
@@ -610,12 +620,9 @@ def conv2d_bw(x, d_y, x_col, filter_shape, padding=None, strides=None):
                     alpha_col = alpha.im2col(h_filter, w_filter, padding, strides)
                     a_col = a.im2col(h_filter, w_filter, padding, strides)
 
-                    alpha_convbw_beta = beta.dot(alpha_col.transpose())
-                    alpha_convbw_b = b.dot(alpha_col.transpose())
-                    a_convbw_beta = beta.dot(a_col.transpose())
-
-                    z = (alpha_convbw_beta + alpha_convbw_b + a_convbw_beta + a_convbw_b).reshape(filter_shape)
-                    return PrivateEncodedTensor.from_shares(z.shares0, z.shares1).truncate()
+                    return beaver_combine(lambda u, v: field_dot(v, u), alpha_col.transpose(), beta, a_col.transpose(), b,
+                                          a_convbw_b, terms=beta.shape[1],
+                                          precision=x.precision + d_y_reshaped.precision).reshape(filter_shape)
             else:
                 dw = d_y_reshaped.dot(x_col.transpose())
                 return dw.reshape(filter_shape)
@@ -647,17 +654,15 @@ def convavgpool_bw(x, d_y, cache, filter_shape, pool_size=None, pool_strides=Non
                                                                           shares_a_col=a_col, shares_b=b,
                                                                           shares_b_expanded=b_expanded)
         if beta_expanded is None:
-            beta = ((d_y / pool_area) - b).reveal()  # divide by pool area before specialized triplet
+            # divide by pool area before specialized triplet
+            beta = ((d_y / pool_area).truncate_() - b).reveal()
             beta_expanded = beta.repeat(pool_size[0], axis=2).repeat(pool_size[1], axis=3).transpose(1, 2, 3, 0) \
                 .reshape(n_filter, -1)
 
-        alpha_conv_pool_bw_beta = beta_expanded.dot(alpha_col.transpose())
-        alpha_conv_pool_bw_b = b_expanded.dot(alpha_col.transpose())
-        a_conv_pool_bw_beta = beta_expanded.dot(a_col.transpose())
-
-        z = (alpha_conv_pool_bw_beta + alpha_conv_pool_bw_b + a_conv_pool_bw_beta + a_conv_pool_bw_b
-             ).reshape(filter_shape)
-        return PrivateEncodedTensor.from_shares(z.shares0, z.shares1).truncate()
+        # beta is always taken from d_y / pool_area truncated to PRECISION_FRACTIONAL, see convavgpool_delta
+        return beaver_combine(lambda u, v: field_dot(v, u), alpha_col.transpose(), beta_expanded, a_col.transpose(),
+                              b_expanded, a_conv_pool_bw_b, terms=beta_expanded.shape[1],
+                              precision=x.precision + pond.tensor.PRECISION_FRACTIONAL).reshape(filter_shape)
 
 
 def convavgpool_delta(d_y, w, cached_input_shape, padding=None, strides=None, pool_size=None, pool_strides=None):
@@ -675,7 +680,7 @@ def convavgpool_delta(d_y, w, cached_input_shape, padding=None, strides=None, po
                            padding=padding, stride=strides)
         return dx
     if isinstance(d_y, PrivateEncodedTensor):
-        assert pond.tensor.use_specialized_triple and pond.tensor.reuse_mask
+        assert pond.tensor.USE_SPECIALIZED_TRIPLE and pond.tensor.REUSE_MASK
         assert pool_size[0] == pool_strides and pool_size[1] == pool_strides
 
         a, alpha = w.mask, w.masked
@@ -684,16 +689,16 @@ def convavgpool_delta(d_y, w, cached_input_shape, padding=None, strides=None, po
 
         a_reshaped = a.reshape(n_filter, -1).transpose()
         alpha_reshaped = alpha.reshape(n_filter, -1).transpose()
-        beta = ((d_y / pool_area) - b).reveal()  # divide by pool area before specialized triplet
+        # divide by pool area before specialized triplet
+        d_y_pooled = (d_y / pool_area).truncate_()
+        w, d_y_pooled = fit_product(w, d_y_pooled)
+        beta = (d_y_pooled - b).reveal()
         beta_expanded = beta.repeat(pool_size[0], axis=2).repeat(pool_size[1], axis=3).transpose(1, 2, 3, 0) \
             .reshape(n_filter, -1)
 
-        alpha_conv_pool_delta_beta = alpha_reshaped.dot(beta_expanded)
-        alpha_conv_pool_delta_b = alpha_reshaped.dot(b_expanded)
-        a_conv_pool_delta_beta = a_reshaped.dot(beta_expanded)
-
-        z = alpha_conv_pool_delta_beta + alpha_conv_pool_delta_b + a_conv_pool_delta_beta + a_conv_pool_delta_b
-        dx_col = PrivateEncodedTensor.from_shares(z.shares0, z.shares1).truncate()
+        dx_col = beaver_combine(field_dot, alpha_reshaped, beta_expanded, a_reshaped, b_expanded,
+                                a_conv_pool_delta_b, terms=alpha_reshaped.shape[1],
+                                precision=w.precision + d_y_pooled.precision)
 
         d_y.mask, d_y.masked, d_y.mask_transformed, d_y.masked_transformed = b, beta, b_expanded, beta_expanded
 
@@ -739,11 +744,14 @@ class Sequential(Model):
     def forward(self, x):
         for layer in self.layers:
             x = layer.forward(x)
+            # operations recorded by lazy tensors are run at the end of every layer
+            if isinstance(x, LazyPrivateEncodedTensor): x.evaluate()
         return x
 
     def backward(self, d_y, learning_rate):
         for layer in reversed(self.layers):
             d_y = layer.backward(d_y, learning_rate)
+            if isinstance(d_y, LazyPrivateEncodedTensor): d_y.evaluate()
 
     @staticmethod
     def print_progress(batch_index, n_batches, batch_size, epoch_start, train_loss=None, train_acc=None,
@@ -769,7 +777,11 @@ class Sequential(Model):
         sys.stdout.flush()
 
     def fit(self, x_train, y_train, x_valid=None, y_valid=None, loss=None, batch_size=32, epochs=1000,
-            learning_rate=.01, verbose=0, eval_n_batches=None):
+            learning_rate=.01, verbose=0, eval_n_batches=None, prefetcher=None):
+        """
+        :param prefetcher: pond.triples.TriplePrefetcher generating the triples of the coming steps in the background,
+            or pond.dealer.ProviderClient fetching them from a crypto provider
+        """
 
         if not isinstance(x_train, DataLoader): x_train = DataLoader(x_train)
         if not isinstance(y_train, DataLoader): y_train = DataLoader(y_train)
@@ -782,50 +794,68 @@ class Sequential(Model):
         if eval_n_batches is None:
             eval_n_batches = n_batches
 
-        for epoch in range(epochs):
-            epoch_start = time.time()
-            if verbose >= 1:
-                print(datetime.now(), "Epoch {}/{}".format(epoch + 1, epochs))
+        source = pond.tensor.TRIPLE_SOURCE
+        if prefetcher is not None: pond.tensor.TRIPLE_SOURCE = prefetcher
 
-            # Create batches on shuffled data
-            shuffle = np.random.permutation(x_train.data.shape[0])
-            batches = zip(x_train.batches(batch_size, shuffle_indices=shuffle),
-                          y_train.batches(batch_size, shuffle_indices=shuffle))
-
-            for batch_index, (x_batch, y_batch) in enumerate(batches):
-                if verbose >= 2:
-                    print(datetime.now(), "Batch %s" % batch_index)
-
-                y_pred = self.forward(x_batch)
-                train_loss = loss.evaluate(y_pred, y_batch).unwrap()[0]
-                acc = np.mean(y_batch.unwrap().argmax(axis=1) == y_pred.unwrap().argmax(axis=1))
-                d_y = loss.derive(y_pred, y_batch)
-                self.backward(d_y, learning_rate)
-
-                # print status
+        try:
+            for epoch in range(epochs):
+                epoch_start = time.time()
                 if verbose >= 1:
-                    if batch_index != 0 and (batch_index + 1) % eval_n_batches == 0:
-                        # validation print
-                        y_pred_val = self.predict(x_valid)
-                        val_loss = np.sum(loss.evaluate(y_pred_val, y_valid.all_data()).unwrap())
-                        val_acc = np.mean(
-                            y_valid.all_data().unwrap().argmax(axis=1) == y_pred_val.unwrap().argmax(axis=1))
-                        self.print_progress(batch_index, n_batches, batch_size, epoch_start, train_acc=acc,
-                                            train_loss=train_loss,
-                                            val_loss=val_loss, val_acc=val_acc)
-                    else:
-                        # normal print
-                        self.print_progress(batch_index, n_batches, batch_size, epoch_start, train_acc=acc,
-                                            train_loss=train_loss)
+                    print(datetime.now(), "Epoch {}/{}".format(epoch + 1, epochs))
+
+                # Create batches on shuffled data
+                shuffle = np.random.permutation(x_train.data.shape[0])
+                batches = zip(x_train.batches(batch_size, shuffle_indices=shuffle),
+                              y_train.batches(batch_size, shuffle_indices=shuffle))
+
+                for batch_index, (x_batch, y_batch) in enumerate(batches):
+                    if verbose >= 2:
+                        print(datetime.now(), "Batch %s" % batch_index)
+                    if prefetcher is not None: prefetcher.step()
+
+                    y_pred = self.forward(x_batch)
+                    train_loss = loss.evaluate(y_pred, y_batch).unwrap()[0]
+                    acc = np.mean(y_batch.unwrap().argmax(axis=1) == y_pred.unwrap().argmax(axis=1))
+                    d_y = loss.derive(y_pred, y_batch)
+                    self.backward(d_y, learning_rate)
+
+                    # print status
+                    if verbose >= 1:
+                        if batch_index != 0 and (batch_index + 1) % eval_n_batches == 0:
+                            # validation print
+                            y_pred_val = self.predict(x_valid)
+                            val_loss = np.sum(loss.evaluate(y_pred_val, y_valid.all_data()).unwrap())
+                            val_acc = np.mean(
+                                y_valid.all_data().unwrap().argmax(axis=1) == y_pred_val.unwrap().argmax(axis=1))
+                            self.print_progress(batch_index, n_batches, batch_size, epoch_start, train_acc=acc,
+                                                train_loss=train_loss,
+                                                val_loss=val_loss, val_acc=val_acc)
+                        else:
+                            # normal print
+                            self.print_progress(batch_index, n_batches, batch_size, epoch_start, train_acc=acc,
+                                                train_loss=train_loss)
+        finally:
+            if prefetcher is not None:
+                prefetcher.close()
+                pond.tensor.TRIPLE_SOURCE = source
 
         # Newline after progressbar.
         print()
 
-    def predict(self, x, batch_size=32, verbose=0):
+    def predict(self, x, batch_size=32, verbose=0, micro_batches=1):
+        """
+        :param micro_batches: number of parts each batch is split into, whose forward passes are interleaved, see
+            pond.tensor.interleave
+        """
         if not isinstance(x, DataLoader): x = DataLoader(x)
         batches = []
         for batch_index, x_batch in enumerate(x.batches(batch_size)):
             if verbose >= 2: print(datetime.now(), "Batch %s" % batch_index)
+            if micro_batches > 1:
+                size = -(-x_batch.shape[0] // micro_batches)
+                parts = [x_batch[start:start + size] for start in range(0, x_batch.shape[0], size)]
+                batches.extend(interleave([lambda part=part: self.forward(part) for part in parts]))
+                continue
             y_batch = self.forward(x_batch)
             batches.append(y_batch)
         return reduce(lambda x_, y: x_.concatenate(y), batches)
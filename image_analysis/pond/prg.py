@@ -0,0 +1,42 @@
+import os
+import hashlib
+import struct
+import numpy as np
+
+SEED_BYTES = 16
+
+
+class PRG:
+    """
+    Counter-based pseudorandom generator: call number i on stream s returns SHAKE-128(seed || s || i), so
+    generators with the same seed but different streams are independent and any call can be recomputed.
+    """
+
+    def __init__(self, seed=None, stream=0):
+        if seed is None:
+            seed = os.urandom(SEED_BYTES)
+        if isinstance(seed, int):
+            seed = seed.to_bytes(SEED_BYTES, 'little')
+        assert len(seed) == SEED_BYTES, seed
+        self.seed = seed
+        self.stream_id = stream
+        self.counter = 0
+
+    def __repr__(self):
+        return "PRG(%s, stream=%d, counter=%d)" % (self.seed.hex(), self.stream_id, self.counter)
+
+    def stream(self, stream):
+        return PRG(self.seed, stream)
+
+    def random_bytes(self, size):
+        block = struct.pack('<QQ', self.stream_id, self.counter)
+        self.counter += 1
+        return hashlib.shake_128(self.seed + block).digest(size)
+
+    def random_words(self, shape):
+        # uniformly random uint64 values, filled in one call
+        size = int(np.prod(shape))
+        return np.frombuffer(bytearray(self.random_bytes(8 * size)), dtype=np.uint64).reshape(shape)
+
+    def new_seed(self):
+        return self.random_bytes(SEED_BYTES)
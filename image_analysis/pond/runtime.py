@@ -0,0 +1,397 @@
+"""
+Two-party runtime: party 0 and party 1 run the same computation, e.g. training the same Sequential, in processes of
+their own. Each process holds only its own shares; those of the other party are AnalyticArrays that keep track of
+the shape and nothing else, and every reveal exchanges the shares of the party with the other over a channel.
+
+Both parties are given the same inputs and the same seed, so that sharing a value gives both the same split, of
+which each keeps its half; this stands in for the owner of an input sharing it. Triples are dealt by a dealer that
+both processes simulate with the same seed, or fetched per party from a pond.dealer.CryptoProvider.
+
+With an AsyncChannel reveals are sent as soon as they are issued and return futures, so that sending and receiving
+overlap with computation; interleave runs independent computations, e.g. the forward passes of micro-batches, such
+that each one computes while the others wait for their reveals.
+"""
+import os
+import socket
+import asyncio
+import threading
+import traceback
+import weakref
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pond.tensor as tensor
+from pond import wire
+from pond.arrays import AnalyticArray, LimbArray
+from pond.dealer import connect
+from pond.prg import PRG
+
+# settings of pond.tensor the parties take over from the process starting them, besides the backend
+SETTINGS = ('SEED_COMPRESSION', 'USE_SPECIALIZED_TRIPLE', 'REUSE_MASK', 'BATCH_REVEALS')
+
+
+class SocketChannel:
+    """
+    Channel between the parties over a connected TCP or Unix socket. A channel is anything with `send(arrays)`,
+    sending a list of share arrays, `recv(like)`, receiving an array for each of `like`, of the same representation
+    and shape, and `release(array)`, giving back an array received once it is no longer used.
+    Arrays are sent from their memory and received into buffers reused by shape, see pond.wire; with
+    `headers=False` they go without headers, each party knowing the shapes of the shares of a reveal from its own.
+    """
+
+    def __init__(self, connection, stream=None, headers=True):
+        self.connection = connection
+        self.stream = connection.makefile('rb') if stream is None else stream
+        if connection.family != socket.AF_UNIX: connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.headers = headers
+        self.buffers = wire.ReceiveBuffers()
+        # bytes of shares sent and received
+        self.sent, self.received = 0, 0
+
+    def send(self, arrays):
+        wire.send_buffers(self.connection, [buffer for array in arrays
+                                            for buffer in wire.pack_buffers(array, self.headers)])
+        self.sent += sum(wire.nbytes(array) for array in arrays)
+
+    def recv(self, like):
+        arrays = [wire.read_array(self.stream, self.buffers, None if self.headers else array) for array in like]
+        self.received += sum(wire.nbytes(array) for array in arrays)
+        return arrays
+
+    def release(self, array):
+        self.buffers.release(array)
+
+    def close(self):
+        self.stream.close()
+        self.connection.close()
+
+
+class AsyncChannel:
+    """
+    SocketChannel driven by an asyncio event loop in a thread of its own. `send` returns at once with a future
+    that is done once the arrays are written, which they are in the background, and `recv` returns futures of the
+    arrays, resolved in the order they arrive. The arrays sent must not change before they are written.
+    """
+
+    asynchronous = True
+
+    def __init__(self, connection, stream=None, headers=True):
+        if connection.family != socket.AF_UNIX: connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if stream is not None: stream.close()
+        connection.setblocking(False)
+        self.connection = connection
+        self.headers = headers
+        self.buffers = wire.ReceiveBuffers()
+        self.sent, self.received = 0, 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.call(self.open()).result()
+
+    def call(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def open(self):
+        # (buffers, future) to write and (like, future) to read, in order
+        self.outgoing = asyncio.Queue()
+        self.expected = asyncio.Queue()
+        self.tasks = [asyncio.ensure_future(self.transmit()), asyncio.ensure_future(self.receive())]
+
+    async def transmit(self):
+        while True:
+            buffers, future = await self.outgoing.get()
+            try:
+                for buffer in buffers: await self.loop.sock_sendall(self.connection, buffer)
+                future.set_result(None)
+            except Exception as error:
+                future.set_exception(error)
+            self.outgoing.task_done()
+
+    async def receive(self):
+        try:
+            while True:
+                like, future = await self.expected.get()
+                array = await wire.read_array_async(self.loop, self.connection, self.buffers,
+                                                    None if self.headers else like)
+                self.received += wire.nbytes(array)
+                future.set_result(array)
+        except Exception as error:
+            future.set_exception(error)
+            while True: (await self.expected.get())[1].set_exception(error)
+
+    def send(self, arrays):
+        buffers = [buffer for array in arrays for buffer in wire.pack_buffers(array, self.headers)]
+        self.sent += sum(wire.nbytes(array) for array in arrays)
+        future = Future()
+        # writes are queued on the loop in the order they are sent
+        self.loop.call_soon_threadsafe(self.outgoing.put_nowait, (buffers, future))
+        return future
+
+    def recv(self, like):
+        futures = [Future() for _ in like]
+        for array, future in zip(like, futures): self.loop.call_soon_threadsafe(self.expected.put_nowait,
+                                                                                (array, future))
+        return futures
+
+    def release(self, array):
+        # called on the loop, see Party.open_async
+        self.buffers.release(array)
+
+    async def shutdown(self):
+        await self.outgoing.join()
+        for task in self.tasks: task.cancel()
+
+    def close(self):
+        self.call(self.shutdown()).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.connection.close()
+
+
+class Interleaving:
+    """
+    Runs functions in threads of which only one runs at a time: whenever the running one waits for a reveal it
+    hands over to the next one that has not finished, in a fixed order. Both parties thus go through the same
+    schedule, whatever arrives when, and each function computes while the others wait.
+    """
+
+    def __init__(self, functions):
+        self.functions = functions
+        self.turns = [threading.Event() for _ in functions]
+        self.finished = [False] * len(functions)
+        self.results = [None] * len(functions)
+        self.errors = [None] * len(functions)
+        self.local = threading.local()
+
+    def run(self):
+        threads = [threading.Thread(target=self.task, args=(index,), daemon=True)
+                   for index in range(len(self.functions))]
+        for thread in threads: thread.start()
+        self.turns[0].set()
+        for thread in threads: thread.join()
+        for error in self.errors:
+            if error is not None: raise error
+        return self.results
+
+    def task(self, index):
+        self.local.index = index
+        self.turns[index].wait()
+        try:
+            self.results[index] = self.functions[index]()
+        except BaseException as error:
+            self.errors[index] = error
+        self.finished[index] = True
+        self.hand_over(index)
+
+    def hand_over(self, index):
+        # let the next function that has not finished run, return whether there is one
+        for step in range(1, len(self.functions)):
+            following = (index + step) % len(self.functions)
+            if not self.finished[following]:
+                self.turns[index].clear()
+                self.turns[following].set()
+                return True
+        return False
+
+    def switch(self):
+        index = getattr(self.local, 'index', None)
+        if index is not None and self.hand_over(index): self.turns[index].wait()
+
+
+class Party:
+    """
+    One of the two parties, set as pond.tensor.RUNTIME in the process running it
+    :param party: 0 or 1
+    :param channel: channel to the other party, e.g. SocketChannel
+    """
+
+    def __init__(self, party, channel):
+        self.party = party
+        self.channel = channel
+        # the triple shares of this party, by the shares of both parties the simulated dealer generated them as
+        self.dealt = weakref.WeakKeyDictionary()
+        self.dealing = False
+        # sending runs next to receiving so that neither party waits for the other to finish sending
+        self.sender = ThreadPoolExecutor(1)
+        self.asynchronous = getattr(channel, 'asynchronous', False)
+        self.interleaving = None
+
+    def localize(self, shares0, shares1):
+        """
+        :return: shares0 and shares1 with the shares of the other party replaced by AnalyticArrays
+        """
+        if self.dealing: return shares0, shares1
+        if self.party == 0: return shares0, AnalyticArray(shares1.shape)
+        return AnalyticArray(shares0.shape), shares1
+
+    def exchange(self, arrays):
+        """
+        Send the arrays of this party and receive those of the other, one round of communication
+        """
+        sending = self.sender.submit(self.channel.send, arrays)
+        received = self.channel.recv(arrays)
+        sending.result()
+        return received
+
+    def own(self, pairs):
+        # pack_array takes object arrays of elements below 2^128, so unreduced shares are reduced first
+        return [pair[self.party] if isinstance(pair[self.party], LimbArray) else pair[self.party] % tensor.Q
+                for pair in pairs]
+
+    def open(self, pairs):
+        if self.asynchronous: return [self.wait(future) for future in self.open_async(pairs)]
+        own = self.own(pairs)
+        opened = []
+        for mine, theirs in zip(own, self.exchange(own)):
+            opened.append(tensor.reconstruct(mine, theirs))
+            self.channel.release(theirs)
+        return opened
+
+    def open_async(self, pairs):
+        """
+        Send the shares of this party of each pair at once, with an asynchronous channel
+        :return: futures of the elements
+        """
+        own = self.own(pairs)
+        sent = self.channel.send(own)
+        opened = []
+        for mine, theirs in zip(own, self.channel.recv(own)):
+            elements = Future()
+            # the elements are there once the share of the other party arrived and this one is no longer read
+            theirs.add_done_callback(lambda theirs, mine=mine, elements=elements: sent.add_done_callback(
+                lambda sent: self.reconstruct(mine, theirs, sent, elements)))
+            opened.append(elements)
+        return opened
+
+    def reconstruct(self, mine, theirs, sent, elements):
+        error = theirs.exception() or sent.exception()
+        if error is not None: return elements.set_exception(error)
+        elements.set_result(tensor.reconstruct(mine, theirs.result()))
+        self.channel.release(theirs.result())
+
+    def wait(self, future):
+        """
+        :return: the result of `future`, letting the other interleaved computations run first
+        """
+        if self.interleaving is not None: self.interleaving.switch()
+        return future.result()
+
+    def interleave(self, functions):
+        """
+        Run the functions interleaved, see Interleaving
+        :return: their results
+        """
+        assert self.interleaving is None, "interleave does not nest"
+        self.interleaving = Interleaving(functions)
+        try:
+            return self.interleaving.run()
+        finally:
+            self.interleaving = None
+
+    def deal(self, kind, generate, params, shares):
+        """
+        Triple of this party: generated by the simulated dealer, or taken from TRIPLE_SOURCE, from the shares of
+        both parties of the given shares, and localized
+        """
+        dealt = tuple((name, None if share is None else self.dealt[share]) for name, share in shares)
+        self.dealing = True
+        try:
+            triple = tensor.take_or_generate(kind, generate, params, dealt)
+        finally:
+            self.dealing = False
+        given = {id(full): share for (_, share), (_, full) in zip(shares, dealt) if share is not None}
+        local = []
+        for full in triple:
+            share = given.get(id(full))
+            if share is None:
+                share = tensor.PrivateFieldTensor.from_shares(*self.localize(full.seed0 or full.expanded0,
+                                                                             full.seed1 or full.expanded1), full.bound)
+            self.dealt[share] = full
+            local.append(share)
+        return tuple(local)
+
+    def derived(self, result, function, sources):
+        # follow the shares of both parties of the sources through function, see pond.tensor.derived
+        if self.dealing: return
+        if all(source in self.dealt for source in sources):
+            self.dealt[result] = function(*(self.dealt[source] for source in sources))
+        else:
+            self.dealt.pop(result, None)
+
+    def close(self):
+        self.sender.shutdown()
+        self.channel.close()
+
+
+def listen(address):
+    if isinstance(address, str):
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(address)
+    else:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(address)
+    listener.listen(1)
+    return listener
+
+
+def run_party(party, address, ready, results, backend, settings, seed, target, args, channel_type):
+    tensor.set_backend(backend)
+    for name, value in settings.items(): setattr(tensor, name, value)
+    tensor.set_seed(seed)
+    if party == 0:
+        listener = listen(address)
+        ready.send(listener.getsockname())
+        connection, _ = listener.accept()
+        listener.close()
+        channel = channel_type(connection)
+    else:
+        channel = channel_type(*connect(address))
+    tensor.RUNTIME = Party(party, channel)
+    try:
+        result = target(*args)
+    except BaseException:
+        results.send((False, traceback.format_exc()))
+        raise
+    finally:
+        tensor.RUNTIME.close()
+    results.send((True, result))
+
+
+def run(target, args=(), address=('127.0.0.1', 0), seed=None, channel=SocketChannel):
+    """
+    Run `target(*args)` as party 0 and as party 1, in two processes with pond.tensor.RUNTIME set to their Party,
+    connected by a socket on `address`: a (host, port) pair for TCP, port 0 picking a free one, or the path of a
+    Unix socket. The processes take over the backend and SETTINGS of this one and are seeded with `seed`;
+    `target` has to seed numpy itself if it draws weights or data from it.
+    :param target: function at the top level of a module, run by both parties
+    :param channel: class of the channel, SocketChannel or AsyncChannel, or a function making one from the connected
+        socket and a stream of it, e.g. functools.partial(AsyncChannel, headers=False)
+    :return: the results of target for party 0 and party 1
+    """
+    if seed is None: seed = PRG().new_seed()
+    settings = {name: getattr(tensor, name) for name in SETTINGS}
+    ready, ready_sender = multiprocessing.Pipe(duplex=False)
+    processes, pipes = [], []
+    for party in (0, 1):
+        pipe, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=run_party, daemon=True, args=(
+            party, address, ready_sender, sender, tensor.BACKEND, settings, seed, target, args, channel))
+        process.start()
+        processes.append(process)
+        pipes.append(pipe)
+        # party 1 connects to wherever party 0 listens
+        if party == 0: address = ready.recv()
+    try:
+        results = []
+        for party, pipe in enumerate(pipes):
+            ok, result = pipe.recv()
+            if not ok: raise RuntimeError("party %d failed:\n%s" % (party, result))
+            results.append(result)
+        return results
+    finally:
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive(): process.terminate()
+        if isinstance(address, str) and os.path.exists(address): os.remove(address)
@@ -1,7 +1,12 @@
-import random
 import numpy as np
+import weakref
+import functools
+import inspect
 from math import log
 from im2col.im2col import im2col_indices, col2im_indices
+from pond import arrays
+from pond.arrays import LimbArray, RNSArray, Ring64Array, AnalyticArray, RNS_MODULI, RNS_MODULUS, RING_MODULUS
+from pond.prg import PRG
 try:
     from im2col.im2col_cython_float import im2col_cython_float, col2im_cython_float
     from im2col.im2col_cython_object import im2col_cython_object, col2im_cython_object
@@ -16,7 +21,11 @@ except ImportError as e:
 
 
 def im2col(x, h_filter, w_filter, padding, strides):
+    if isinstance(x, AnalyticArray): return x.im2col(h_filter, w_filter, padding, strides)
+    if isinstance(x, LimbArray):
+        return x.map(lambda limb: im2col_indices(limb, h_filter, w_filter, padding, strides))
     if use_cython:
+        if not x.flags.writeable: x = x.copy()  # buffer arguments of the cython kernels have to be writeable
         if x.dtype == np.dtype('float64'):
             return im2col_cython_float(x, h_filter, w_filter, padding, strides)
         else:
@@ -26,6 +35,9 @@ def im2col(x, h_filter, w_filter, padding, strides):
 
 
 def col2im(x, imshape, field_height, field_width, padding, stride):
+    if isinstance(x, AnalyticArray): return x.col2im(imshape, field_height, field_width, padding, stride)
+    if isinstance(x, LimbArray):
+        return x.map(lambda limb: col2im_indices(limb, imshape, field_height, field_width, padding, stride))
     if use_cython:
         if x.dtype == np.dtype('float64'):
             return col2im_cython_float(x, imshape[0], imshape[1], imshape[2], imshape[3],
@@ -39,6 +51,9 @@ def col2im(x, imshape, field_height, field_width, padding, stride):
 
 class NativeTensor:
 
+    # make numpy return NotImplemented from its binary operators so that our reflected operators are used
+    __array_ufunc__ = None
+
     def __init__(self, values):
         self.values = values
 
@@ -80,19 +95,26 @@ class NativeTensor:
         return y
 
     def flip(x, axis):
-        x.values = np.flip(x.values, axis)
-        return x
+        return NativeTensor(np.flip(x.values, axis))
 
     def add(x, y):
-        y = NativeTensor.wrap_if_needed(y)
-        if isinstance(y, NativeTensor): return NativeTensor(x.values + y.values)
-        if isinstance(y, PublicEncodedTensor): return PublicEncodedTensor.from_values(x.values).add(y)
-        if isinstance(y, PrivateEncodedTensor): return PublicEncodedTensor.from_values(x.values).add(y)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('add', x, y)(x, y)
+
+    def add_native(x, y):
+        return NativeTensor(x.values + y.values)
+
+    def add_value(x, y):
+        return NativeTensor(x.values + y)
+
+    def add_encoded(x, y):
+        return PublicEncodedTensor.from_values(x.values).add(y)
 
     def __add__(x, y):
         return x.add(y)
 
+    def __radd__(x, y):
+        return x.add(y)
+
     def __iadd__(self, y):
         if isinstance(y, NativeTensor): self.values = self.values + y.values
         elif isinstance(y, PublicEncodedTensor): return PublicEncodedTensor.from_values(self.values).add(y)
@@ -100,6 +122,13 @@ class NativeTensor:
         else: raise TypeError("does not support %s" % (type(y)))
         return self
 
+    def __isub__(self, y):
+        if isinstance(y, NativeTensor): self.values -= y.values
+        elif isinstance(y, PublicEncodedTensor): return PublicEncodedTensor.from_values(self.values).sub(y)
+        elif isinstance(y, PrivateEncodedTensor): return PublicEncodedTensor.from_values(self.values).sub(y)
+        else: raise TypeError("does not support %s" % (type(y)))
+        return self
+
     def add_at(self, indices, y):
         if isinstance(y, NativeTensor):
             np.add.at(self.values, indices, y.values)
@@ -107,37 +136,58 @@ class NativeTensor:
             raise TypeError("%s does not support %s" % (type(self), type(y)))
 
     def sub(x, y):
-        y = NativeTensor.wrap_if_needed(y)
-        if isinstance(y, NativeTensor): return NativeTensor(x.values - y.values)
-        if isinstance(y, PublicEncodedTensor): return PublicEncodedTensor.from_values(x.values).sub(y)
-        if isinstance(y, PrivateEncodedTensor): return PublicEncodedTensor.from_values(x.values).sub(y)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('sub', x, y)(x, y)
+
+    def sub_native(x, y):
+        return NativeTensor(x.values - y.values)
+
+    def sub_value(x, y):
+        return NativeTensor(x.values - y)
+
+    def sub_encoded(x, y):
+        return PublicEncodedTensor.from_values(x.values).sub(y)
 
     def __sub__(x, y):
         return x.sub(y)
 
     def mul(x, y):
-        y = NativeTensor.wrap_if_needed(y)
-        if isinstance(y, NativeTensor): return NativeTensor(x.values * y.values)
-        if isinstance(y, PublicEncodedTensor): return PublicEncodedTensor.from_values(x.values).mul(y)
-        if isinstance(y, PrivateEncodedTensor): return PublicEncodedTensor.from_values(x.values).mul(y)
-        if isinstance(y, float): return NativeTensor(x.values * y)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('mul', x, y)(x, y)
+
+    def mul_native(x, y):
+        return NativeTensor(x.values * y.values)
+
+    def mul_value(x, y):
+        return NativeTensor(x.values * y)
+
+    def mul_encoded(x, y):
+        return PublicEncodedTensor.from_values(x.values).mul(y)
 
     def __mul__(x, y):
         return x.mul(y)
 
+    def __rmul__(x, y):
+        return x.mul(y)
+
     def dot(x, y):
-        y = NativeTensor.wrap_if_needed(y)
-        if isinstance(y, NativeTensor): return NativeTensor(x.values.dot(y.values))
-        if isinstance(y, PublicEncodedTensor): return PublicEncodedTensor.from_values(x.values).dot(y)
-        if isinstance(y, PrivateEncodedTensor): return PublicEncodedTensor.from_values(x.values).dot(y)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('dot', x, y)(x, y)
+
+    def dot_native(x, y):
+        return NativeTensor(x.values.dot(y.values))
+
+    def dot_value(x, y):
+        return NativeTensor(x.values.dot(y))
+
+    def dot_encoded(x, y):
+        return PublicEncodedTensor.from_values(x.values).dot(y)
 
     def div(x, y):
-        y = NativeTensor.wrap_if_needed(y)
-        if isinstance(y, NativeTensor): return NativeTensor(x.values / y.values)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('div', x, y)(x, y)
+
+    def div_native(x, y):
+        return NativeTensor(x.values / y.values)
+
+    def div_value(x, y):
+        return NativeTensor(x.values / y)
 
     def __div__(x, y):
         return x.div(y)
@@ -146,14 +196,22 @@ class NativeTensor:
         return x.div(y)
 
     def __gt__(x, y):
-        y = NativeTensor.wrap_if_needed(y)
-        if isinstance(y, NativeTensor): return NativeTensor(x.values > y.values)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('gt', x, y)(x, y)
+
+    def gt_native(x, y):
+        return NativeTensor(x.values > y.values)
+
+    def gt_value(x, y):
+        return NativeTensor(x.values > y)
 
     def pow(x, y):
-        y = NativeTensor.wrap_if_needed(y)
-        if isinstance(y, NativeTensor): return NativeTensor(x.values ** y.values)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('pow', x, y)(x, y)
+
+    def pow_native(x, y):
+        return NativeTensor(x.values ** y.values)
+
+    def pow_value(x, y):
+        return NativeTensor(x.values ** y)
 
     def __pow__(x, y):
         return x.pow(y)
@@ -161,6 +219,11 @@ class NativeTensor:
     def square(x):
         return NativeTensor(np.power(x.values, 2))
 
+    def powers(x, degree, precision=None):
+        powers = [x]
+        for _ in range(degree - 1): powers.append(powers[-1] * x)
+        return powers
+
     def transpose(x, *axes):
         return NativeTensor(x.values.transpose(*axes))
         
@@ -196,15 +259,13 @@ class NativeTensor:
         return NativeTensor(1. / x.values)
 
     def repeat(self, repeats, axis=None):
-        self.values = np.repeat(self.values, repeats, axis=axis)
-        return self
+        return NativeTensor(np.repeat(self.values, repeats, axis=axis))
 
     def reshape(self, *shape):
         return NativeTensor(self.values.reshape(*shape))
 
     def expand_dims(self, axis=0):
-        self.values = np.expand_dims(self.values, axis=axis)
-        return self
+        return NativeTensor(np.expand_dims(self.values, axis=axis))
 
     def im2col(x, h_filter, w_filter, padding, strides):
         return NativeTensor(im2col(x.values, h_filter, w_filter, padding, strides))
@@ -213,8 +274,29 @@ class NativeTensor:
         return NativeTensor(col2im(x.values, imshape, field_height, field_width, padding, stride))
 
 
-DTYPE = 'object'
-Q = 2657003489534545107915232808830590043
+# Share arrays are either numpy arrays of Python integers ('object'), stacks of int64 residues modulo the
+# primes in pond.arrays.RNS_MODULI ('rns') or uint64 arrays in the ring Z_2^64 ('ring64'); use set_backend to
+# switch. The ring leaves less room so it comes with its own fixed-point precision.
+# Shares are only reduced modulo Q once an operation could push their magnitude past `headroom`; `bound` is the
+# magnitude of reduced shares if it is not Q. RNS residues have to stay within int64, in the ring arithmetic
+# wraps around by itself so there is no headroom but reducing is free.
+# The 'analytic' backend keeps nothing but shapes (pond.arrays.AnalyticArray) to dry-run computations, e.g. to find
+# out which triples and reveals a training step needs, see pond.triples.trace.
+BACKENDS = {
+    'object': dict(array=None, dtype='object', q=2657003489534545107915232808830590043,
+                   headroom=2 ** 256, precision_integral=16, precision_fractional=32),
+    'rns': dict(array=RNSArray, dtype='int64', q=RNS_MODULUS, bound=max(RNS_MODULI), headroom=2 ** 63,
+                precision_integral=16, precision_fractional=32),
+    'ring64': dict(array=Ring64Array, dtype='uint64', q=RING_MODULUS, headroom=RING_MODULUS,
+                   precision_integral=11, precision_fractional=16),
+    'analytic': dict(array=AnalyticArray, dtype='object', q=2657003489534545107915232808830590043,
+                     headroom=2 ** 256, precision_integral=16, precision_fractional=32),
+}
+BACKEND = 'object'
+DTYPE = BACKENDS[BACKEND]['dtype']
+Q = BACKENDS[BACKEND]['q']
+REDUCED_BOUND = BACKENDS[BACKEND].get('bound', Q)
+HEADROOM = BACKENDS[BACKEND]['headroom']
 
 
 # For arbitrary precision integers.
@@ -225,69 +307,241 @@ def log2(x):
 # We need room for summing MAX_SUM values of MAX_DEGREE before during modulus reduction.
 MAX_DEGREE = 2
 MAX_SUM = 2 ** 12
-assert MAX_DEGREE * log2(Q) + log2(MAX_SUM) < 256
+assert MAX_DEGREE * log2(Q) + log2(MAX_SUM) < log2(HEADROOM)
 
 BASE = 2
-PRECISION_INTEGRAL = 16
-PRECISION_FRACTIONAL = 32
-# TODO Gap as needed for local truncating
+PRECISION_INTEGRAL = BACKENDS[BACKEND]['precision_integral']
+PRECISION_FRACTIONAL = BACKENDS[BACKEND]['precision_fractional']
 
-# We need room for double precision before truncating.
-assert PRECISION_INTEGRAL + 2 * PRECISION_FRACTIONAL < log(Q) / log(BASE)
+# Every encoded tensor carries its own number of fractional digits (`precision`, PRECISION_FRACTIONAL unless given).
+# Products add up the precisions of their factors and are not truncated; factors are only truncated once their
+# product would have more than MAX_PRECISION fractional digits.
+MAX_PRECISION = 2 * PRECISION_FRACTIONAL
+
+# Shares are truncated locally, which goes wrong with probability about 2^(PRECISION_INTEGRAL + MAX_PRECISION + 1) / Q,
+# so values of double precision have to leave a gap of TRUNCATION_GAP bits below Q.
+TRUNCATION_GAP = 20
+assert PRECISION_INTEGRAL + MAX_PRECISION + 1 + TRUNCATION_GAP <= log2(Q)
 
 COMMUNICATION_ROUNDS = 0
 COMMUNICATED_VALUES = 0
 USE_SPECIALIZED_TRIPLE = False
 REUSE_MASK = False
+# Defer reveals until one of their results is used, so that independent reveals share a round of communication.
+BATCH_REVEALS = True
+# Represent the first share of freshly shared tensors by the PRG seed it is expanded from, and both shares of the
+# random parts of triples, so that the dealer only sends the second share of their products.
+SEED_COMPRESSION = False
+# Encodings of public constants with at most ENCODING_CACHE_SIZE elements, such as polynomial coefficients, keyed by
+# value, precision and backend; cleared once it holds ENCODING_CACHE_ENTRIES of them.
+ENCODING_CACHE = {}
+ENCODING_CACHE_SIZE = 64
+ENCODING_CACHE_ENTRIES = 1024
+
+# Independent randomness for the dealer generating triples and for each party sharing its inputs.
+PRGS = None
+# Triples generated ahead of time, see pond.triples; None generates every triple when it is needed.
+TRIPLE_SOURCE = None
+# Shapes of the tensors revealed, one list per round of communication, while not None.
+REVEAL_LOG = None
+# pond.runtime.Party of this process if the parties run in processes of their own; None keeps both in this one.
+RUNTIME = None
+
+
+def set_seed(seed=None):
+    """
+    Reseed all randomness used for shares and triples
+    :param seed: int or bytes, None for a random seed
+    """
+    global PRGS
+    prg = PRG(seed)
+    PRGS = {'dealer': prg.stream(0), 0: prg.stream(1), 1: prg.stream(2)}
 
 
-def encode(rationals):
-    return (rationals * BASE ** PRECISION_FRACTIONAL).astype('int').astype(DTYPE) % Q
+set_seed()
 
 
-def decode(elements):
-    map_negative_range = np.vectorize(lambda element: element if element <= Q / 2 else element - Q)
-    return map_negative_range(elements) / BASE ** PRECISION_FRACTIONAL
+def set_backend(backend):
+    """
+    Select the representation and fixed-point precision used for all tensors created from now on
+    :param backend: key of BACKENDS
+    """
+    global BACKEND, DTYPE, Q, REDUCED_BOUND, HEADROOM, PRECISION_INTEGRAL, PRECISION_FRACTIONAL, MAX_PRECISION
+    assert backend in BACKENDS, backend
+    BACKEND = backend
+    DTYPE = BACKENDS[backend]['dtype']
+    Q = BACKENDS[backend]['q']
+    REDUCED_BOUND = BACKENDS[backend].get('bound', Q)
+    HEADROOM = BACKENDS[backend]['headroom']
+    # room for the four terms of a Beaver recombination without reducing in between
+    assert 4 * REDUCED_BOUND ** MAX_DEGREE <= HEADROOM or REDUCED_BOUND == HEADROOM
+    PRECISION_INTEGRAL = BACKENDS[backend]['precision_integral']
+    PRECISION_FRACTIONAL = BACKENDS[backend]['precision_fractional']
+    MAX_PRECISION = 2 * PRECISION_FRACTIONAL
+    assert PRECISION_INTEGRAL + MAX_PRECISION + 1 + TRUNCATION_GAP <= log2(Q)
+
+
+def field_elements(ints):
+    array = BACKENDS[BACKEND]['array']
+    if array is not None: return array.from_ints(ints)
+    return np.asarray(ints).astype(DTYPE) % Q
+
+
+def sample(shape, prg=None):
+    if prg is None: prg = PRGS['dealer']
+    array = BACKENDS[BACKEND]['array']
+    if array is not None: return array.random(shape, prg)
+    # 192 random bits per element, the bias of reducing them modulo Q is negligible
+    if not isinstance(shape, tuple): shape = tuple(shape) if isinstance(shape, list) else (shape,)
+    words = prg.random_words((3,) + shape).astype(DTYPE)
+    return ((words[2] << 128) + (words[1] << 64) + words[0]) % Q
+
+
+def zeros(shape):
+    array = BACKENDS[BACKEND]['array']
+    if array is not None: return array.zeros(shape)
+    return np.zeros(shape, dtype=DTYPE)
+
+
+def field_dot(x, y):
+    # dot product of field element arrays, reduced modulo Q
+    return arrays.dot(x, y, Q)
+
+
+def encode(rationals, precision=None):
+    if precision is None: precision = PRECISION_FRACTIONAL
+    # scaling by a power of two is exact in float64, truncating towards zero matches astype('int')
+    scaled = np.trunc(np.asarray(rationals, dtype=np.float64) * BASE ** precision)
+    array = BACKENDS[BACKEND]['array']
+    if array is not None: return array.from_floats(scaled)
+    mantissa, exponent = arrays.split_float(scaled)
+    elements = mantissa.astype(DTYPE)
+    large = exponent > 0
+    if large.any(): elements[large] = elements[large] << exponent[large].astype(DTYPE)
+    # only touch the elements that need reducing instead of taking every Python integer modulo Q
+    elements[mantissa < 0] += Q
+    if large.any(): elements[large] %= Q
+    return elements
+
+
+def decode(elements, precision=None):
+    if precision is None: precision = PRECISION_FRACTIONAL
+    if isinstance(elements, LimbArray): return elements.signed_float() / BASE ** precision
+    elements = np.asarray(elements)
+    negative = elements > Q // 2
+    signed = elements.copy()
+    signed[negative] -= Q
+    return signed.astype(np.float64) / BASE ** precision
+
+
+def encode_constant(rationals, precision=None):
+    """
+    Encode like `encode`, reusing the encoding of constants that were encoded before
+    :return: elements, read-only if they come from ENCODING_CACHE
+    """
+    if precision is None: precision = PRECISION_FRACTIONAL
+    # scalars are encoded as arrays of one element like in PublicEncodedTensor
+    rationals = np.asarray(rationals, dtype=np.float64).reshape(np.shape(rationals) or (1,))
+    if rationals.size > ENCODING_CACHE_SIZE: return encode(rationals, precision)
+    key = (rationals.tobytes(), rationals.shape, precision, BACKEND)
+    if key not in ENCODING_CACHE:
+        if len(ENCODING_CACHE) >= ENCODING_CACHE_ENTRIES: ENCODING_CACHE.clear()
+        elements = encode(rationals, precision)
+        (elements.limbs if isinstance(elements, LimbArray) else elements).flags.writeable = False
+        ENCODING_CACHE[key] = elements
+    return ENCODING_CACHE[key]
 
 
 def wrap_if_needed(y):
-    if isinstance(y, int) or isinstance(y, float): return PublicEncodedTensor.from_values(np.array([y]))
-    if isinstance(y, np.ndarray): return PublicEncodedTensor.from_values(y)
-    if isinstance(y, NativeTensor): return PublicEncodedTensor.from_values(y.values)
+    if isinstance(y, int) or isinstance(y, float): return PublicEncodedTensor.from_elements(encode_constant(y))
+    if isinstance(y, np.ndarray): return PublicEncodedTensor.from_elements(encode_constant(y))
+    if isinstance(y, NativeTensor): return PublicEncodedTensor.from_elements(encode_constant(y.values))
     return y
 
 
+# kernels of the binary operations, keyed by (operation, type of x, type of y), see dispatch
+KERNELS = {}
+
+
+def dispatch(op, x, y):
+    """
+    Look up the kernel computing `op` on x and y; subclasses use the kernels of their closest registered bases
+    :return: function taking x, y and the remaining arguments of the operation
+    """
+    key = (op, type(x), type(y))
+    if key not in KERNELS:
+        kernels = [KERNELS.get((op, left, right)) for left in type(x).__mro__ for right in type(y).__mro__]
+        kernels = [kernel for kernel in kernels if kernel is not None]
+        if not kernels: raise TypeError("%s does not support %s" % (type(x), type(y)))
+        KERNELS[key] = kernels[0]
+    return KERNELS[key]
+
+
+def encoding(kernel):
+    # kernel for plain values, encoded as a PublicEncodedTensor first
+    return lambda x, y, *args: kernel(x, wrap_if_needed(y), *args)
+
+
+def align_precision(x, y):
+    # scaling up the less precise tensor is exact
+    precision = max(x.precision, y.precision)
+    return x.rescale(precision), y.rescale(precision)
+
+
+def fit_product(x, y):
+    """
+    Truncate the factors of a product, the more precise one first, until the product has at most MAX_PRECISION
+    fractional digits; x and y themselves are left as they are
+    :param x: PublicEncodedTensor or PrivateEncodedTensor
+    :param y: PublicEncodedTensor or PrivateEncodedTensor, possibly x itself
+    :return: x and y, or truncated copies of them
+    """
+    fitted = {id(x): x, id(y): y}
+    for z in sorted([x, y], key=lambda t: t.precision, reverse=True):
+        if fitted[id(x)].precision + fitted[id(y)].precision > MAX_PRECISION and z.precision > PRECISION_FRACTIONAL:
+            fitted[id(z)] = z.truncate()
+    x, y = fitted[id(x)], fitted[id(y)]
+    assert x.precision + y.precision <= MAX_PRECISION, (x.precision, y.precision)
+    return x, y
+
+
 class PublicEncodedTensor:
 
-    def __init__(self, values, elements=None):
+    __array_ufunc__ = None
+
+    def __init__(self, values, elements=None, precision=None):
+        if precision is None: precision = PRECISION_FRACTIONAL
         if values is not None:
             if not isinstance(values, np.ndarray):
                 values = np.array([values])
-            elements = encode(values)
-        assert isinstance(elements, np.ndarray), "%s, %s, %s" % (values, elements, type(elements))
+            elements = encode(values, precision)
+        assert arrays.is_array(elements), "%s, %s, %s" % (values, elements, type(elements))
         self.elements = elements
+        # number of fractional digits of the encoding
+        self.precision = precision
 
     @staticmethod
-    def from_values(values):
-        return PublicEncodedTensor(values)
+    def from_values(values, precision=None):
+        return PublicEncodedTensor(values, precision=precision)
 
     @staticmethod
-    def from_elements(elements):
-        return PublicEncodedTensor(None, elements)
+    def from_elements(elements, precision=None):
+        return PublicEncodedTensor(None, elements, precision)
 
     def __repr__(self):
-        return "PublicEncodedTensor(%s)" % decode(self.elements)
+        return "PublicEncodedTensor(%s)" % decode(self.elements, self.precision)
 
     def __getitem__(self, index):
-        return PublicEncodedTensor.from_elements(self.elements[index])
+        return PublicEncodedTensor.from_elements(self.elements[index], self.precision)
 
     def __setitem__(self, idx, other):
         assert isinstance(other, PublicEncodedTensor)
-        self.elements[idx] = other.elements
+        self.elements[idx] = other.rescale(self.precision).elements
 
     def concatenate(self, other):
         if isinstance(other, PublicEncodedTensor):
-            return PublicEncodedTensor.from_elements(np.concatenate([self.elements, other.elements]))
+            x, y = align_precision(self, other)
+            return PublicEncodedTensor.from_elements(arrays.concatenate([x.elements, y.elements]), x.precision)
         raise TypeError("%s does not support %s" % (type(self), type(other)))
 
     @property
@@ -299,87 +553,138 @@ class PublicEncodedTensor:
         return self.elements.size
 
     def copy(x):
-        return PublicEncodedTensor.from_elements(x.elements.copy())
+        return PublicEncodedTensor.from_elements(x.elements.copy(), x.precision)
 
     def unwrap(self):
-        return decode(self.elements)
+        return decode(self.elements, self.precision)
 
     def reveal(self):
-        return NativeTensor.from_values(decode(self.elements))
+        return NativeTensor.from_values(decode(self.elements, self.precision))
 
-    def truncate(self, amount=PRECISION_FRACTIONAL):
+    def truncate(self, amount=None):
+        """
+        :param amount: number of fractional digits to drop, by default all beyond PRECISION_FRACTIONAL
+        """
+        if amount is None: amount = self.precision - PRECISION_FRACTIONAL
         positive_numbers = (self.elements <= Q // 2).astype(int)
         elements = self.elements
         elements = (Q + (2 * positive_numbers - 1) * elements) % Q  # x if x <= Q//2 else Q - x
-        elements = np.floor_divide(elements, BASE ** amount)        # x // BASE**amount
+        elements = elements // BASE ** amount                       # x // BASE**amount
         elements = (Q + (2 * positive_numbers - 1) * elements) % Q  # x if x <= Q//2 else Q - x
-        return PublicEncodedTensor.from_elements(elements.astype(DTYPE))
+        return PublicEncodedTensor.from_elements(elements, self.precision - amount)
+
+    def truncate_(self):
+        """
+        Truncate in place down to PRECISION_FRACTIONAL fractional digits if there are more
+        :return: self
+        """
+        if self.precision > PRECISION_FRACTIONAL:
+            truncated = self.truncate()
+            self.elements, self.precision = truncated.elements, truncated.precision
+        return self
+
+    def rescale(self, precision):
+        if precision < self.precision: return self.truncate(self.precision - precision)
+        if precision == self.precision: return self
+        return PublicEncodedTensor.from_elements((self.elements * BASE ** (precision - self.precision)) % Q,
+                                                 precision)
 
     def flip(x, axis):
-        x.elements = np.flip(x.elements, axis)
-        return x
+        return PublicEncodedTensor.from_elements(arrays.flip(x.elements, axis), x.precision)
 
     def add(x, y):
-        y = wrap_if_needed(y)
-        if isinstance(y, PublicEncodedTensor):
-            return PublicEncodedTensor.from_elements((x.elements + y.elements) % Q)
-        if isinstance(y, PrivateEncodedTensor):
-            shares0 = (x.elements + y.shares0) % Q
-            shares1 = y.shares1
-            return PrivateEncodedTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('add', x, y)(x, y)
+
+    def add_public(x, y):
+        x, y = align_precision(x, y)
+        return PublicEncodedTensor.from_elements((x.elements + y.elements) % Q, x.precision)
+
+    def add_private(x, y):
+        x, y = align_precision(x, y)
+        if y.bound + REDUCED_BOUND > HEADROOM: y.reduce()
+        shares0 = x.elements + y.shares0
+        shares1 = arrays.broadcast_to(y.shares1, shares0.shape)
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=y.bound + REDUCED_BOUND,
+                                                precision=x.precision)
 
     def __add__(x, y):
         return x.add(y)
 
+    def __radd__(x, y):
+        return x.add(y)
+
     def sub(x, y):
-        y = wrap_if_needed(y)
-        if isinstance(y, PublicEncodedTensor): return PublicEncodedTensor.from_elements((x.elements - y.elements) % Q)
-        if isinstance(y, PrivateEncodedTensor): return x.add(y.neg())  # TODO there might be a more efficient way
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('sub', x, y)(x, y)
+
+    def sub_public(x, y):
+        x, y = align_precision(x, y)
+        return PublicEncodedTensor.from_elements((x.elements - y.elements) % Q, x.precision)
+
+    def sub_private(x, y):
+        return x.add(y.neg())  # TODO there might be a more efficient way
 
     def __sub__(x, y):
         return x.sub(y)
 
     def __gt__(x, y):
-        y = wrap_if_needed(y)
-        if isinstance(y, PublicEncodedTensor):
-            return PublicEncodedTensor.from_values((x.elements - y.elements) % Q <= 0.5 * Q)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('gt', x, y)(x, y)
+
+    def gt_public(x, y):
+        x, y = align_precision(x, y)
+        return PublicEncodedTensor.from_values((x.elements - y.elements) % Q <= 0.5 * Q)
 
     def mul(x, y):
-        y = wrap_if_needed(y)
-        if isinstance(y, PublicFieldTensor):
-            return PublicFieldTensor.from_elements((x.elements * y.elements) % Q)
-        if isinstance(y, PublicEncodedTensor):
-            return PublicEncodedTensor.from_elements((x.elements * y.elements) % Q).truncate()
-        if isinstance(y, PrivateEncodedTensor):
-            shares0 = (x.elements * y.shares0) % Q
-            shares1 = (x.elements * y.shares1) % Q
-            return PrivateEncodedTensor.from_shares(shares0, shares1).truncate()
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('mul', x, y)(x, y)
+
+    def mul_field(x, y):
+        return PublicFieldTensor.from_elements((x.elements * y.elements) % Q)
+
+    def mul_public(x, y):
+        x, y = fit_product(x, y)
+        return PublicEncodedTensor.from_elements((x.elements * y.elements) % Q, x.precision + y.precision)
+
+    def mul_private(x, y):
+        x, y = fit_product(x, y)
+        if y.bound * REDUCED_BOUND > HEADROOM: y.reduce()
+        shares0 = x.elements * y.shares0
+        shares1 = x.elements * y.shares1
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=y.bound * REDUCED_BOUND,
+                                                precision=x.precision + y.precision)
 
     def __mul__(x, y):
         return x.mul(y)
 
+    def __rmul__(x, y):
+        return x.mul(y)
+
     def square(x):
-        return PublicEncodedTensor.from_elements(np.power(x.elements, 2) % Q).truncate()
+        x, _ = fit_product(x, x)
+        return PublicEncodedTensor.from_elements((x.elements * x.elements) % Q, 2 * x.precision)
+
+    def powers(x, degree, precision=None):
+        powers = [x]
+        for _ in range(degree - 1): powers.append(powers[-1] * x)
+        return powers
 
     def dot(x, y):
-        y = wrap_if_needed(y)
-        if isinstance(y, PublicEncodedTensor): return PublicEncodedTensor.from_elements(
-            x.elements.dot(y.elements) % Q).truncate()
-        if isinstance(y, PrivateEncodedTensor):
-            shares0 = x.elements.dot(y.shares0) % Q
-            shares1 = x.elements.dot(y.shares1) % Q
-            return PrivateEncodedTensor.from_shares(shares0, shares1).truncate()
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('dot', x, y)(x, y)
+
+    def dot_public(x, y):
+        x, y = fit_product(x, y)
+        return PublicEncodedTensor.from_elements(field_dot(x.elements, y.elements), x.precision + y.precision)
+
+    def dot_private(x, y):
+        x, y = fit_product(x, y)
+        y.reduce()
+        shares0 = field_dot(x.elements, y.shares0)
+        shares1 = field_dot(x.elements, y.shares1)
+        return PrivateEncodedTensor.from_shares(shares0, shares1, precision=x.precision + y.precision)
 
     def div(x, y):
-        y = wrap_if_needed(y)
-        if isinstance(y, NativeTensor): return x.mul(y.inv())
-        if isinstance(y, PublicEncodedTensor): return x.mul(y.inv())
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('div', x, y)(x, y)
+
+    def div_public(x, y):
+        return x.mul(y.inv())
 
     def __div__(x, y):
         return x.div(y)
@@ -388,37 +693,37 @@ class PublicEncodedTensor:
         return x.div(y)
 
     def transpose(x, *axes):
-        return PublicEncodedTensor.from_elements(x.elements.transpose(*axes))
+        return PublicEncodedTensor.from_elements(x.elements.transpose(*axes), x.precision)
 
     def sum(x, axis=None, keepdims=False):
-        return PublicEncodedTensor.from_elements(x.elements.sum(axis=axis, keepdims=keepdims))
+        return PublicEncodedTensor.from_elements(x.elements.sum(axis=axis, keepdims=keepdims) % Q,
+                                               x.precision)
 
     def argmax(x, axis):
-        return PublicEncodedTensor.from_values(decode(x.elements).argmax(axis=axis))
+        return PublicEncodedTensor.from_values(decode(x.elements, x.precision).argmax(axis=axis))
 
     def neg(x):
-        return PublicEncodedTensor.from_values(decode(x.elements) * -1)
+        return PublicEncodedTensor.from_values(decode(x.elements, x.precision) * -1, x.precision)
 
     def inv(x):
-        return PublicEncodedTensor.from_values(1. / decode(x.elements))
+        return PublicEncodedTensor.from_values(1. / decode(x.elements, x.precision))
 
     def repeat(self, repeats, axis=None):
-        self.elements = np.repeat(self.elements, repeats, axis=axis)
-        return self
+        return PublicEncodedTensor.from_elements(self.elements.repeat(repeats, axis=axis), self.precision)
 
     def reshape(self, *shape):
-        return PublicEncodedTensor.from_elements(self.elements.reshape(*shape))
+        return PublicEncodedTensor.from_elements(self.elements.reshape(*shape), self.precision)
 
     def expand_dims(self, axis=0):
-        self.elements = np.expand_dims(self.elements, axis=axis)
-        return self
+        return PublicEncodedTensor.from_elements(arrays.expand_dims(self.elements, axis), self.precision)
 
     def im2col(x, h_filter, w_filter, padding, strides):
-        return PublicEncodedTensor.from_elements(im2col(x.elements, h_filter, w_filter, padding, strides))
+        return PublicEncodedTensor.from_elements(im2col(x.elements, h_filter, w_filter, padding, strides),
+                                                 x.precision)
 
     def col2im(x, imshape, field_height, field_width, padding, stride):
         return PublicEncodedTensor.from_elements(
-            col2im(x.elements, imshape, field_height, field_width, padding, stride))
+            col2im(x.elements, imshape, field_height, field_width, padding, stride), x.precision)
 
 
 
@@ -445,8 +750,7 @@ class PublicFieldTensor:
         return PublicFieldTensor.from_elements(self.elements.copy())
 
     def flip(x, axis):
-        x.elements = np.flip(x.elements, axis)
-        return x
+        return PublicFieldTensor.from_elements(arrays.flip(x.elements, axis))
 
     @property
     def size(self):
@@ -457,41 +761,49 @@ class PublicFieldTensor:
         return self.elements.shape
 
     def add(x, y):
-        if isinstance(y, PublicFieldTensor):
-            return PublicFieldTensor.from_elements((x.elements + y.elements) % Q)
-        if isinstance(y, PrivateFieldTensor):
-            shares0 = (x.elements + y.shares0) % Q
-            shares1 = y.shares1
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('add', x, y)(x, y)
+
+    def add_public(x, y):
+        return PublicFieldTensor.from_elements((x.elements + y.elements) % Q)
+
+    def add_private(x, y):
+        if y.bound + REDUCED_BOUND > HEADROOM: y.reduce()
+        shares0 = x.elements + y.shares0
+        shares1 = arrays.broadcast_to(y.shares1, shares0.shape)
+        return PrivateFieldTensor.from_shares(shares0, shares1, bound=y.bound + REDUCED_BOUND)
 
     def __add__(x, y):
         return x.add(y)
 
     def mul(x, y):
-        if isinstance(y, PublicFieldTensor):
-            return PublicFieldTensor.from_elements((x.elements * y.elements) % Q)
-        if isinstance(y, PrivateFieldTensor):
-            shares0 = (x.elements * y.shares0) % Q
-            shares1 = (x.elements * y.shares1) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('mul', x, y)(x, y)
+
+    def mul_public(x, y):
+        return PublicFieldTensor.from_elements((x.elements * y.elements) % Q)
+
+    def mul_private(x, y):
+        if y.bound * REDUCED_BOUND > HEADROOM: y.reduce()
+        shares0 = x.elements * y.shares0
+        shares1 = x.elements * y.shares1
+        return PrivateFieldTensor.from_shares(shares0, shares1, bound=y.bound * REDUCED_BOUND)
 
     def __mul__(x, y):
         return x.mul(y)
 
     def dot(x, y):
-        if isinstance(y, PublicFieldTensor):
-            return PublicFieldTensor.from_elements((x.elements.dot(y.elements)) % Q)
-        if isinstance(y, PrivateFieldTensor):
-            shares0 = (x.elements.dot(y.shares0)) % Q
-            shares1 = (x.elements.dot(y.shares1)) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('dot', x, y)(x, y)
+
+    def dot_public(x, y):
+        return PublicFieldTensor.from_elements(field_dot(x.elements, y.elements))
+
+    def dot_private(x, y):
+        y.reduce()
+        shares0 = field_dot(x.elements, y.shares0)
+        shares1 = field_dot(x.elements, y.shares1)
+        return PrivateFieldTensor.from_shares(shares0, shares1)
 
     def expand_dims(x, axis):
-        x.elements = np.expand_dims(x.elements, axis=axis)
-        return x
+        return PublicFieldTensor.from_elements(arrays.expand_dims(x.elements, axis))
 
     def transpose(x, *axes):
         return PublicFieldTensor.from_elements(x.elements.transpose(*axes))
@@ -506,13 +818,51 @@ class PublicFieldTensor:
         return PublicFieldTensor.from_elements(col2im(x.elements, imshape, field_height, field_width, padding, stride))
 
     def repeat(self, repeats, axis=None):
-        self.elements = np.repeat(self.elements, repeats, axis=axis)
-        return self
+        return PublicFieldTensor.from_elements(self.elements.repeat(repeats, axis=axis))
+
+
+def rearrange(elements, op, args):
+    # im2col, or an array method that only moves elements around such as reshape, transpose and repeat
+    if op == 'im2col': return im2col(elements, *args)
+    return getattr(elements, op)(*args)
+
+
+class SeededElements:
+    """
+    Share given by a PRG seed; the party holding it expands it locally so only the other share is materialized.
+    `ops` are rearrangements (see rearrange) applied to the sampled elements, so that e.g. the im2col of a seeded
+    share is still given by its seed.
+    """
+
+    def __init__(self, seed, shape, ops=()):
+        self.seed = seed
+        self.sample_shape = tuple(shape)
+        self.ops = tuple(ops)
+        array = AnalyticArray(self.sample_shape)
+        for op, args in self.ops: array = rearrange(array, op, args)
+        self.shape = array.shape
+
+    def __repr__(self):
+        return "SeededElements(%s, %s, %s)" % (self.seed.hex(), self.sample_shape, self.ops)
+
+    def expand(self):
+        elements = sample(self.sample_shape, PRG(self.seed))
+        for op, args in self.ops: elements = rearrange(elements, op, args)
+        return elements
+
+    def derive(self, op, *args):
+        return SeededElements(self.seed, self.sample_shape, self.ops + ((op, args),))
 
 
-def share(elements):
-    shares0 = np.array([random.randrange(Q) for _ in range(elements.size)]).astype(DTYPE).reshape(elements.shape)
-    shares1 = ((elements - shares0) % Q).astype(DTYPE)
+def share(elements, party=0):
+    prg = PRGS[party]
+    if SEED_COMPRESSION:
+        shares0 = SeededElements(prg.new_seed(), elements.shape)
+        shares1 = (elements - shares0.expand()) % Q
+    else:
+        shares0 = sample(elements.shape, prg)
+        shares1 = (elements - shares0) % Q
+    if RUNTIME is not None: return RUNTIME.localize(shares0, shares1)
     return shares0, shares1
 
 
@@ -520,115 +870,247 @@ def reconstruct(shares0, shares1):
     return (shares0 + shares1) % Q
 
 
+def derived(result, function, *sources):
+    """
+    Tell the RUNTIME that the PrivateFieldTensor `result` is function(*sources), so that the dealer can still deal
+    triples for masks that were transformed before being reused
+    :return: result
+    """
+    if RUNTIME is not None: RUNTIME.derived(result, function, sources)
+    return result
+
+
+def open_shares(pairs):
+    """
+    :param pairs: (shares0, shares1) of each tensor to reveal
+    :return: the elements of each, exchanged with the other party if there is a RUNTIME
+    """
+    if RUNTIME is None: return [reconstruct(shares0, shares1) for shares0, shares1 in pairs]
+    return RUNTIME.open(pairs)
+
+
+def interleave(functions):
+    """
+    Run independent computations, e.g. on different samples, so that each computes while the others wait for
+    their reveals if the RUNTIME is asynchronous, and one after the other otherwise
+    :return: the results of the functions
+    """
+    if RUNTIME is not None and RUNTIME.asynchronous: return RUNTIME.interleave(functions)
+    return [function() for function in functions]
+
+
+# (PrivateFieldTensor, PendingPublicFieldTensor) of every reveal that has not been sent yet
+PENDING_REVEALS = []
+
+
+def flush_reveals():
+    """
+    Send all pending reveals together as one round of communication
+    """
+    global PENDING_REVEALS, COMMUNICATION_ROUNDS, COMMUNICATED_VALUES
+    pending, PENDING_REVEALS = PENDING_REVEALS, []
+    if not pending: return
+    COMMUNICATION_ROUNDS += 1
+    if REVEAL_LOG is not None: REVEAL_LOG.append([private.shape for private, _ in pending])
+    for private, _ in pending: COMMUNICATED_VALUES += np.prod(private.shape)
+    # with an asynchronous runtime the reveals were sent when they were issued
+    unsent = [(private, public) for private, public in pending if 'future' not in public.__dict__]
+    opened = open_shares([(private.shares0, private.shares1) for private, _ in unsent])
+    for (_, public), elements in zip(unsent, opened):
+        public.elements = elements
+
+
+class PendingPublicFieldTensor(PublicFieldTensor):
+    """
+    Result of a reveal that is only sent once the elements of this or any other pending reveal are needed. Every
+    reveal that an operation depends on has been used, and therefore sent, before the operation can issue its own
+    reveals, so everything that is pending at once is independent.
+    """
+
+    def __init__(self, shape):
+        self.pending_shape = tuple(shape)
+
+    def __getattr__(self, name):
+        if name != 'elements': raise AttributeError(name)
+        flush_reveals()
+        if 'elements' not in self.__dict__: self.elements = RUNTIME.wait(self.future)
+        return self.__dict__['elements']
+
+    def in_flight(self):
+        # whether the reveal was sent asynchronously and its elements have not been waited for yet; unlike whether
+        # they arrived, this is the same for both parties
+        return 'future' in self.__dict__ and 'elements' not in self.__dict__
+
+    @property
+    def shape(self):
+        return self.pending_shape
+
+
 class PrivateFieldTensor:
 
-    def __init__(self, elements, shares0=None, shares1=None):
+    def __init__(self, elements, shares0=None, shares1=None, bound=None):
         if elements is not None:
             shares0, shares1 = share(elements)
-        assert isinstance(shares0, np.ndarray), "%s, %s, %s" % (elements, shares0, type(shares0))
-        assert isinstance(shares1, np.ndarray), "%s, %s, %s" % (elements, shares1, type(shares1))
+        assert arrays.is_array(shares0) or isinstance(shares0, SeededElements), \
+            "%s, %s, %s" % (elements, shares0, type(shares0))
+        assert arrays.is_array(shares1) or isinstance(shares1, SeededElements), \
+            "%s, %s, %s" % (elements, shares1, type(shares1))
         assert shares0.shape == shares1.shape
         self.shares0 = shares0
         self.shares1 = shares1
+        # upper bound on the magnitude of both shares, see reduce
+        self.bound = REDUCED_BOUND if bound is None else bound
+
+    @property
+    def shares0(self):
+        if self.expanded0 is None: self.expanded0 = self.seed0.expand()
+        return self.expanded0
+
+    @shares0.setter
+    def shares0(self, shares0):
+        if isinstance(shares0, SeededElements):
+            self.seed0, self.expanded0 = shares0, None
+        else:
+            self.seed0, self.expanded0 = None, shares0
+
+    # the second share of triples can be seeded as well, see sample_shared
+    @property
+    def shares1(self):
+        if self.expanded1 is None: self.expanded1 = self.seed1.expand()
+        return self.expanded1
+
+    @shares1.setter
+    def shares1(self, shares1):
+        if isinstance(shares1, SeededElements):
+            self.seed1, self.expanded1 = shares1, None
+        else:
+            self.seed1, self.expanded1 = None, shares1
 
     @staticmethod
     def from_elements(elements):
         return PrivateFieldTensor(elements)
 
     @staticmethod
-    def from_shares(shares0, shares1):
-        return PrivateFieldTensor(None, shares0, shares1)
+    def from_shares(shares0, shares1, bound=None):
+        return PrivateFieldTensor(None, shares0, shares1, bound)
+
+    def reduce(self):
+        """
+        Reduce the shares modulo Q in place if they are not already
+        :return: self
+        """
+        if self.bound > REDUCED_BOUND:
+            self.shares0 = self.shares0 % Q
+            self.shares1 = self.shares1 % Q
+            self.bound = REDUCED_BOUND
+        return self
 
     def reveal(self, count_communication=True):
-        if count_communication:
-            global COMMUNICATION_ROUNDS, COMMUNICATED_VALUES
-            COMMUNICATION_ROUNDS += 1
-            COMMUNICATED_VALUES += np.prod(self.shape)
-        return PublicFieldTensor.from_elements(reconstruct(self.shares0, self.shares1))
+        if 2 * self.bound > HEADROOM: self.reduce()
+        if not count_communication: return PublicFieldTensor.from_elements(reconstruct(self.shares0, self.shares1))
+        result = PendingPublicFieldTensor(self.shape)
+        if RUNTIME is not None and RUNTIME.asynchronous:
+            result.future, = RUNTIME.open_async([(self.shares0, self.shares1)])
+        PENDING_REVEALS.append((self, result))
+        if not BATCH_REVEALS: flush_reveals()
+        return result
 
     def __repr__(self):
         return "PrivateFieldTensor(%s)" % self.reveal().elements
 
     def __getitem__(self, index):
-        return PrivateFieldTensor.from_shares(self.shares0[index], self.shares1[index])
+        return self.view(lambda shares: shares[index])
 
     def __setitem__(self, idx, other):
         if isinstance(other, PrivateFieldTensor):
+            if not arrays.writeable(self.shares1): self.shares1 = self.shares1.copy()  # broadcast view
             self.shares0[idx] = other.shares0
             self.shares1[idx] = other.shares1
+            self.bound = max(self.bound, other.bound)
+            derived(self, lambda x, y: x.__setitem__(idx, y) or x, self, other)
         else:
             raise TypeError("%s does not support %s" % (type(self), type(other)))
 
     def copy(self):
-        return PrivateFieldTensor.from_shares(self.shares0.copy(), self.shares1.copy())
+        shares0 = self.seed0 if self.expanded0 is None else self.expanded0.copy()
+        shares1 = self.seed1 if self.expanded1 is None else self.expanded1.copy()
+        return derived(PrivateFieldTensor.from_shares(shares0, shares1, self.bound), lambda x: x.copy(), self)
+
+    def view(x, function):
+        """
+        :param function: shape manipulation on share arrays, e.g. lambda shares: shares.reshape(2, -1)
+        :return: PrivateFieldTensor with `function` applied to both shares
+        """
+        result = PrivateFieldTensor.from_shares(function(x.shares0), function(x.shares1), x.bound)
+        return derived(result, lambda y: y.view(function), x)
 
     @property
     def size(self):
-        return self.shares0.size
+        return int(np.prod(self.shape))
 
     @property
     def shape(self):
-        return self.shares0.shape
+        return self.seed1.shape if self.expanded1 is None else self.expanded1.shape
 
     def flip(x, axis):
-        x.shares0 = np.flip(x.shares0, axis)
-        x.shares1 = np.flip(x.shares1, axis)
-        return x
+        return x.view(lambda shares: arrays.flip(shares, axis))
 
     def add(x, y):
-        if isinstance(y, PrivateFieldTensor):
-            shares0 = (x.shares0 + y.shares0) % Q
-            shares1 = (x.shares1 + y.shares1) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        if isinstance(y, PublicFieldTensor):
-            shares0 = (x.shares0 + y.elements) % Q
-            shares1 = x.shares1
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        if isinstance(y, PrivateEncodedTensor):
-            shares0 = (x.shares0 + y.shares0) % Q
-            shares1 = (x.shares1 + y.shares1) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('add', x, y)(x, y)
+
+    def add_private(x, y):
+        if x.bound + y.bound > HEADROOM: x.reduce(), y.reduce()
+        shares0 = x.shares0 + y.shares0
+        shares1 = x.shares1 + y.shares1
+        return PrivateFieldTensor.from_shares(shares0, shares1, bound=x.bound + y.bound)
+
+    def add_public(x, y):
+        if x.bound + REDUCED_BOUND > HEADROOM: x.reduce()
+        shares0 = x.shares0 + y.elements
+        shares1 = arrays.broadcast_to(x.shares1, shares0.shape)
+        return PrivateFieldTensor.from_shares(shares0, shares1, bound=x.bound + REDUCED_BOUND)
 
     def __add__(x, y):
         return x.add(y)
 
     def mul(x, y):
-        if isinstance(y, PublicFieldTensor):
-            shares0 = (x.shares0 * y.elements) % Q
-            shares1 = (x.shares1 * y.elements) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('mul', x, y)(x, y)
+
+    def mul_public(x, y):
+        if x.bound * REDUCED_BOUND > HEADROOM: x.reduce()
+        shares0 = x.shares0 * y.elements
+        shares1 = x.shares1 * y.elements
+        return PrivateFieldTensor.from_shares(shares0, shares1, bound=x.bound * REDUCED_BOUND)
 
     def __mul__(x, y):
         return x.mul(y)
 
     def dot(x, y):
-        if isinstance(y, PublicFieldTensor):
-            shares0 = (x.shares0.dot(y.elements)) % Q
-            shares1 = (x.shares1.dot(y.elements)) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        if isinstance(y, PrivateFieldTensor):
-            shares0 = (x.shares0.dot(y.shares0)) % Q
-            shares1 = (x.shares1.dot(y.shares1)) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('dot', x, y)(x, y)
+
+    def dot_public(x, y):
+        x.reduce()
+        shares0 = field_dot(x.shares0, y.elements)
+        shares1 = field_dot(x.shares1, y.elements)
+        return PrivateFieldTensor.from_shares(shares0, shares1)
+
+    def dot_private(x, y):
+        x.reduce(), y.reduce()
+        shares0 = field_dot(x.shares0, y.shares0)
+        shares1 = field_dot(x.shares1, y.shares1)
+        return PrivateFieldTensor.from_shares(shares0, shares1)
 
     def repeat(x, repeats, axis):
-        x.shares0 = np.repeat(x.shares0, repeats, axis=axis)
-        x.shares1 = np.repeat(x.shares1, repeats, axis=axis)
-        return x
+        return x.view(lambda shares: shares.repeat(repeats, axis=axis))
 
     def expand_dims(x, axis):
-        x.shares0 = np.expand_dims(x.shares0, axis=axis)
-        x.shares1 = np.expand_dims(x.shares1, axis=axis)
-        return x
+        return x.view(lambda shares: arrays.expand_dims(shares, axis))
 
     def transpose(x, *axes):
-        return PrivateFieldTensor.from_shares(x.shares0.transpose(*axes), x.shares1.transpose(*axes))
+        return x.view(lambda shares: shares.transpose(*axes))
 
     def reshape(self, *shape):
-        return PrivateFieldTensor.from_shares(self.shares0.reshape(*shape), self.shares1.reshape(*shape))
+        return self.view(lambda shares: shares.reshape(*shape))
 
     def conv2d(x, y, strides, padding):
         if isinstance(y, PublicFieldTensor):
@@ -650,71 +1132,150 @@ class PrivateFieldTensor:
         raise TypeError("%s does not support %s" % (type(x), type(y)))
 
     def im2col(x, h_filter, w_filter, padding, strides):
-        shares0 = im2col(x.shares0, h_filter, w_filter, padding, strides)
-        shares1 = im2col(x.shares1, h_filter, w_filter, padding, strides)
-        return PrivateFieldTensor.from_shares(shares0, shares1)
+        return x.view(lambda shares: im2col(shares, h_filter, w_filter, padding, strides))
 
     def col2im(x, imshape, field_height, field_width, padding, stride):
+        # overlapping patches are summed up
+        if x.bound * field_height * field_width > HEADROOM: x.reduce()
         shares0 = col2im(x.shares0, imshape, field_height, field_width, padding, stride)
         shares1 = col2im(x.shares1, imshape, field_height, field_width, padding, stride)
-        return PrivateFieldTensor.from_shares(shares0, shares1)
+        return PrivateFieldTensor.from_shares(shares0, shares1, x.bound * field_height * field_width)
+
+    def derive(x, op, *args):
+        """
+        Rearrange both shares by `op` (see rearrange), keeping shares given by a seed as seeds
+        """
+        shares = [rearrange(expanded, op, args) if seed is None else seed.derive(op, *args)
+                  for seed, expanded in ((x.seed0, x.expanded0), (x.seed1, x.expanded1))]
+        return PrivateFieldTensor.from_shares(shares[0], shares[1], x.bound)
+
+
+# generator functions by kind of triple, undecorated
+TRIPLE_GENERATORS = {}
 
 
+def triple(kind):
+    """
+    Decorator for the triple generators: serve triples from TRIPLE_SOURCE if it has one for the same parameters and
+    given shares, and tell it about the triples generated otherwise. Arguments named shares_* are the given shares,
+    all others are the parameters.
+    """
+    def decorator(generate):
+        signature = inspect.signature(generate)
+        TRIPLE_GENERATORS[kind] = generate
+
+        @functools.wraps(generate)
+        def generator(*args, **kwargs):
+            if TRIPLE_SOURCE is None and RUNTIME is None: return generate(*args, **kwargs)
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            params = tuple((name, freeze(value)) for name, value in arguments.arguments.items()
+                           if not name.startswith('shares_'))
+            shares = tuple((name, value) for name, value in arguments.arguments.items() if name.startswith('shares_'))
+            # a party in a process of its own only gets to see its shares of the triple
+            if RUNTIME is not None: return RUNTIME.deal(kind, generate, params, shares)
+            return take_or_generate(kind, generate, params, shares)
+        return generator
+    return decorator
+
+
+def take_or_generate(kind, generate, params, shares):
+    # the triple TRIPLE_SOURCE has for the parameters and given shares, or a new one it is told about
+    result = None if TRIPLE_SOURCE is None else TRIPLE_SOURCE.take(kind, params, shares)
+    if result is None:
+        result = generate(**dict(params), **dict(shares))
+        if TRIPLE_SOURCE is not None: TRIPLE_SOURCE.generated(kind, params, shares, result)
+    return result
+
+
+def freeze(value):
+    # hashable version of shapes and pool sizes given as lists
+    if isinstance(value, (list, tuple)): return tuple(freeze(v) for v in value)
+    if isinstance(value, np.integer): return int(value)
+    return value
+
+
+def sample_shared(shape):
+    """
+    Shares of random elements, for the parts of triples the dealer picks at random. With SEED_COMPRESSION both
+    shares are seeds, so that they are expanded by the parties instead of being sent.
+    :return: PrivateFieldTensor, elements
+    """
+    if not SEED_COMPRESSION:
+        elements = sample(shape)
+        return PrivateFieldTensor.from_elements(elements), elements
+    seeds = [PRGS['dealer'].new_seed() for _ in range(2)]
+    shares = PrivateFieldTensor.from_shares(SeededElements(seeds[0], shape), SeededElements(seeds[1], shape))
+    return shares, shares.reveal(count_communication=False).elements
+
+
+def expand_pool(shares, pool_size, n_filter):
+    # upsample the gradients of a pooling layer to the conv output and lay them out like the filters
+    return shares.derive('repeat', pool_size[0], 2).derive('repeat', pool_size[1], 3).derive('transpose', 1, 2, 3, 0)\
+        .derive('reshape', n_filter, -1)
+
+
+@triple('mask')
+def generate_mask(shape):
+    """
+    Shares of a random tensor to mask a value with, dealt like a triple of one
+    :return: (PrivateFieldTensor,)
+    """
+    return sample_shared(shape)[0],
+
+
+@triple('mul')
 def generate_mul_triple(shape1, shape2, shares_a=None, shares_b=None):
     if shares_a is None:
-        a = np.array([random.randrange(Q) for _ in range(np.prod(shape1))]).astype(DTYPE).reshape(shape1)
-        shares_a = PrivateFieldTensor.from_elements(a)
+        shares_a, a = sample_shared(shape1)
     else:
         a = shares_a.reveal(count_communication=False).elements
     if shares_b is None:
-        b = np.array([random.randrange(Q) for _ in range(np.prod(shape2))]).astype(DTYPE).reshape(shape2)
-        shares_b = PrivateFieldTensor.from_elements(b)
+        shares_b, b = sample_shared(shape2)
     else:
         b = shares_b.reveal(count_communication=False).elements
     shares_ab = PrivateFieldTensor.from_elements((a * b) % Q)
     return shares_a, shares_b, shares_ab
 
 
+@triple('dot')
 def generate_dot_triple(m, n, o, shares_a=None, shares_b=None):
     if shares_a is None:
-        a = np.array([random.randrange(Q) for _ in range(m * n)]).astype(DTYPE).reshape((m, n))
-        shares_a = PrivateFieldTensor.from_elements(a)
+        shares_a, a = sample_shared((m, n))
     else:
         a = shares_a.reveal(count_communication=False).elements
 
     if shares_b is None:
-        b = np.array([random.randrange(Q) for _ in range(n * o)]).astype(DTYPE).reshape((n, o))
-        shares_b = PrivateFieldTensor.from_elements(b)
+        shares_b, b = sample_shared((n, o))
     else:
         b = shares_b.reveal(count_communication=False).elements
 
-    shares_ab = PrivateFieldTensor.from_elements(np.dot(a, b))
+    shares_ab = PrivateFieldTensor.from_elements(field_dot(a, b))
     return shares_a, shares_b, shares_ab
 
 
+@triple('conv')
 def generate_conv_triple(xshape, yshape, strides, padding):
     h_filter, w_filter, d_filters, n_filters = yshape
 
-    a = np.array([random.randrange(Q) for _ in range(np.prod(xshape))]).astype(DTYPE).reshape(xshape)
-    b = np.array([random.randrange(Q) for _ in range(np.prod(yshape))]).astype(DTYPE).reshape(yshape)
+    shares_a, a = sample_shared(xshape)
+    shares_b, b = sample_shared(yshape)
 
-    if use_cython:
-        a_col = im2col_cython_object(a, h_filter, w_filter, padding, strides)
-    else:
-        a_col = im2col_indices(a, field_height=h_filter, field_width=w_filter, padding=padding, stride=strides)
+    # im2col only rearranges elements, so it is applied to the shares rather than sharing a_col anew
+    shares_a_col = shares_a.derive('im2col', h_filter, w_filter, padding, strides)
+    a_col = im2col(a, h_filter, w_filter, padding, strides)
 
     b_col = b.transpose(3, 2, 0, 1).reshape(n_filters, -1)
     # c is a conv b
-    c = np.dot(b_col, a_col)
+    c = field_dot(b_col, a_col)
 
-    return PrivateFieldTensor.from_elements(a), PrivateFieldTensor.from_elements(b), \
-           PrivateFieldTensor.from_elements(c), PrivateFieldTensor.from_elements(a_col)
+    return shares_a, shares_b, PrivateFieldTensor.from_elements(c), shares_a_col
 
 
+@triple('convbw')
 def generate_convbw_triple(xshape, yshape, shares_a=None, shares_a_col=None):
     if shares_a is None:
-        a = np.array([random.randrange(Q) for _ in range(np.prod(xshape))]).astype(DTYPE).reshape(xshape)
-        shares_a = PrivateFieldTensor.from_elements(a)
+        shares_a, a = sample_shared(xshape)
     else:
         a = shares_a.reveal(count_communication=False).elements
 
@@ -723,19 +1284,18 @@ def generate_convbw_triple(xshape, yshape, shares_a=None, shares_a_col=None):
     else:
         a_col = shares_a_col.reveal(count_communication=False).elements
 
-    b = np.array([random.randrange(Q) for _ in range(np.prod(yshape))]).astype(DTYPE).reshape(yshape)
-    shares_b = PrivateFieldTensor.from_elements(b)
+    shares_b, b = sample_shared(yshape)
     # c is a conv backward b
-    shares_c = PrivateFieldTensor.from_elements(b.dot(a_col.transpose()))
+    shares_c = PrivateFieldTensor.from_elements(field_dot(b, a_col.transpose()))
 
     return shares_a, shares_b, shares_c
 
 
+@triple('conv_pool_bw')
 def generate_conv_pool_bw_triple(xshape, yshape, pool_size, n_filter, shares_a=None, shares_a_col=None,
                                  shares_b=None, shares_b_expanded=None):
     if shares_a is None:
-        a = np.array([random.randrange(Q) for _ in range(np.prod(xshape))]).astype(DTYPE).reshape(xshape)
-        shares_a = PrivateFieldTensor.from_elements(a)
+        shares_a, a = sample_shared(xshape)
     else:
         a = shares_a.reveal(count_communication=False).elements
 
@@ -745,44 +1305,109 @@ def generate_conv_pool_bw_triple(xshape, yshape, pool_size, n_filter, shares_a=N
         a_col = shares_a_col.reveal(count_communication=False).elements
 
     if shares_b is None:
-        b = np.array([random.randrange(Q) for _ in range(np.prod(yshape))]).astype(DTYPE).reshape(yshape)
-        shares_b = PrivateFieldTensor.from_elements(b)
+        shares_b, b = sample_shared(yshape)
     else:
         b = shares_b.reveal(count_communication=False).elements
 
     if shares_b_expanded is None:
+        shares_b_expanded = expand_pool(shares_b, pool_size, n_filter)
         b_expanded = b.repeat(pool_size[0], axis=2).repeat(pool_size[1], axis=3).transpose(1, 2, 3, 0)\
             .reshape(n_filter, -1)
-        shares_b_expanded = PrivateFieldTensor.from_elements(b_expanded)
     else:
         b_expanded = shares_b_expanded.reveal(count_communication=False).elements
 
     # c is a conv pool backward b
-    shares_c = PrivateFieldTensor.from_elements(b_expanded.dot(a_col.transpose()))
+    shares_c = PrivateFieldTensor.from_elements(field_dot(b_expanded, a_col.transpose()))
 
     return shares_a, shares_b, shares_c, shares_b_expanded
 
 
+@triple('conv_pool_delta')
 def generate_conv_pool_delta_triple(xshape, yshape, pool_size, n_filter, shares_a=None):
     if shares_a is None:
-        a = np.array([random.randrange(Q) for _ in range(np.prod(xshape))]).astype(DTYPE).reshape(xshape)
+        shares_a, a = sample_shared(xshape)
     else:
         a = shares_a.reveal(count_communication=False).elements
-    b = np.array([random.randrange(Q) for _ in range(np.prod(yshape))]).astype(DTYPE).reshape(yshape)
+    shares_b, b = sample_shared(yshape)
+    shares_b_expanded = expand_pool(shares_b, pool_size, n_filter)
     b_expanded = b.repeat(pool_size[0], axis=2).repeat(pool_size[1], axis=3).transpose(1, 2, 3, 0).reshape(n_filter, -1)
     a_reshaped = a.reshape(n_filter, -1).transpose()
 
-    shares_b = PrivateFieldTensor.from_elements(b)
-    shares_b_expanded = PrivateFieldTensor.from_elements(b_expanded)
     # c is the backpropagated gradient of weights a and incoming backpropagated gradient b
-    shares_c = PrivateFieldTensor.from_elements(a_reshaped.dot(b_expanded)),
+    shares_c = PrivateFieldTensor.from_elements(field_dot(a_reshaped, b_expanded))
     return shares_a, shares_b, shares_c, shares_b_expanded
 
 
+@triple('square')
 def generate_square_triple(xshape):
-    a = np.array([random.randrange(Q) for _ in range(np.prod(xshape))]).astype(DTYPE).reshape(xshape)
-    aa = np.power(a, 2) % Q
-    return PrivateFieldTensor.from_elements(a), PrivateFieldTensor.from_elements(aa)
+    shares_a, a = sample_shared(xshape)
+    aa = (a * a) % Q
+    return shares_a, PrivateFieldTensor.from_elements(aa)
+
+
+@triple('powering')
+def generate_powering_triple(shape, exponent):
+    shares_a, a = sample_shared(shape)
+    powers = [a]
+    for _ in range(exponent - 1): powers.append((powers[-1] * a) % Q)
+    return (shares_a,) + tuple(PrivateFieldTensor.from_elements(power) for power in powers[1:])
+
+
+def beaver_combine(op, alpha, beta, a, b, c, terms=1, precision=None):
+    """
+    Shares of op(x, y) from a triple (a, b, c = op(a, b)) and the revealed masked values alpha = x - a and
+    beta = y - b
+    :param op: bilinear function on share arrays, e.g. multiplication or dot
+    :param alpha: PublicFieldTensor
+    :param beta: PublicFieldTensor
+    :param a: PrivateFieldTensor
+    :param b: PrivateFieldTensor
+    :param c: PrivateFieldTensor
+    :param terms: number of products op sums up for each output element, e.g. the inner dimension of a dot
+    :param precision: sum of the precisions of x and y, by default 2 * PRECISION_FRACTIONAL
+    :return: PrivateEncodedTensor
+    """
+    # op(alpha, beta) + op(alpha, b) + op(a, beta) + c == op(alpha, beta + b) + op(a, beta) + c, where only
+    # the first party adds beta to its share of b; both products are accumulated into one array per party
+    a.reduce(), b.reduce(), c.reduce()
+    bound = terms * 3 * REDUCED_BOUND ** 2 + REDUCED_BOUND
+    reduce_products = bound > HEADROOM
+    if reduce_products: bound = 3 * REDUCED_BOUND
+    if isinstance(beta, PendingPublicFieldTensor) and beta.in_flight():
+        return beaver_combine_alpha_first(op, alpha, beta, a, b, c, bound, reduce_products, precision)
+    shares = []
+    for shares_a, shares_b, shares_c in ((a.shares0, beta.elements + b.shares0, c.shares0),
+                                         (a.shares1, b.shares1, c.shares1)):
+        z = op(alpha.elements, shares_b)
+        if reduce_products: z %= Q
+        z_a = op(shares_a, beta.elements)
+        z += z_a % Q if reduce_products else z_a
+        z += shares_c
+        shares.append(z)
+    if precision is None: precision = 2 * PRECISION_FRACTIONAL
+    return PrivateEncodedTensor.from_shares(shares[0], shares[1], bound=bound, precision=precision)
+
+
+def beaver_combine_alpha_first(op, alpha, beta, a, b, c, bound, reduce_products, precision):
+    # beaver_combine computing op(alpha, b) while beta is still on its way, at the cost of op(alpha, beta) on its own
+    if reduce_products: bound = 4 * REDUCED_BOUND
+    shares = [op(alpha.elements, shares_b) for shares_b in (b.shares0, b.shares1)]
+    if reduce_products: shares = [z % Q for z in shares]
+    products = [op(alpha.elements, beta.elements)] + [op(shares_a, beta.elements) for shares_a in (a.shares0,
+                                                                                                  a.shares1)]
+    if reduce_products: products = [z % Q for z in products]
+    shares[0] += products[0]
+    for z, z_a, shares_c in zip(shares, products[1:], (c.shares0, c.shares1)):
+        z += z_a
+        z += shares_c
+    if precision is None: precision = 2 * PRECISION_FRACTIONAL
+    return PrivateEncodedTensor.from_shares(shares[0], shares[1], bound=bound, precision=precision)
+
+
+def stack_field(tensors, axis):
+    result = PrivateFieldTensor.from_shares(arrays.stack([t.shares0 for t in tensors], axis),
+                                            arrays.stack([t.shares1 for t in tensors], axis))
+    return derived(result, lambda *sources: stack_field(sources, axis), *tensors)
 
 
 def stack(tensors, axis=-1):
@@ -796,53 +1421,109 @@ def stack(tensors, axis=-1):
     if isinstance(tensors[0], NativeTensor):
         return NativeTensor(np.stack([t.values for t in tensors], axis))
     if isinstance(tensors[0], PublicEncodedTensor):
-        return PublicEncodedTensor.from_elements(np.stack([t.elements for t in tensors], axis))
+        precision = max(t.precision for t in tensors)
+        return PublicEncodedTensor.from_elements(arrays.stack([t.rescale(precision).elements for t in tensors], axis),
+                                                 precision)
     if isinstance(tensors[0], PrivateEncodedTensor):
         mask, masked = None, None
         if all(t.mask is not None for t in tensors):
-            mask = PrivateFieldTensor.from_shares(np.stack([t.mask.shares0 for t in tensors], axis),
-                                                  np.stack([t.mask.shares1 for t in tensors], axis))
+            mask = stack_field([t.mask for t in tensors], axis)
         if all(t.masked is not None for t in tensors):
-            masked = PublicFieldTensor.from_elements(np.stack([t.masked.elements for t in tensors], axis))
+            masked = PublicFieldTensor.from_elements(arrays.stack([t.masked.elements for t in tensors], axis))
 
-        return PrivateEncodedTensor.from_shares(np.stack([t.shares0 for t in tensors], axis),
-                                                np.stack([t.shares1 for t in tensors], axis),
-                                                mask=mask, masked=masked)
+        # scaling changes the shares, so masks are only kept if no tensor needs it
+        precision = max(t.precision for t in tensors)
+        if any(t.precision != precision for t in tensors):
+            tensors, mask, masked = [t.rescale(precision) for t in tensors], None, None
+        return PrivateEncodedTensor.from_shares(arrays.stack([t.shares0 for t in tensors], axis),
+                                                arrays.stack([t.shares1 for t in tensors], axis),
+                                                mask=mask, masked=masked, bound=max(t.bound for t in tensors),
+                                                precision=precision)
 
 
 class PrivateEncodedTensor:
 
-    def __init__(self, values, shares0=None, shares1=None, mask=None, masked=None):
+    __array_ufunc__ = None
+
+    def __init__(self, values, shares0=None, shares1=None, mask=None, masked=None, bound=None, precision=None):
+        if precision is None: precision = PRECISION_FRACTIONAL
         if values is not None:
             if not isinstance(values, np.ndarray):
                 values = np.array([values])
-            shares0, shares1 = share(encode(values))
-        assert isinstance(shares0, np.ndarray), "%s, %s, %s" % (values, shares0, type(shares0))
-        assert isinstance(shares1, np.ndarray), "%s, %s, %s" % (values, shares1, type(shares1))
-        assert shares0.dtype == shares1.dtype
+            shares0, shares1 = share(encode(values, precision))
+        assert arrays.is_array(shares0) or isinstance(shares0, SeededElements), \
+            "%s, %s, %s" % (values, shares0, type(shares0))
+        assert arrays.is_array(shares1), "%s, %s, %s" % (values, shares1, type(shares1))
+        # shares of the other party under a RUNTIME are AnalyticArrays
+        assert isinstance(shares0, (SeededElements, AnalyticArray)) or isinstance(shares1, AnalyticArray) or \
+            shares0.dtype == shares1.dtype
         assert shares0.shape == shares1.shape
         self.shares0 = shares0
         self.shares1 = shares1
+        # upper bound on the magnitude of both shares, see reduce
+        self.bound = REDUCED_BOUND if bound is None else bound
+        # number of fractional digits of the encoding
+        self.precision = precision
         self.mask = mask
         self.masked_transformed = None
         self.masked = masked
         self.mask_transformed = None
 
+    @property
+    def shares0(self):
+        if self.expanded0 is None: self.expanded0 = self.seed0.expand()
+        return self.expanded0
+
+    @shares0.setter
+    def shares0(self, shares0):
+        if isinstance(shares0, SeededElements):
+            self.seed0, self.expanded0 = shares0, None
+        else:
+            self.seed0, self.expanded0 = None, shares0
+
     @staticmethod
-    def from_values(values):
-        return PrivateEncodedTensor(values)
+    def from_values(values, precision=None):
+        return PrivateEncodedTensor(values, precision=precision)
 
     @staticmethod
-    def from_elements(elements):
+    def from_elements(elements, precision=None):
         shares0, shares1 = share(elements)
-        return PrivateEncodedTensor(None, shares0, shares1)
+        return PrivateEncodedTensor(None, shares0, shares1, precision=precision)
 
     @staticmethod
-    def from_shares(shares0, shares1, mask=None, masked=None):
-        return PrivateEncodedTensor(None, shares0, shares1, mask, masked)
+    def from_shares(shares0, shares1, mask=None, masked=None, bound=None, precision=None, out=None):
+        if out is None: return PrivateEncodedTensor(None, shares0, shares1, mask, masked, bound, precision)
+        # the value of `out` changes so any cached masked values are stale
+        out.shares0, out.shares1 = shares0, shares1
+        out.bound = REDUCED_BOUND if bound is None else bound
+        out.precision = PRECISION_FRACTIONAL if precision is None else precision
+        out.mask, out.masked, out.mask_transformed, out.masked_transformed = mask, masked, None, None
+        return out
+
+    def reduce(self):
+        """
+        Reduce the shares modulo Q in place if they are not already
+        :return: self
+        """
+        if self.bound > REDUCED_BOUND:
+            self.shares0 = self.shares0 % Q
+            self.shares1 = self.shares1 % Q
+            self.bound = REDUCED_BOUND
+        return self
+
+    def materialize(self):
+        """
+        Replace shares that are read-only views, such as the second share of x + public which is a view of the
+        share of x, by arrays of their own so that they can be written in place
+        :return: self
+        """
+        if not arrays.writeable(self.shares0): self.shares0 = self.shares0.copy()
+        if not arrays.writeable(self.shares1): self.shares1 = self.shares1.copy()
+        return self
 
     def copy(self):
-        result = PrivateEncodedTensor(None, self.shares0.copy(), self.shares1.copy())
+        shares0 = self.seed0 if self.expanded0 is None else self.expanded0.copy()
+        result = PrivateEncodedTensor(None, shares0, self.shares1.copy(), bound=self.bound, precision=self.precision)
         if self.mask is not None: result.mask = self.mask.copy()
         if self.masked is not None: result.masked = self.masked.copy()
         if self.mask_transformed is not None: result.mask_transformed = self.mask_transformed.copy()
@@ -850,224 +1531,665 @@ class PrivateEncodedTensor:
         return result
 
     def __repr__(self):
+        if 2 * self.bound > HEADROOM: self.reduce()
         elements = (self.shares0 + self.shares1) % Q
-        return "PrivateEncodedTensor(%s)" % decode(elements)
+        return "PrivateEncodedTensor(%s)" % decode(elements, self.precision)
+
+    def view(x, function):
+        """
+        Tensor with `function` applied to the shares as well as to the cached mask and masked values, so that
+        they can still be reused after reshaping. Without cached masks it shares memory with x wherever `function`
+        returns numpy views; with them the shares are copied, since in-place updates of x would leave the masks of
+        the view stale. Transformed masks describe the layout of a particular layer and are not carried over.
+        :param function: shape manipulation on share arrays, e.g. lambda shares: shares.reshape(2, -1)
+        :return: PrivateEncodedTensor
+        """
+        if x.mask is None and x.masked is None:
+            return PrivateEncodedTensor.from_shares(function(x.shares0), function(x.shares1), bound=x.bound,
+                                                    precision=x.precision)
+        mask, masked = None, None
+        if x.mask is not None:
+            mask = x.mask.view(function)
+        if x.masked is not None:
+            masked = PublicFieldTensor.from_elements(function(x.masked.elements))
+        return PrivateEncodedTensor.from_shares(function(x.shares0).copy(), function(x.shares1).copy(), mask, masked,
+                                                x.bound, x.precision)
 
     def __getitem__(self, index):
-        result = PrivateEncodedTensor.from_shares(self.shares0[index], self.shares1[index])
-        if self.mask is not None:
-            result.mask = self.mask[index]
-        if self.masked_transformed is not None:
-            result.masked_transformed = self.masked_transformed[index]
-        if self.masked is not None:
-            result.masked = self.masked[index]
-        if self.mask_transformed is not None:
-            result.mask_transformed = self.mask_transformed[index]
-        return result
+        return self.view(lambda shares: shares[index])
 
     def __setitem__(self, idx, other):
         if isinstance(other, PrivateEncodedTensor):
+            if other.precision != self.precision: other = other.rescale(self.precision)
+            self.materialize()
             self.shares0[idx] = other.shares0
             self.shares1[idx] = other.shares1
+            self.bound = max(self.bound, other.bound)
 
+            # keep masks only where they still describe every element, written into copies as views may share them
             if self.mask is not None and other.mask is not None:
+                self.mask = self.mask.copy()
                 self.mask[idx] = other.mask
+            else:
+                self.mask = None
             if self.masked is not None and other.masked is not None:
+                self.masked = self.masked.copy()
                 self.masked[idx] = other.masked
+            else:
+                self.masked = None
+            self.mask_transformed, self.masked_transformed = None, None
         else:
             raise TypeError("%s does not support %s" % (type(self), type(other)))
 
     def concatenate(self, other):
         if isinstance(other, PrivateEncodedTensor):
-            shares0 = np.concatenate([self.shares0, other.shares0])
-            shares1 = np.concatenate([self.shares1, other.shares1])
-            return PrivateEncodedTensor.from_shares(shares0, shares1)
+            x, y = align_precision(self, other)
+            shares0 = arrays.concatenate([x.shares0, y.shares0])
+            shares1 = arrays.concatenate([x.shares1, y.shares1])
+            return PrivateEncodedTensor.from_shares(shares0, shares1, bound=max(x.bound, y.bound),
+                                                    precision=x.precision)
         raise TypeError("%s does not support %s" % (type(self), type(other)))
 
     @property
     def shape(self):
-        return self.shares0.shape
+        return self.shares1.shape
 
     @property
     def size(self):
-        return self.shares0.size
+        return self.shares1.size
 
     def unwrap(self):
-        return decode((self.shares0 + self.shares1) % Q)
+        if 2 * self.bound > HEADROOM: self.reduce()
+        if REVEAL_LOG is not None: REVEAL_LOG.append([self.shape])
+        return decode(open_shares([(self.shares0, self.shares1)])[0], self.precision)
 
     def reveal(self):
-        return NativeTensor.from_values(decode((self.shares0 + self.shares1) % Q))
+        if 2 * self.bound > HEADROOM: self.reduce()
+        if REVEAL_LOG is not None: REVEAL_LOG.append([self.shape])
+        return NativeTensor.from_values(decode(open_shares([(self.shares0, self.shares1)])[0], self.precision))
+
+    def truncate(self, amount=None, out=None):
+        """
+        :param amount: number of fractional digits to drop, by default all beyond PRECISION_FRACTIONAL
+        :param out: PrivateEncodedTensor of the same shape to write the shares into, e.g. self
+        """
+        if amount is None: amount = self.precision - PRECISION_FRACTIONAL
+        precision = self.precision - amount
+        self.reduce()
+        if BACKENDS[BACKEND]['array'] is Ring64Array:
+            # SecureML local truncation: off by at most one in the last place, and wrong with probability about
+            # 2^(l + 1 - 64) for plaintexts of l bits; no modulus reduction needed in the ring
+            shares0 = self.shares0 >> amount
+            shares1 = -((-self.shares1) >> amount)
+            return PrivateEncodedTensor.from_shares(shares0, shares1, precision=precision, out=out)
+        shares0 = (self.shares0 // BASE ** amount) % Q
+        # Q - 0 has to be reduced to 0 first, or zero shares, e.g. the padding of im2col, truncate to -Q // BASE^amount
+        shares1 = (Q - ((Q - self.shares1) % Q) // BASE ** amount) % Q
+        return PrivateEncodedTensor.from_shares(shares0, shares1, precision=precision, out=out)
+
+    def truncate_(self):
+        """
+        Truncate in place down to PRECISION_FRACTIONAL fractional digits if there are more
+        :return: self
+        """
+        if self.precision > PRECISION_FRACTIONAL: self.truncate(out=self)
+        return self
 
-    def truncate(self, amount=PRECISION_FRACTIONAL):
-        shares0 = np.floor_divide(self.shares0, BASE ** amount) % Q
-        shares1 = (Q - (np.floor_divide(Q - self.shares1, BASE ** amount))) % Q
-        return PrivateEncodedTensor.from_shares(shares0, shares1)
+    def rescale(self, precision):
+        """
+        The same values encoded with `precision` fractional digits, exact unless digits are truncated
+        :return: PrivateEncodedTensor, self if the precision already matches
+        """
+        if precision < self.precision: return self.truncate(self.precision - precision)
+        if precision == self.precision: return self
+        factor = BASE ** (precision - self.precision)
+        if self.bound * factor > HEADROOM: self.reduce()
+        return PrivateEncodedTensor.from_shares(self.shares0 * factor, self.shares1 * factor,
+                                                bound=self.bound * factor, precision=precision)
 
     def flip(x, axis):
-        x.shares0 = np.flip(x.shares0, axis)
-        x.shares1 = np.flip(x.shares1, axis)
-        if x.mask is not None: x.mask = x.mask.flip(axis)
-        if x.masked is not None: x.masked = x.masked.flip(axis)
-        if x.mask_transformed is not None: x.mask_transformed = x.mask_transformed.flip(axis)
-        if x.masked_transformed is not None: x.masked_transformed = x.masked_transformed.flip(axis)
-        return x
-
-    def add(x, y):
-        y = wrap_if_needed(y)
-        if isinstance(y, PublicEncodedTensor):
-            shares0 = (x.shares0 + y.elements) % Q
-            shares1 = x.shares1 + np.zeros(y.elements.shape, dtype=DTYPE)  # hack to fix broadcasting
-            return PrivateEncodedTensor.from_shares(shares0, shares1)
-        if isinstance(y, PrivateEncodedTensor):
-            shares0 = (x.shares0 + y.shares0) % Q
-            shares1 = (x.shares1 + y.shares1) % Q
-            return PrivateEncodedTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return x.view(lambda shares: arrays.flip(shares, axis))
+
+    def add(x, y, out=None):
+        """
+        :param out: PrivateEncodedTensor of the result shape to write the shares into, e.g. x itself
+        """
+        if out is not None: out.materialize()
+        return dispatch('add', x, y)(x, y, out)
+
+    def add_public(x, y, out=None):
+        x, y = align_precision(x, y)
+        if x.bound + REDUCED_BOUND > HEADROOM: x.reduce()
+        # only the first share changes, the second one is kept as a broadcast view
+        shares0 = arrays.add(x.shares0, y.elements, out=None if out is None else out.shares0)
+        shares1 = arrays.broadcast_to(x.shares1, shares0.shape) if out is None else out.shares1
+        if out is not None and out is not x: shares1[...] = x.shares1
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=x.bound + REDUCED_BOUND,
+                                                precision=x.precision, out=out)
+
+    def add_private(x, y, out=None):
+        x, y = align_precision(x, y)
+        if x.bound + y.bound > HEADROOM: x.reduce(), y.reduce()
+        shares0 = arrays.add(x.shares0, y.shares0, out=None if out is None else out.shares0)
+        shares1 = arrays.add(x.shares1, y.shares1, out=None if out is None else out.shares1)
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=x.bound + y.bound, precision=x.precision,
+                                                out=out)
 
     def __add__(x, y):
         return x.add(y)
 
-    def sub(x, y):
-        y = wrap_if_needed(y)
-        if isinstance(y, PublicEncodedTensor):
-            shares0 = (x.shares0 - y.elements) % Q
-            shares1 = x.shares1
-            return PrivateEncodedTensor.from_shares(shares0, shares1)
-        if isinstance(y, PrivateEncodedTensor):
-            shares0 = (x.shares0 - y.shares0) % Q
-            shares1 = (x.shares1 - y.shares1) % Q
-            return PrivateEncodedTensor.from_shares(shares0, shares1)
-        if isinstance(y, PrivateFieldTensor):
-            shares0 = (x.shares0 - y.shares0) % Q
-            shares1 = (x.shares1 - y.shares1) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+    def __radd__(x, y):
+        return x.add(y)
+
+    def add_(x, y):
+        return x.add(y, out=x)
+
+    def __iadd__(x, y):
+        return x.add_(y)
+
+    def sub(x, y, out=None):
+        """
+        :param out: PrivateEncodedTensor of the result shape to write the shares into, e.g. x itself
+        """
+        if out is not None: out.materialize()
+        return dispatch('sub', x, y)(x, y, out)
+
+    def sub_public(x, y, out=None):
+        x, y = align_precision(x, y)
+        if x.bound + REDUCED_BOUND > HEADROOM: x.reduce()
+        shares0 = arrays.subtract(x.shares0, y.elements, out=None if out is None else out.shares0)
+        shares1 = arrays.broadcast_to(x.shares1, shares0.shape) if out is None else out.shares1
+        if out is not None and out is not x: shares1[...] = x.shares1
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=x.bound + REDUCED_BOUND,
+                                                precision=x.precision, out=out)
+
+    def sub_private(x, y, out=None):
+        x, y = align_precision(x, y)
+        if x.bound + y.bound > HEADROOM: x.reduce(), y.reduce()
+        shares0 = arrays.subtract(x.shares0, y.shares0, out=None if out is None else out.shares0)
+        shares1 = arrays.subtract(x.shares1, y.shares1, out=None if out is None else out.shares1)
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=x.bound + y.bound, precision=x.precision,
+                                                out=out)
+
+    def sub_field(x, y, out=None):
+        assert out is None, "the difference is a PrivateFieldTensor"
+        if x.bound + y.bound > HEADROOM: x.reduce(), y.reduce()
+        shares0 = x.shares0 - y.shares0
+        shares1 = x.shares1 - y.shares1
+        return PrivateFieldTensor.from_shares(shares0, shares1, bound=x.bound + y.bound)
 
     def __sub__(x, y):
         return x.sub(y)
 
-    def mul(x, y, precomputed=None, reuse_mask=REUSE_MASK):
-        y = wrap_if_needed(y)
-        if isinstance(y, PublicEncodedTensor):
-            shares0 = (x.shares0 * y.elements) % Q
-            shares1 = (x.shares1 * y.elements) % Q
-            return PrivateEncodedTensor.from_shares(shares0, shares1).truncate()
-        if isinstance(y, PrivateEncodedTensor):
-            a, b, alpha, beta = None, None, None, None
-            if reuse_mask: a, alpha, b, beta = x.mask, x.masked, y.mask, y.masked
-            if precomputed is None: precomputed = generate_mul_triple(x.shape, y.shape, shares_a=a, shares_b=b)
-            a, b, ab = precomputed
-            if alpha is None: alpha = (x - a).reveal()
-            if beta is None: beta = (y - b).reveal()
-            if reuse_mask: x.mask, x.masked, y.mask, y.masked = a, alpha, b, beta
-            z = alpha.mul(beta) + alpha.mul(b) + a.mul(beta) + ab
-            return PrivateEncodedTensor.from_shares(z.shares0, z.shares1).truncate()
-
-        if isinstance(y, PrivateFieldTensor):
-            shares0 = (x.shares0 * y.shares0) % Q
-            shares1 = (x.shares1 * y.shares1) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        if isinstance(y, PublicFieldTensor):
-            shares0 = (x.shares0 * y.elements) % Q
-            shares1 = (x.shares1 * y.elements) % Q
-            return PrivateFieldTensor.from_shares(shares0, shares1)
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+    def sub_(x, y):
+        return x.sub(y, out=x)
+
+    def __isub__(x, y):
+        return x.sub_(y)
+
+    def mul(x, y, precomputed=None, reuse_mask=None):
+        return dispatch('mul', x, y)(x, y, precomputed, reuse_mask)
+
+    def mul_public(x, y, *_):
+        x, y = fit_product(x, y)
+        if x.bound * REDUCED_BOUND > HEADROOM: x.reduce()
+        shares0 = x.shares0 * y.elements
+        shares1 = x.shares1 * y.elements
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=x.bound * REDUCED_BOUND,
+                                                precision=x.precision + y.precision)
+
+    def mul_scalar(x, y, *_):
+        # both shares are multiplied by the same integer: y itself, or its encoding if it is not an integer
+        precision = 0 if isinstance(y, int) else PRECISION_FRACTIONAL
+        if x.precision + precision > MAX_PRECISION: x = x.truncate()
+        if x.bound * REDUCED_BOUND > HEADROOM: x.reduce()
+        element = int(y * BASE ** precision) % Q
+        return PrivateEncodedTensor.from_shares(x.shares0 * element, x.shares1 * element,
+                                                bound=x.bound * REDUCED_BOUND, precision=x.precision + precision)
+
+    def mul_private(x, y, precomputed=None, reuse_mask=None):
+        if reuse_mask is None: reuse_mask = REUSE_MASK
+        x, y = fit_product(x, y)
+        a, b, alpha, beta = None, None, None, None
+        if reuse_mask: a, alpha, b, beta = x.mask, x.masked, y.mask, y.masked
+        if precomputed is None: precomputed = generate_mul_triple(x.shape, y.shape, shares_a=a, shares_b=b)
+        a, b, ab = precomputed
+        if alpha is None: alpha = (x - a).reveal()
+        if beta is None: beta = (y - b).reveal()
+        if reuse_mask: x.mask, x.masked, y.mask, y.masked = a, alpha, b, beta
+        return beaver_combine(lambda u, v: u * v, alpha, beta, a, b, ab, precision=x.precision + y.precision)
+
+    def mul_private_field(x, y, *_):
+        if x.bound * y.bound > HEADROOM: x.reduce(), y.reduce()
+        shares0 = x.shares0 * y.shares0
+        shares1 = x.shares1 * y.shares1
+        return PrivateFieldTensor.from_shares(shares0, shares1, bound=x.bound * y.bound)
+
+    def mul_public_field(x, y, *_):
+        if x.bound * REDUCED_BOUND > HEADROOM: x.reduce()
+        shares0 = x.shares0 * y.elements
+        shares1 = x.shares1 * y.elements
+        return PrivateFieldTensor.from_shares(shares0, shares1, bound=x.bound * REDUCED_BOUND)
 
     def __mul__(x, y):
         return x.mul(y)
 
-    def dot(x, y, precomputed=None, reuse_mask=REUSE_MASK):
-        y = wrap_if_needed(y)
-        if isinstance(y, PublicEncodedTensor):
-            assert x.shape[-1] == y.shape[0]
-            shares0 = x.shares0.dot(y.elements) % Q
-            shares1 = x.shares1.dot(y.elements) % Q
-            return PrivateEncodedTensor.from_shares(shares0, shares1).truncate()
-        if isinstance(y, PrivateEncodedTensor):
-            m, n, o = x.shape[0], x.shape[1], y.shape[1]
-            assert n == y.shape[0]
-            a, b, alpha, beta = None, None, None, None
-            if reuse_mask: a, alpha, b, bet = x.mask, x.masked, y.mask, y.masked
-            if precomputed is None: precomputed = generate_dot_triple(m, n, o, a, b)
-            a, b, ab = precomputed
-            if alpha is None: alpha = (x - a).reveal()
-            if beta is None: beta = (y - b).reveal()
-            z = alpha.dot(beta) + alpha.dot(b) + a.dot(beta) + ab
-            # cache masks
-            if reuse_mask:
-                x.mask, x.masked, y.mask, y.masked = a, alpha, b, beta
-
-            return PrivateEncodedTensor.from_shares(z.shares0, z.shares1).truncate()
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+    def __rmul__(x, y):
+        return x.mul(y)
+
+    def dot(x, y, precomputed=None, reuse_mask=None):
+        return dispatch('dot', x, y)(x, y, precomputed, reuse_mask)
+
+    def dot_public(x, y, *_):
+        assert x.shape[-1] == y.shape[0]
+        x, y = fit_product(x, y)
+        x.reduce()
+        shares0 = field_dot(x.shares0, y.elements)
+        shares1 = field_dot(x.shares1, y.elements)
+        return PrivateEncodedTensor.from_shares(shares0, shares1, precision=x.precision + y.precision)
+
+    def dot_private(x, y, precomputed=None, reuse_mask=None):
+        if reuse_mask is None: reuse_mask = REUSE_MASK
+        m, n, o = x.shape[0], x.shape[1], y.shape[1]
+        assert n == y.shape[0]
+        x, y = fit_product(x, y)
+        a, b, alpha, beta = None, None, None, None
+        if reuse_mask: a, alpha, b, beta = x.mask, x.masked, y.mask, y.masked
+        if precomputed is None: precomputed = generate_dot_triple(m, n, o, a, b)
+        a, b, ab = precomputed
+        if alpha is None: alpha = (x - a).reveal()
+        if beta is None: beta = (y - b).reveal()
+        # cache masks
+        if reuse_mask:
+            x.mask, x.masked, y.mask, y.masked = a, alpha, b, beta
+
+        return beaver_combine(field_dot, alpha, beta, a, b, ab, terms=n, precision=x.precision + y.precision)
 
     def div(x, y):
-        y = wrap_if_needed(y)
-        if isinstance(y, NativeTensor): return x.mul(y.inv())
-        if isinstance(y, PublicEncodedTensor): return x.mul(y.inv())
-        raise TypeError("%s does not support %s" % (type(x), type(y)))
+        return dispatch('div', x, y)(x, y)
+
+    def div_public(x, y):
+        return x.mul(y.inv())
 
     def square(x):
+        x, _ = fit_product(x, x)
         a, aa = generate_square_triple(x.shape)
         alpha = (x - a).reveal()
-        z = alpha * alpha + alpha * a + alpha * a + aa
         x.mask, x.masked = a, alpha
-        return PrivateEncodedTensor.from_shares(z.shares0, z.shares1).truncate()
+        return beaver_combine(lambda u, v: u * v, alpha, alpha, a, a, aa, precision=2 * x.precision)
+
+    def powers(x, degree, precision=None):
+        """
+        x, x^2, ..., x^degree from as few reveals as possible: with a powering triple (a, a^2, ..., a^m) and the
+        revealed alpha = x - a, x^k is the sum of binomial(k, i) alpha^(k - i) a^i over i, which is local. x is
+        truncated to `precision` fractional digits first so that x^m fits like any other product, which allows
+        m = MAX_PRECISION // precision; every further round multiplies the powers so far by x^m.
+        :param precision: by default PRECISION_FRACTIONAL, as any product keeps; MAX_PRECISION // degree takes a
+            single reveal at the cost of most of the fractional digits of x
+        :return: list of PrivateEncodedTensor
+        """
+        if precision is None: precision = PRECISION_FRACTIONAL
+        x = x.rescale(min(x.precision, precision))
+        m = min(degree, MAX_PRECISION // x.precision)
+        a = generate_powering_triple(x.shape, m)
+        alpha = (x - a[0]).reveal()
+        x.mask, x.masked = a[0], alpha
+        for a_i in a: a_i.reduce()
+        alphas = [None, alpha.elements]
+        for _ in range(m - 1): alphas.append((alphas[-1] * alpha.elements) % Q)
+        # rows of Pascal's triangle up to m
+        binomials = [[1]]
+        for _ in range(m): binomials.append([1] + [u + v for u, v in zip(binomials[-1], binomials[-1][1:])] + [1])
+        powers = []
+        for k in range(1, m + 1):
+            # the a^k term, of which only the first party adds alpha^k, and k - 1 products with public factors
+            bound = (k - 1) * REDUCED_BOUND ** 2 + 2 * REDUCED_BOUND
+            reduce_products = bound > HEADROOM
+            if reduce_products: bound = (k + 1) * REDUCED_BOUND
+            shares0, shares1 = arrays.add(a[k - 1].shares0, alphas[k]), a[k - 1].shares1
+            for i in range(1, k):
+                factor = (binomials[k][i] * alphas[k - i]) % Q
+                term0, term1 = factor * a[i - 1].shares0, factor * a[i - 1].shares1
+                if reduce_products: term0, term1 = term0 % Q, term1 % Q
+                shares0, shares1 = shares0 + term0, shares1 + term1
+            powers.append(PrivateEncodedTensor.from_shares(shares0, shares1, bound=bound, precision=k * x.precision))
+        while len(powers) < degree:
+            # x^(n + k) = x^n x^k for k = 1, ..., m in one round, with the same mask for x^n in every product
+            top, fitted = powers[-1], []
+            for factor in powers[:min(m, degree - len(powers))]:
+                top, factor = fit_product(top, factor)
+                fitted.append(factor)
+            factors = fitted
+            triples, a = [], None
+            for factor in factors:
+                triples.append(generate_mul_triple(top.shape, factor.shape, shares_a=a))
+                a = triples[-1][0]
+            alpha = (top - a).reveal()
+            betas = [(factor - b).reveal() for factor, (_, b, _) in zip(factors, triples)]
+            powers += [beaver_combine(lambda u, v: u * v, alpha, beta, a, b, ab,
+                                      precision=top.precision + factor.precision)
+                       for factor, beta, (_, b, ab) in zip(factors, betas, triples)]
+        return powers
 
     def __truediv__(x, y):
         return x.div(y)
 
-    def neg(self):
-        minus_one = PublicFieldTensor.from_elements(np.array([Q - 1]))
-        z = self.mul(minus_one)
-        return PrivateEncodedTensor.from_shares(z.shares0, z.shares1)
-
-    def transpose(self, *axes, reuse_mask=REUSE_MASK):
-        if self.mask is not None and reuse_mask:
-            out = PrivateEncodedTensor.from_shares(self.shares0.transpose(*axes), self.shares1.transpose(*axes))
-            if self.mask is not None: out.mask = self.mask.transpose(*axes)
-            if self.masked is not None: out.masked = self.masked.transpose(*axes)
-            if self.mask_transformed is not None: out.mask_transformed = self.masked_transformed.transpose(*axes)
-            if self.masked_transformed is not None: out.masked_transformed = self.masked_transformed.transpose(*axes)
-            return out
-        else:
-            return PrivateEncodedTensor.from_shares(self.shares0.transpose(*axes), self.shares1.transpose(*axes))
+    def neg(x, out=None):
+        """
+        :param out: PrivateEncodedTensor of the same shape to write the shares into, e.g. x itself
+        """
+        if out is not None: out.materialize()
+        # Q - x is the negation modulo Q and stays within [0, Q] for reduced shares
+        if x.bound + REDUCED_BOUND > HEADROOM: x.reduce()
+        shares0 = arrays.subtract(Q, x.shares0, out=None if out is None else out.shares0)
+        shares1 = arrays.subtract(Q, x.shares1, out=None if out is None else out.shares1)
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=x.bound + REDUCED_BOUND,
+                                                precision=x.precision, out=out)
+
+    def neg_(x):
+        return x.neg(out=x)
 
-    def expand_dims(self, axis=0):
-        self.shares0 = np.expand_dims(self.shares0, axis=axis)
-        self.shares1 = np.expand_dims(self.shares1, axis=axis)
+    def transpose(x, *axes):
+        return x.view(lambda shares: shares.transpose(*axes))
 
-        if self.mask is not None:
-            self.mask = self.mask.expand_dims(axis=axis)
-        if self.masked is not None:
-            self.masked = self.masked.expand_dims(axis=axis)
-        return self
+    def expand_dims(x, axis=0):
+        return x.view(lambda shares: arrays.expand_dims(shares, axis))
 
     def sum(self, axis, keepdims=False):
-        shares0 = self.shares0.sum(axis=axis, keepdims=keepdims) % Q
-        shares1 = self.shares1.sum(axis=axis, keepdims=keepdims) % Q
-        return PrivateEncodedTensor.from_shares(shares0, shares1)
+        axes = range(len(self.shape)) if axis is None else np.atleast_1d(axis)
+        terms = int(np.prod([self.shape[a] for a in axes]))
+        if self.bound * terms > HEADROOM: self.reduce()
+        shares0 = self.shares0.sum(axis=axis, keepdims=keepdims)
+        shares1 = self.shares1.sum(axis=axis, keepdims=keepdims)
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=self.bound * terms, precision=self.precision)
 
-    def repeat(self, repeats, axis=None):
-        self.shares0 = np.repeat(self.shares0, repeats, axis=axis)
-        self.shares1 = np.repeat(self.shares1, repeats, axis=axis)
-        if self.mask is not None:
-            self.mask = self.mask.repeat(repeats, axis=axis)
-        if self.masked is not None:
-            self.masked = self.masked.repeat(repeats, axis=axis)
-        return self
+    def repeat(x, repeats, axis=None):
+        return x.view(lambda shares: shares.repeat(repeats, axis=axis))
 
-    def reshape(self, *shape):
-        return PrivateEncodedTensor.from_shares(self.shares0.reshape(*shape), self.shares1.reshape(*shape))
+    def reshape(x, *shape):
+        return x.view(lambda shares: shares.reshape(*shape))
 
     def im2col(x, h_filter, w_filter, padding, strides):
         shares0 = im2col(x.shares0, h_filter, w_filter, padding, strides)
         shares1 = im2col(x.shares1, h_filter, w_filter, padding, strides)
-        return PrivateEncodedTensor.from_shares(shares0, shares1)
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=x.bound, precision=x.precision)
 
     def col2im(x, imshape, field_height, field_width, padding, stride):
+        # overlapping patches are summed up
+        if x.bound * field_height * field_width > HEADROOM: x.reduce()
         shares0 = col2im(x.shares0, imshape, field_height, field_width, padding, stride)
         shares1 = col2im(x.shares1, imshape, field_height, field_width, padding, stride)
-        return PrivateEncodedTensor.from_shares(shares0, shares1)
+        return PrivateEncodedTensor.from_shares(shares0, shares1, bound=x.bound * field_height * field_width,
+                                                precision=x.precision)
+
+
+
+VALUES = (int, float, np.ndarray)
+
+KERNELS.update({
+    ('add', NativeTensor, NativeTensor): NativeTensor.add_native,
+    ('add', NativeTensor, PublicEncodedTensor): NativeTensor.add_encoded,
+    ('add', NativeTensor, PrivateEncodedTensor): NativeTensor.add_encoded,
+    ('sub', NativeTensor, NativeTensor): NativeTensor.sub_native,
+    ('sub', NativeTensor, PublicEncodedTensor): NativeTensor.sub_encoded,
+    ('sub', NativeTensor, PrivateEncodedTensor): NativeTensor.sub_encoded,
+    ('mul', NativeTensor, NativeTensor): NativeTensor.mul_native,
+    ('mul', NativeTensor, PublicEncodedTensor): NativeTensor.mul_encoded,
+    ('mul', NativeTensor, PrivateEncodedTensor): NativeTensor.mul_encoded,
+    ('dot', NativeTensor, NativeTensor): NativeTensor.dot_native,
+    ('dot', NativeTensor, PublicEncodedTensor): NativeTensor.dot_encoded,
+    ('dot', NativeTensor, PrivateEncodedTensor): NativeTensor.dot_encoded,
+    ('div', NativeTensor, NativeTensor): NativeTensor.div_native,
+    ('gt', NativeTensor, NativeTensor): NativeTensor.gt_native,
+    ('pow', NativeTensor, NativeTensor): NativeTensor.pow_native,
+
+    ('add', PublicEncodedTensor, PublicEncodedTensor): PublicEncodedTensor.add_public,
+    ('add', PublicEncodedTensor, PrivateEncodedTensor): PublicEncodedTensor.add_private,
+    ('sub', PublicEncodedTensor, PublicEncodedTensor): PublicEncodedTensor.sub_public,
+    ('sub', PublicEncodedTensor, PrivateEncodedTensor): PublicEncodedTensor.sub_private,
+    ('gt', PublicEncodedTensor, PublicEncodedTensor): PublicEncodedTensor.gt_public,
+    ('mul', PublicEncodedTensor, PublicFieldTensor): PublicEncodedTensor.mul_field,
+    ('mul', PublicEncodedTensor, PublicEncodedTensor): PublicEncodedTensor.mul_public,
+    ('mul', PublicEncodedTensor, PrivateEncodedTensor): PublicEncodedTensor.mul_private,
+    ('dot', PublicEncodedTensor, PublicEncodedTensor): PublicEncodedTensor.dot_public,
+    ('dot', PublicEncodedTensor, PrivateEncodedTensor): PublicEncodedTensor.dot_private,
+    ('div', PublicEncodedTensor, PublicEncodedTensor): PublicEncodedTensor.div_public,
+
+    ('add', PublicFieldTensor, PublicFieldTensor): PublicFieldTensor.add_public,
+    ('add', PublicFieldTensor, PrivateFieldTensor): PublicFieldTensor.add_private,
+    ('mul', PublicFieldTensor, PublicFieldTensor): PublicFieldTensor.mul_public,
+    ('mul', PublicFieldTensor, PrivateFieldTensor): PublicFieldTensor.mul_private,
+    ('dot', PublicFieldTensor, PublicFieldTensor): PublicFieldTensor.dot_public,
+    ('dot', PublicFieldTensor, PrivateFieldTensor): PublicFieldTensor.dot_private,
+
+    ('add', PrivateFieldTensor, PrivateFieldTensor): PrivateFieldTensor.add_private,
+    ('add', PrivateFieldTensor, PrivateEncodedTensor): PrivateFieldTensor.add_private,
+    ('add', PrivateFieldTensor, PublicFieldTensor): PrivateFieldTensor.add_public,
+    ('mul', PrivateFieldTensor, PublicFieldTensor): PrivateFieldTensor.mul_public,
+    ('dot', PrivateFieldTensor, PublicFieldTensor): PrivateFieldTensor.dot_public,
+    ('dot', PrivateFieldTensor, PrivateFieldTensor): PrivateFieldTensor.dot_private,
+
+    ('add', PrivateEncodedTensor, PublicEncodedTensor): PrivateEncodedTensor.add_public,
+    ('add', PrivateEncodedTensor, PrivateEncodedTensor): PrivateEncodedTensor.add_private,
+    ('sub', PrivateEncodedTensor, PublicEncodedTensor): PrivateEncodedTensor.sub_public,
+    ('sub', PrivateEncodedTensor, PrivateEncodedTensor): PrivateEncodedTensor.sub_private,
+    ('sub', PrivateEncodedTensor, PrivateFieldTensor): PrivateEncodedTensor.sub_field,
+    ('mul', PrivateEncodedTensor, PublicEncodedTensor): PrivateEncodedTensor.mul_public,
+    ('mul', PrivateEncodedTensor, PrivateEncodedTensor): PrivateEncodedTensor.mul_private,
+    ('mul', PrivateEncodedTensor, PrivateFieldTensor): PrivateEncodedTensor.mul_private_field,
+    ('mul', PrivateEncodedTensor, PublicFieldTensor): PrivateEncodedTensor.mul_public_field,
+    ('dot', PrivateEncodedTensor, PublicEncodedTensor): PrivateEncodedTensor.dot_public,
+    ('dot', PrivateEncodedTensor, PrivateEncodedTensor): PrivateEncodedTensor.dot_private,
+    ('div', PrivateEncodedTensor, PublicEncodedTensor): PrivateEncodedTensor.div_public,
+})
+
+# plain values skip the wrapping for native tensors and are encoded as public tensors otherwise
+KERNELS.update({(op, NativeTensor, value): getattr(NativeTensor, op + '_value')
+                for op in ['add', 'sub', 'mul', 'dot', 'div', 'gt', 'pow'] for value in VALUES})
+KERNELS.update({(op, cls, value): encoding(KERNELS[(op, cls, PublicEncodedTensor)])
+                for op in ['add', 'sub', 'mul', 'dot', 'div', 'gt'] for cls in [PublicEncodedTensor, PrivateEncodedTensor]
+                for value in VALUES + (NativeTensor,) if (op, cls, PublicEncodedTensor) in KERNELS})
+KERNELS.update({('mul', PrivateEncodedTensor, value): PrivateEncodedTensor.mul_scalar for value in (int, float)})
+
+
+def broadcast_shape(*shapes):
+    return np.broadcast(*[np.broadcast_to(False, shape) for shape in shapes]).shape
+
+
+def reduced_shape(shape, axis, keepdims):
+    axes = range(len(shape)) if axis is None else [a % len(shape) for a in np.atleast_1d(axis)]
+    return tuple(1 if i in axes else n for i, n in enumerate(shape) if keepdims or i not in axes)
+
+
+class LazyPrivateEncodedTensor(PrivateEncodedTensor):
+    """
+    PrivateEncodedTensor that records additions, subtractions, negations, multiplications and sums instead of
+    running them. A recorded tensor is computed in place the first time anything needs its shares, e.g. reveal,
+    unwrap or any operation that is not recorded, and only the operations it depends on run. Chains of additions
+    and subtractions are accumulated into one pair of share arrays, with public terms folded into one constant and
+    no truncation in between, and the same sum of a tensor is recorded only once.
+    Use it as the initializer of a model to switch the layers to lazy evaluation.
+    """
+
+    def __init__(self, values, shares0=None, shares1=None, mask=None, masked=None, bound=None, precision=None):
+        super().__init__(values, shares0, shares1, mask, masked, bound, precision)
+        self.init_graph(None, None)
+
+    def init_graph(self, node, shape):
+        # (op, args, kwargs) of a tensor that is not computed yet
+        self.node = node
+        self.node_shape = shape
+        # number of recorded operations on this tensor, the ones that are not computed yet, and recorded sums
+        self.consumers = 0
+        self.pending = weakref.WeakSet()
+        self.reductions = {}
+        self.reduced_from = None
+
+    @staticmethod
+    def from_values(values, precision=None):
+        return LazyPrivateEncodedTensor(values, precision=precision)
+
+    @staticmethod
+    def record(op, args, shape, **kwargs):
+        result = LazyPrivateEncodedTensor.__new__(LazyPrivateEncodedTensor)
+        result.init_graph((op, args, kwargs), tuple(shape))
+        for arg in args:
+            if isinstance(arg, LazyPrivateEncodedTensor):
+                arg.consumers += 1
+                arg.pending.add(result)
+        return result
+
+    def __getattr__(self, name):
+        # only called for missing attributes, i.e. the shares, bound etc. of a tensor that is not computed yet
+        if name.startswith('__') or self.__dict__.get('node') is None: raise AttributeError(name)
+        self.evaluate()
+        return getattr(self, name)
+
+    def __repr__(self):
+        if self.node is not None: return "LazyPrivateEncodedTensor(%s, %s)" % (self.node[0], self.node_shape)
+        return super().__repr__()
+
+    @property
+    def shape(self):
+        if self.node is not None: return self.node_shape
+        return self.shares1.shape
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    def evaluate(self):
+        """
+        Compute the tensor from the recorded operations it depends on, in place
+        :return: self
+        """
+        if self.node is None: return self
+        op, args, kwargs = self.node
+        if op in ('add', 'sub', 'neg'):
+            result = self.accumulate()
+        else:
+            LazyPrivateEncodedTensor.mask_products(args)
+            args = [arg.evaluate() if isinstance(arg, LazyPrivateEncodedTensor) else arg for arg in args]
+            op, _, kwargs = self.node
+            result = getattr(PrivateEncodedTensor, op)(*args, **kwargs)
+        # dropping the node frees the intermediates nothing else refers to
+        self.__dict__.update(result.__dict__)
+        self.node = None
+        return self
+
+    def accumulate(self):
+        # additions, subtractions and negations that nothing else uses are flattened into one signed sum
+        privates, publics = [], []
+
+        def collect(t, sign):
+            if isinstance(t, LazyPrivateEncodedTensor) and t.node is not None and t.node[0] in ('add', 'sub', 'neg') \
+                    and (t is self or t.consumers == 1):
+                op, args, _ = t.node
+                collect(args[0], -sign if op == 'neg' else sign)
+                if op != 'neg': collect(args[1], sign if op == 'add' else -sign)
+            elif isinstance(t, PublicEncodedTensor):
+                publics.append((sign, t))
+            else:
+                privates.append((sign, t))
+
+        collect(self, 1)
+        LazyPrivateEncodedTensor.mask_products([t for _, t in privates])
+        privates = [(sign, t.evaluate() if isinstance(t, LazyPrivateEncodedTensor) else t) for sign, t in privates]
+        constant = None
+        for sign, t in publics:
+            if constant is None and sign < 0: constant = PublicEncodedTensor.from_elements(zeros(t.shape), t.precision)
+            if constant is None: constant = t
+            else: constant = constant.add(t) if sign > 0 else constant.sub(t)
+        if constant is not None: privates.append((1, constant))
+
+        # the first term is only copied once something is added to it, later terms are added in place
+        result, owned = None, False
+        for sign, t in privates:
+            operation = PrivateEncodedTensor.add if sign > 0 else PrivateEncodedTensor.sub
+            if result is None:
+                result, owned = (t, False) if sign > 0 else (PrivateEncodedTensor.neg(t), True)
+            elif owned and broadcast_shape(result.shape, t.shape) == result.shape:
+                operation(result, t, out=result)
+            else:
+                result, owned = operation(result, t), True
+        if not owned: result = PrivateEncodedTensor.copy(result)
+        return result
+
+    @staticmethod
+    def mask_products(tensors):
+        """
+        Reveal the masked factors of all recorded Beaver products among `tensors` before computing any of them, so
+        that the reveals of independent products are sent in the same round
+        """
+        for t in tensors:
+            if not isinstance(t, LazyPrivateEncodedTensor) or t.node is None or t.node[0] not in ('mul', 'square'):
+                continue
+            op, args, _ = t.node
+            x, y = (args[0], args[0]) if op == 'square' else args
+            if not isinstance(y, PrivateEncodedTensor): continue
+            if isinstance(x, LazyPrivateEncodedTensor): x.evaluate()
+            if isinstance(y, LazyPrivateEncodedTensor): y.evaluate()
+            x, y = fit_product(x, y)
+            for z in (x, y):
+                if z.mask is None or z.masked is None:
+                    z.mask, = generate_mask(z.shape)
+                    z.masked = (z - z.mask).reveal()
+            # a square is the product of x with itself under the same mask
+            t.node = ('mul', [x, y], dict(reuse_mask=True))
+
+    def invalidate(self):
+        # recorded operations on this tensor have to see its old value
+        for consumer in list(self.pending): consumer.evaluate()
+        self.reductions = {}
+        if self.reduced_from is not None:
+            source, key = self.reduced_from
+            if source.reductions.get(key) is self: del source.reductions[key]
+
+    def add(x, y, out=None):
+        if out is not None:
+            if isinstance(out, LazyPrivateEncodedTensor): out.invalidate()
+            return super().add(y, out=out)
+        y = wrap_if_needed(y)
+        if not isinstance(y, (PublicEncodedTensor, PrivateEncodedTensor)): return super().add(y)
+        return LazyPrivateEncodedTensor.record('add', [x, y], broadcast_shape(x.shape, y.shape))
+
+    def sub(x, y, out=None):
+        if out is not None:
+            if isinstance(out, LazyPrivateEncodedTensor): out.invalidate()
+            return super().sub(y, out=out)
+        y = wrap_if_needed(y)
+        if not isinstance(y, (PublicEncodedTensor, PrivateEncodedTensor)): return super().sub(y)
+        return LazyPrivateEncodedTensor.record('sub', [x, y], broadcast_shape(x.shape, y.shape))
+
+    def neg(x, out=None):
+        if out is not None:
+            if isinstance(out, LazyPrivateEncodedTensor): out.invalidate()
+            return super().neg(out=out)
+        return LazyPrivateEncodedTensor.record('neg', [x], x.shape)
+
+    def mul(x, y, precomputed=None, reuse_mask=None):
+        # scalars are recorded as they are to keep the fast path of mul_scalar
+        if not isinstance(y, (int, float)): y = wrap_if_needed(y)
+        if precomputed is not None or reuse_mask is not None or \
+                not isinstance(y, (int, float, PublicEncodedTensor, PrivateEncodedTensor)):
+            return super().mul(y, precomputed, reuse_mask)
+        return LazyPrivateEncodedTensor.record('mul', [x, y], broadcast_shape(x.shape, np.shape(y)))
+
+    def square(x):
+        return LazyPrivateEncodedTensor.record('square', [x], x.shape)
+
+    def sum(x, axis, keepdims=False):
+        key = (None if axis is None else tuple(np.atleast_1d(axis).tolist()), keepdims)
+        if key not in x.reductions:
+            result = LazyPrivateEncodedTensor.record('sum', [x], reduced_shape(x.shape, axis, keepdims), axis=axis,
+                                                     keepdims=keepdims)
+            result.reduced_from = (x, key)
+            x.reductions[key] = result
+        return x.reductions[key]
+
+    def __setitem__(self, idx, other):
+        self.invalidate()
+        super().__setitem__(idx, other)
 
 
 
@@ -1076,6 +2198,11 @@ NEXT_ID = 0
 
 
 class AnalyticTensor:
+    """
+    Symbolic tensor that records the operations applied to it in ANALYTIC_STORE and only keeps track of shapes.
+    To dry-run encoded tensors and pond.nn models as they are, use the 'analytic' backend instead, see
+    pond.triples.trace.
+    """
 
     def __init__(self, values, shape=None, ident=None):
         if values is not None:
@@ -1086,7 +2213,7 @@ class AnalyticTensor:
             global NEXT_ID
             ident = "tensor_%d" % NEXT_ID
             NEXT_ID += 1
-        self.shape = shape
+        self.shape = tuple(shape)
         self.ident = ident
 
     @staticmethod
@@ -1097,11 +2224,11 @@ class AnalyticTensor:
         return "AnalyticTensor(%s, %s)" % (self.shape, self.ident)
 
     def __getitem__(self, index):
-        start, stop, _ = index.indices(self.shape[0])
-        shape = list(self.shape)
-        shape[0] = stop - start
-        ident = "%s_%d,%d" % (self.ident, start, stop)
-        return AnalyticTensor.from_shape(tuple(shape), ident)
+        shape = AnalyticArray(self.shape)[index].shape
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(self.shape[0])
+            return AnalyticTensor.from_shape(shape, "%s_%d,%d" % (self.ident, start, stop))
+        return AnalyticTensor.from_shape(shape, "%s_%s" % (self.ident, index))
 
     @staticmethod
     def reset():
@@ -1113,9 +2240,22 @@ class AnalyticTensor:
         global ANALYTIC_STORE
         return ANALYTIC_STORE
 
+    @staticmethod
+    def record(op, shape, *operands):
+        ANALYTIC_STORE.append((op,) + operands)
+        return AnalyticTensor.from_shape(shape)
+
     @property
     def size(self):
-        return np.prod(self.shape)
+        return int(np.prod(self.shape))
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def elements(self):
+        # shape-only array to work out the shapes of results with
+        return AnalyticArray(self.shape)
 
     def reveal(self):
         return self
@@ -1127,46 +2267,66 @@ class AnalyticTensor:
 
     def add(x, y):
         y = AnalyticTensor.wrap_if_needed(y)
-        ANALYTIC_STORE.append(('add', x, y))
-        return AnalyticTensor.from_shape(x.shape)
+        return AnalyticTensor.record('add', broadcast_shape(x.shape, y.shape), x, y)
 
     def __add__(x, y):
         return x.add(y)
 
     def sub(x, y):
         y = AnalyticTensor.wrap_if_needed(y)
-        ANALYTIC_STORE.append(('sub', x, y))
-        return AnalyticTensor.from_shape(x.shape)
+        return AnalyticTensor.record('sub', broadcast_shape(x.shape, y.shape), x, y)
 
     def __sub__(x, y):
         return x.sub(y)
 
     def mul(x, y):
         y = AnalyticTensor.wrap_if_needed(y)
-        ANALYTIC_STORE.append(('mul', x, y))
-        return AnalyticTensor.from_shape(x.shape)
+        return AnalyticTensor.record('mul', broadcast_shape(x.shape, y.shape), x, y)
 
     def __mul__(x, y):
         return x.mul(y)
 
+    def square(x):
+        return AnalyticTensor.record('square', x.shape, x)
+
     def dot(x, y):
         y = AnalyticTensor.wrap_if_needed(y)
-        ANALYTIC_STORE.append(('dot', x, y))
-        return AnalyticTensor.from_shape(x.shape)
+        return AnalyticTensor.record('dot', x.elements().dot(y.elements()).shape, x, y)
 
     def div(x, y):
         y = AnalyticTensor.wrap_if_needed(y)
-        ANALYTIC_STORE.append(('div', x, y))
-        return AnalyticTensor.from_shape(x.shape)
+        return AnalyticTensor.record('div', broadcast_shape(x.shape, y.shape), x, y)
 
     def neg(self):
-        ANALYTIC_STORE.append(('neg', self))
-        return AnalyticTensor.from_shape(self.shape)
+        return AnalyticTensor.record('neg', self.shape, self)
 
-    def transpose(self):
-        ANALYTIC_STORE.append(('transpose', self))
-        return self
+    def transpose(self, *axes):
+        return AnalyticTensor.record('transpose', self.elements().transpose(*axes).shape, self)
+
+    def sum(self, axis=None, keepdims=False):
+        return AnalyticTensor.record('sum', reduced_shape(self.shape, axis, keepdims), self)
 
-    def sum(self, _):
-        ANALYTIC_STORE.append(('sum', self))
-        return AnalyticTensor.from_shape(self.shape)
+    def reshape(self, *shape):
+        return AnalyticTensor.record('reshape', self.elements().reshape(*shape).shape, self)
+
+    def repeat(self, repeats, axis=None):
+        return AnalyticTensor.record('repeat', self.elements().repeat(repeats, axis).shape, self)
+
+    def expand_dims(self, axis):
+        return AnalyticTensor.record('expand_dims', arrays.expand_dims(self.elements(), axis).shape, self)
+
+    def im2col(x, h_filter, w_filter, padding, strides):
+        return AnalyticTensor.record('im2col', x.elements().im2col(h_filter, w_filter, padding, strides).shape, x)
+
+    def col2im(x, imshape, field_height, field_width, padding, stride):
+        return AnalyticTensor.record('col2im', tuple(imshape), x)
+
+    def conv2d(x, filters, strides, padding):
+        """
+        :param filters: AnalyticTensor of shape (height, width, channels, n_filters), as in nn.Conv2D
+        :return: AnalyticTensor of shape (batch, n_filters, height out, width out)
+        """
+        h_filter, w_filter, _, n_filters = filters.shape
+        h_out = int((x.shape[2] - h_filter + 2 * padding) / strides + 1)
+        w_out = int((x.shape[3] - w_filter + 2 * padding) / strides + 1)
+        return AnalyticTensor.record('conv2d', (x.shape[0], n_filters, h_out, w_out), x, filters)
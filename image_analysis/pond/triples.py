@@ -0,0 +1,418 @@
+"""
+Offline generation of Beaver triples: record which triples a training step generates, generate them for many steps
+in worker processes and serve them to the online phase through pond.tensor.TRIPLE_SOURCE.
+"""
+import os
+import copy
+import uuid
+import weakref
+import multiprocessing
+from collections import defaultdict, deque
+
+import numpy as np
+
+import pond.tensor as tensor
+from pond import arrays
+from pond.arrays import RNSArray, Ring64Array, AnalyticArray, RNS_MODULI
+
+# bytes per field element of the stored shares of each backend, see write_array
+ELEMENT_BYTES = {'object': arrays.FIXED_BYTES, 'rns': 8 * len(RNS_MODULI), 'ring64': 8}
+
+
+class TriplePlan:
+    """
+    Triples generated by one training step, in order, as (kind, params, inputs) calls of the generators in
+    pond.tensor. `inputs` refers to the given shares as (name, (call, position)) pairs: position in the triple
+    returned by an earlier call. Triples derived from shares that no triple of the plan returned, such as the masks
+    of lazy tensors, depend on the online phase and are left out.
+    """
+
+    def __init__(self):
+        self.calls = []
+        # call and position of the first triple returned each share, by id
+        self.outputs = {}
+        # the recorded triples, kept alive so that ids are not reused while recording
+        self.triples = []
+
+    def __len__(self):
+        return len(self.calls)
+
+    @staticmethod
+    def record(step):
+        """
+        :param step: function running one training step
+        """
+        plan, source = TriplePlan(), tensor.TRIPLE_SOURCE
+        tensor.TRIPLE_SOURCE = plan
+        try:
+            step()
+        finally:
+            tensor.TRIPLE_SOURCE = source
+        plan.outputs, plan.triples = {}, []
+        return plan
+
+    def take(self, kind, params, shares):
+        return None
+
+    def generated(self, kind, params, shares, triple):
+        inputs = []
+        for name, share in shares:
+            if share is None: continue
+            if id(share) not in self.outputs: return
+            inputs.append((name, self.outputs[id(share)]))
+        for position, share in enumerate(triple):
+            self.outputs.setdefault(id(share), (len(self.calls), position))
+        self.calls.append((kind, params, tuple(inputs)))
+        self.triples.append(triple)
+
+
+class Manifest:
+    """
+    Triples and reveals of one training step, from a dry run with trace. `triples` holds (kind, params, shapes) for
+    every triple generated, in order, with the shapes of its shares and None for the shares it was given; `reveals`
+    holds the shapes revealed in each round of communication. `plan` is the TriplePlan of the step.
+    """
+
+    def __init__(self):
+        self.plan = TriplePlan()
+        self.triples = []
+        self.reveals = []
+        # field elements of the triples held as arrays rather than seeds, summed over both parties
+        self.materialized = 0
+
+    def __repr__(self):
+        return "Manifest(%d triples, %d elements, %d rounds, %d revealed)" % (
+            len(self.triples), self.elements(), self.rounds, self.revealed())
+
+    @property
+    def rounds(self):
+        return len(self.reveals)
+
+    def elements(self):
+        # field elements of the triples, per party
+        return sum(int(np.prod(shape)) for _, _, shapes in self.triples for shape in shapes if shape is not None)
+
+    def revealed(self):
+        return sum(int(np.prod(shape)) for shapes in self.reveals for shape in shapes)
+
+    def nbytes(self, backend=None):
+        """
+        :param backend: key of pond.tensor.BACKENDS, by default the current one
+        :return: bytes a TripleStore takes for the triples of the step, for both parties, not counting seeds
+        """
+        return self.materialized * ELEMENT_BYTES[backend or tensor.BACKEND]
+
+    def take(self, kind, params, shares):
+        return None
+
+    def generated(self, kind, params, shares, triple):
+        self.plan.generated(kind, params, shares, triple)
+        given = [share for _, share in shares if share is not None]
+        shapes = tuple(None if any(share is g for g in given) else share.shape for share in triple)
+        self.triples.append((kind, params, shapes))
+        self.materialized += sum(int(np.prod(shape)) * ((share.seed0 is None) + (share.seed1 is None))
+                                 for share, shape in zip(triple, shapes) if shape is not None)
+
+
+class TripleQueue:
+    """
+    Triples generated ahead of time, served first in first out for the same kind and parameters. A triple derived
+    from given shares is only served for exactly those shares, and dropped once nothing else refers to them.
+    """
+
+    def __init__(self):
+        self.triples = defaultdict(deque)
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.triples.values())
+
+    def put(self, calls, triples):
+        """
+        :param calls: TriplePlan.calls
+        :param triples: one triple per call, e.g. from generate_step
+        :return: whether the triples were stored
+        """
+        for (kind, params, inputs), triple in zip(calls, triples):
+            given = {name: weakref.ref(triples[call][position]) for name, (call, position) in inputs}
+            self.triples[(kind, params)].append((given, triple))
+        return True
+
+    def take(self, kind, params, shares):
+        queue = self.triples.get((kind, params))
+        if not queue: return None
+        queue = self.triples[(kind, params)] = deque((given, triple) for given, triple in queue
+                                                     if all(ref() is not None for ref in given.values()))
+        for index, (given, triple) in enumerate(queue):
+            if all((given[name]() if name in given else None) is share for name, share in shares):
+                del queue[index]
+                return triple
+        return None
+
+    def generated(self, kind, params, shares, triple):
+        pass
+
+
+class TripleStore:
+    """
+    Triples kept in memory-mapped files below `directory`, with the shares of each party in a directory of its
+    own, served like from TripleQueue. Files are deleted once their triple is served, and no more triples are stored
+    while their files would take more than `capacity` bytes.
+    Only the limbs of the rns and ring64 backends are served as the mapped files themselves; the object backend
+    converts the shares of a triple into Python integers when it is taken, so that its triples take the usual memory
+    while in use and the store only saves the memory of the triples waiting on disk.
+    """
+
+    def __init__(self, directory, capacity=None):
+        self.directory = directory
+        self.capacity = capacity
+        for party in (0, 1): os.makedirs(os.path.join(directory, 'party%d' % party), exist_ok=True)
+        # records of the stored triples by (kind, params), see write_step
+        self.index = defaultdict(deque)
+        self.size = 0
+        # the shares served so far by (step, call, position), to recognize them when they are given
+        self.served = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return sum(len(records) for records in self.index.values())
+
+    def put(self, calls, triples):
+        return self.put_records(calls, write_step(self.directory, calls, triples))
+
+    def put_records(self, calls, records):
+        """
+        :param records: write_step of the triples of `calls`
+        :return: whether the triples were stored, they are deleted if not
+        """
+        size = sum(record['size'] for record in records)
+        if self.capacity is not None and self.size + size > self.capacity:
+            for record in records: evict(self.directory, record)
+            return False
+        for (kind, params, _), record in zip(calls, records):
+            self.index[(kind, params)].append(record)
+        self.size += size
+        return True
+
+    def take(self, kind, params, shares):
+        records = self.index.get((kind, params))
+        if not records: return None
+        for index, record in enumerate(records):
+            if all(self.served.get(record['given'].get(name)) is share for name, share in shares):
+                del records[index]
+                break
+        else:
+            return None
+        given = {name: self.served[ref] for name, ref in record['given'].items()}
+        triple = tuple(given[meta] if isinstance(meta, str) else load_share(self.directory, meta)
+                       for meta in record['shares'])
+        evict(self.directory, record)
+        self.size -= record['size']
+        for position, share in enumerate(triple):
+            self.served.setdefault(record['step'] + (position,), share)
+        return triple
+
+    def generated(self, kind, params, shares, triple):
+        pass
+
+
+def write_array(path, array):
+    # stores limbs as they are and Python integers with a fixed width
+    if isinstance(array, np.ndarray) and array.dtype == object: array = arrays.to_fixed(array)
+    elif isinstance(array, (RNSArray, Ring64Array)): array = array.limbs
+    np.save(path, array)
+    return array.nbytes
+
+
+def read_array(path, cls, reduced):
+    # copy-on-write mapping: the shares can be written in place without touching the file; Python integers are
+    # converted from it right away
+    data = np.load(path, mmap_mode='c')
+    if cls is RNSArray: return RNSArray(data, reduced)
+    if cls is Ring64Array: return Ring64Array(data)
+    return arrays.from_fixed(data)
+
+
+def write_step(directory, calls, triples):
+    """
+    Write the shares of the triples of one step to files below `directory`, can be run in a worker process
+    :return: one record per call; the positions of given shares returned again are stored as their names
+    """
+    step = uuid.uuid4().hex
+    records = []
+    for call, ((kind, params, inputs), triple) in enumerate(zip(calls, triples)):
+        given = {name: triples[c][position] for name, (c, position) in inputs}
+        record = dict(step=(step, call), given={name: (step,) + ref for name, ref in inputs}, shares=[], size=0)
+        for position, share in enumerate(triple):
+            names = [name for name, tensor_ in given.items() if tensor_ is share]
+            if names:
+                record['shares'].append(names[0])
+                continue
+            name = '%s_%d_%d.npy' % (step, call, position)
+            meta = dict(name=name, bound=share.bound, seed0=share.seed0, seed1=share.seed1)
+            # shares given by a seed are stored as the seed
+            for party, seed, shares in ((0, share.seed0, share.expanded0), (1, share.seed1, share.expanded1)):
+                if seed is not None: continue
+                meta.update(cls=type(shares), reduced=getattr(shares, 'reduced', True))
+                record['size'] += write_array(os.path.join(directory, 'party%d' % party, name), shares)
+            record['shares'].append(meta)
+        records.append(record)
+    return records
+
+
+def load_share(directory, meta):
+    shares = [meta['seed%d' % party] for party in (0, 1)]
+    for party in (0, 1):
+        if shares[party] is None: shares[party] = read_array(os.path.join(directory, 'party%d' % party, meta['name']),
+                                                             meta['cls'], meta['reduced'])
+    return tensor.PrivateFieldTensor.from_shares(shares[0], shares[1], meta['bound'])
+
+
+def evict(directory, record):
+    for meta in record['shares']:
+        if isinstance(meta, str): continue
+        for party in (0, 1):
+            path = os.path.join(directory, 'party%d' % party, meta['name'])
+            if os.path.exists(path): os.remove(path)
+
+
+class TriplePrefetcher(TripleQueue):
+    """
+    Generates the triples of the coming training steps in worker processes while the current step runs. The first
+    step records which triples a step generates, after that the triples of up to `depth` steps are kept ready or
+    in the making. Triples that are not ready when they are needed are generated inline.
+    Call `step` at the start of every training step and `close` at the end, or pass it to Sequential.fit.
+    """
+
+    def __init__(self, depth=2, processes=None):
+        super().__init__()
+        self.depth = depth
+        self.plan, self.recording = None, False
+        self.pool = multiprocessing.Pool(processes, start_worker, (tensor.BACKEND, tensor.SEED_COMPRESSION))
+        # AsyncResult of each step being generated, and the number of steps in the queue
+        self.pending = deque()
+        self.ready = 0
+        self.hits, self.misses = 0, 0
+
+    def step(self):
+        if self.plan is None:
+            self.plan, self.recording = TriplePlan(), True
+            return
+        if self.recording:
+            self.plan.outputs, self.plan.triples, self.recording = {}, [], False
+        while self.pending and self.pending[0].ready():
+            self.put(self.plan.calls, self.pending.popleft().get())
+            self.ready += 1
+        # the triples of a step are used up once the next one starts, whether they were served or not
+        self.ready = max(self.ready - 1, 0)
+        while self.plan.calls and len(self.pending) + self.ready < self.depth:
+            task = (self.plan.calls, tensor.PRGS['dealer'].new_seed(), None)
+            self.pending.append(self.pool.apply_async(generate_step, (task,)))
+
+    def take(self, kind, params, shares):
+        triple = super().take(kind, params, shares)
+        if triple is None: self.misses += 1
+        else: self.hits += 1
+        return triple
+
+    def generated(self, kind, params, shares, triple):
+        if self.recording: self.plan.generated(kind, params, shares, triple)
+
+    def close(self):
+        self.pool.terminate()
+
+
+def start_worker(backend, seed_compression):
+    tensor.set_backend(backend)
+    tensor.SEED_COMPRESSION = seed_compression
+    tensor.TRIPLE_SOURCE = None
+
+
+def generate_step(task):
+    """
+    Generate the triples of one training step, in a worker process
+    :param task: (TriplePlan.calls, dealer seed, directory of a TripleStore or None)
+    :return: one triple per call, or their records if they were written to a TripleStore
+    """
+    calls, seed, directory = task
+    tensor.set_seed(seed)
+    triples = []
+    for kind, params, inputs in calls:
+        shares = {name: triples[call][position] for name, (call, position) in inputs}
+        triples.append(tensor.TRIPLE_GENERATORS[kind](**dict(params), **shares))
+    if directory is not None: return write_step(directory, calls, triples)
+    return triples
+
+
+def training_step(model, x, y, loss):
+    # one step of Sequential.fit that leaves the weights as they are
+    y_pred = model.forward(x)
+    loss.evaluate(y_pred, y).unwrap()
+    model.backward(loss.derive(y_pred, y), 0)
+
+
+def analytic(value, memo):
+    # copy of the models, layers and tensors in `value` with shares of nothing but the shape, see AnalyticArray
+    if id(value) in memo: return memo[id(value)]
+    if isinstance(value, tensor.PrivateEncodedTensor):
+        result = type(value)(None, AnalyticArray(value.shape), AnalyticArray(value.shape), precision=value.precision)
+    elif isinstance(value, tensor.PublicEncodedTensor):
+        result = tensor.PublicEncodedTensor.from_elements(AnalyticArray(value.shape), value.precision)
+    elif isinstance(value, list):
+        result = memo[id(value)] = []
+        result.extend(analytic(item, memo) for item in value)
+    elif type(value).__module__ == 'pond.nn':
+        result = memo[id(value)] = copy.copy(value)
+        result.__dict__ = {name: analytic(item, memo) for name, item in vars(value).items()}
+    else:
+        result = value
+    memo[id(value)] = result
+    return result
+
+
+def trace(model, x, y, loss):
+    """
+    Dry-run one training step of `model` on the 'analytic' backend, which works out shapes and nothing else
+    :param x: input batch of the size and type used for training, only its shape and type matter
+    :param y: labels of the batch
+    :return: Manifest of the step
+    """
+    manifest, memo = Manifest(), {}
+    tensor.flush_reveals()
+    backend, source, log = tensor.BACKEND, tensor.TRIPLE_SOURCE, tensor.REVEAL_LOG
+    tensor.set_backend('analytic')
+    tensor.TRIPLE_SOURCE, tensor.REVEAL_LOG = manifest, manifest.reveals
+    try:
+        # revealed values are zeros, which public computations on them may divide by
+        with np.errstate(all='ignore'):
+            training_step(analytic(model, memo), analytic(x, memo), analytic(y, memo), loss)
+        tensor.flush_reveals()
+    finally:
+        tensor.set_backend(backend)
+        tensor.TRIPLE_SOURCE, tensor.REVEAL_LOG = source, log
+    manifest.plan.outputs, manifest.plan.triples = {}, []
+    return manifest
+
+
+def precompute(model, x, y, loss, steps, processes=None, store=None):
+    """
+    Offline phase: generate the triples of `steps` training steps of `model` in worker processes and serve them
+    to the online phase from now on. Steps beyond those, and triples left out of the plan, are generated inline.
+    :param x: input batch of the size and type used for training
+    :param y: labels of the batch
+    :param processes: number of worker processes, by default one per core
+    :param store: TripleStore the workers write the triples to, stops at its capacity; None keeps them in memory
+    :return: TripleQueue or `store`, installed as pond.tensor.TRIPLE_SOURCE
+    """
+    plan = trace(model, x, y, loss).plan
+    queue = TripleQueue() if store is None else store
+    directory = None if store is None else store.directory
+    tasks = [(plan.calls, tensor.PRGS['dealer'].new_seed(), directory) for _ in range(steps)]
+    if processes is None: processes = os.cpu_count()
+    with multiprocessing.Pool(processes, start_worker, (tensor.BACKEND, tensor.SEED_COMPRESSION)) as pool:
+        # one step per worker at a time, so that no files are left behind once the store is full
+        for start in range(0, steps, processes):
+            results = pool.map(generate_step, tasks[start:start + processes])
+            stored = [queue.put(plan.calls, result) if store is None else store.put_records(plan.calls, result)
+                      for result in results]
+            if not all(stored): break
+    tensor.TRIPLE_SOURCE = queue
+    return queue
@@ -0,0 +1,205 @@
+"""
+Binary encoding of share arrays for sockets: a header with the representation, which fixes the dtype and number of
+limbs, and the shape, followed by the elements in a fixed-width little-endian layout. Shares given by a seed
+(pond.tensor.SeededElements) are sent as the seed, the shape it is sampled with and the rearrangements applied to it.
+
+The elements are written straight from the memory of the array and read into preallocated buffers, so that large
+shares cross a socket without being copied into intermediate bytes. When both ends know the representation and
+shape of what comes next, as the parties do for the shares of a reveal, the header can be left out.
+"""
+import ast
+import struct
+from collections import defaultdict
+
+import numpy as np
+
+from pond import arrays
+from pond.arrays import RNSArray, Ring64Array, RNS_MODULI, RNS_MODULUS
+from pond.prg import SEED_BYTES
+from pond.tensor import SeededElements
+
+# representation (OBJECT, RNS, RING64 or SEEDED) and number of dimensions, followed by one uint64 per dimension
+HEADER = struct.Struct('<BB')
+OBJECT, RNS, RING64, SEEDED = 0, 1, 2, 3
+# length of the rearrangements of a seeded share, written as a Python literal
+OPS = struct.Struct('<H')
+# buffers per sendmsg, below the IOV_MAX of common platforms
+MAX_BUFFERS = 512
+
+
+def representation(array):
+    if isinstance(array, SeededElements): return SEEDED
+    if isinstance(array, RNSArray): return RNS
+    if isinstance(array, Ring64Array): return RING64
+    return OBJECT
+
+
+def pack_header(code, shape):
+    return HEADER.pack(code, len(shape)) + struct.pack('<%dQ' % len(shape), *shape)
+
+
+def pack_buffers(array, header=True):
+    """
+    :param array: numpy array of Python integers below 2^128, RNSArray, Ring64Array or SeededElements
+    :param header: whether to start with the header, which the receiver can only do without if it knows the
+        representation and shape of the array; SeededElements always have it
+    :return: bytes-like objects to write one after the other, the elements being a view of the memory of the array
+        where it is already in the wire layout
+    """
+    code = representation(array)
+    if code == SEEDED:
+        ops = repr(array.ops).encode()
+        return [pack_header(SEEDED, array.sample_shape) + array.seed + OPS.pack(len(ops)) + ops]
+    if code == RNS: data = (array % RNS_MODULUS).limbs
+    elif code == RING64: data = array.limbs
+    else: data = arrays.to_fixed(array)
+    data = memoryview(np.ascontiguousarray(data, dtype=data.dtype.newbyteorder('<'))).cast('B')
+    return [pack_header(code, array.shape), data] if header else [data]
+
+
+def pack_array(array):
+    """
+    :param array: numpy array of Python integers below 2^128, RNSArray, Ring64Array or SeededElements
+    :return: bytes
+    """
+    return b''.join(pack_buffers(array))
+
+
+def send_buffers(connection, buffers):
+    # write bytes-like objects to a blocking socket with as few system calls as possible, without joining them
+    buffers = [memoryview(buffer).cast('B') for buffer in buffers]
+    while buffers:
+        sent = connection.sendmsg(buffers[:MAX_BUFFERS])
+        while buffers and sent >= len(buffers[0]):
+            sent -= len(buffers.pop(0))
+        if sent: buffers[0] = buffers[0][sent:]
+
+
+def nbytes(array):
+    # size of the elements of `array` once packed
+    if isinstance(array, SeededElements): return SEED_BYTES
+    if isinstance(array, (RNSArray, Ring64Array)): return array.limbs.nbytes
+    return arrays.FIXED_BYTES * array.size
+
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+    if len(data) < size: raise EOFError("connection closed")
+    return data
+
+
+def read_into(stream, buffer):
+    # fill a writeable numpy array with the next bytes of the stream
+    view = memoryview(buffer).cast('B')
+    filled = 0
+    while filled < len(view):
+        count = stream.readinto(view[filled:])
+        if not count: raise EOFError("connection closed")
+        filled += count
+    return buffer
+
+
+async def read_into_async(loop, connection, buffer):
+    # fill a writeable buffer with the next bytes of a non-blocking socket; loop.sock_recv_into needs Python 3.7,
+    # so the received chunks are copied in
+    view = memoryview(buffer).cast('B')
+    filled = 0
+    while filled < len(view):
+        chunk = await loop.sock_recv(connection, len(view) - filled)
+        if not chunk: raise EOFError("connection closed")
+        view[filled:filled + len(chunk)] = chunk
+        filled += len(chunk)
+    return buffer
+
+
+class ReceiveBuffers:
+    """
+    Buffers to read elements into, kept by dtype and shape: `take` hands out a buffer given back with `release`
+    if there is one, so that reveals of the same shapes, as in every training step, are read into the same memory.
+    Only buffers this handed out are taken back.
+    """
+
+    def __init__(self):
+        self.free = defaultdict(list)
+        self.taken = {}
+
+    def take(self, dtype, shape):
+        free = self.free[(dtype, shape)]
+        buffer = free.pop() if free else np.empty(shape, dtype=dtype)
+        self.taken[id(buffer)] = buffer
+        return buffer
+
+    def release(self, array):
+        """
+        Give back the buffer of an array read into it once the array is no longer used
+        """
+        data = array.limbs if isinstance(array, (RNSArray, Ring64Array)) else array
+        buffer = self.taken.pop(id(data), None)
+        if buffer is not None: self.free[(buffer.dtype, buffer.shape)].append(buffer)
+
+
+def layout(code, shape):
+    # dtype and shape of the data following the header of an array of `shape`
+    if code == RNS: return np.dtype('<i8'), (len(RNS_MODULI),) + shape
+    if code == RING64: return np.dtype('<u8'), (1,) + shape
+    return np.dtype(np.uint8), shape + (arrays.FIXED_BYTES,)
+
+
+def wrap(code, data):
+    # array of the representation `code` from the data read after its header
+    if code == RNS: return RNSArray(data)
+    if code == RING64: return Ring64Array(data)
+    return arrays.from_fixed(data)
+
+
+def allocate(buffers, code, shape):
+    dtype, data_shape = layout(code, shape)
+    if buffers is None: return np.empty(data_shape, dtype=dtype)
+    return buffers.take(dtype, data_shape)
+
+
+def unpack(buffers, code, data):
+    array = wrap(code, data)
+    # object arrays are converted from the buffer, which is free again right away
+    if code == OBJECT and buffers is not None: buffers.release(data)
+    return array
+
+
+def read_array(stream, buffers=None, like=None):
+    """
+    :param stream: binary file object, e.g. socket.makefile('rb')
+    :param buffers: ReceiveBuffers to read the elements into, by default new arrays
+    :param like: array of the representation and shape of the one to read if it was sent without header, see
+        pack_buffers
+    :return: the array pack_array encoded
+    """
+    if like is not None and representation(like) != SEEDED:
+        code, shape = representation(like), like.shape
+    else:
+        code, ndim = HEADER.unpack(read_exactly(stream, HEADER.size))
+        shape = struct.unpack('<%dQ' % ndim, read_exactly(stream, 8 * ndim))
+    if code == SEEDED:
+        seed = read_exactly(stream, SEED_BYTES)
+        length, = OPS.unpack(read_exactly(stream, OPS.size))
+        return SeededElements(seed, shape, ast.literal_eval(read_exactly(stream, length).decode()))
+    return unpack(buffers, code, read_into(stream, allocate(buffers, code, shape)))
+
+
+async def read_array_async(loop, connection, buffers=None, like=None):
+    """
+    read_array from a non-blocking socket with the asyncio event loop `loop`
+    """
+    async def read_exactly_async(size):
+        return bytes(await read_into_async(loop, connection, bytearray(size)))
+
+    if like is not None and representation(like) != SEEDED:
+        code, shape = representation(like), like.shape
+    else:
+        code, ndim = HEADER.unpack(await read_exactly_async(HEADER.size))
+        shape = struct.unpack('<%dQ' % ndim, await read_exactly_async(8 * ndim))
+    if code == SEEDED:
+        seed = await read_exactly_async(SEED_BYTES)
+        length, = OPS.unpack(await read_exactly_async(OPS.size))
+        return SeededElements(seed, shape, ast.literal_eval((await read_exactly_async(length)).decode()))
+    return unpack(buffers, code, await read_into_async(loop, connection, allocate(buffers, code, shape)))
+
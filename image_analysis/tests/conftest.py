@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pond.tensor  # noqa: E402
+
+SETTINGS = ['USE_SPECIALIZED_TRIPLE', 'REUSE_MASK', 'BATCH_REVEALS', 'SEED_COMPRESSION', 'TRIPLE_SOURCE']
+
+
+@pytest.fixture(autouse=True)
+def settings():
+    """
+    Restore the settings of pond.tensor that a test changes
+    """
+    saved = {name: getattr(pond.tensor, name) for name in SETTINGS}
+    yield
+    for name, value in saved.items(): setattr(pond.tensor, name, value)
+
+
+@pytest.fixture(params=['object', 'rns', 'ring64'])
+def backend(request):
+    """
+    Run a test on each share representation, going back to the default one afterwards
+    """
+    pond.tensor.set_backend(request.param)
+    pond.tensor.set_seed(b'0' * 16)
+    yield request.param
+    pond.tensor.set_backend('object')
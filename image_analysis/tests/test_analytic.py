@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from pond.arrays import AnalyticArray
+from pond.tensor import AnalyticTensor, PrivateEncodedTensor
+from pond.nn import Conv2D
+
+
+def test_analytic_array_broadcasts():
+    assert (AnalyticArray((3, 1, 5)) + np.ones((4, 1))).shape == (3, 4, 5)
+    assert (2 * AnalyticArray((2, 3))).shape == (2, 3)
+    with pytest.raises(ValueError):
+        AnalyticArray((3,)) + np.ones(4)
+
+
+def test_analytic_conv2d_shape():
+    # filters are (height, width, channels, n_filters) like those of nn.Conv2D
+    layer = Conv2D((3, 3, 2, 5), strides=1, padding=1)
+    layer.initialize(input_shape=(4, 2, 8, 8), initializer=PrivateEncodedTensor)
+    x = AnalyticTensor.from_shape((4, 2, 8, 8))
+    filters = AnalyticTensor.from_shape(layer.filters.shape)
+    assert x.conv2d(filters, 1, 1).shape == layer.forward(PrivateEncodedTensor(np.zeros((4, 2, 8, 8)))).shape
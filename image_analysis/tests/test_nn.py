@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+import pond.tensor
+from pond.arrays import LimbArray
+from pond.tensor import NativeTensor, PrivateEncodedTensor, LazyPrivateEncodedTensor
+from pond.nn import Conv2D, ConvAveragePooling2D, AveragePooling2D, Relu, Sigmoid, Flatten, Dense, Reveal, \
+    SoftmaxStable, CrossEntropy, Sequential, DataLoader
+
+
+def tolerance():
+    # a few bits above the fixed-point resolution of the backend
+    return 2 ** (4 - pond.tensor.PRECISION_FRACTIONAL)
+
+
+def train_step(layers, input_shape, tensor, seed=0):
+    """
+    Initialize `layers` from `seed` and train them for one batch of random data
+    :return: the model
+    """
+    np.random.seed(seed)
+    xs = np.random.uniform(0, 1, input_shape)
+    ys = np.eye(10)[np.random.randint(0, 10, input_shape[0])]
+    model = Sequential(layers)
+    model.initialize(initializer=tensor, input_shape=list(input_shape))
+    np.random.seed(seed + 1)
+    model.fit(x_train=DataLoader(xs, wrapper=tensor), y_train=DataLoader(ys, wrapper=tensor), loss=CrossEntropy(),
+              epochs=1, batch_size=input_shape[0], learning_rate=0.01, verbose=0)
+    return model
+
+
+def test_padded_conv_after_activation(backend):
+    # the second conv gets the more precise output of Relu, whose truncation has to leave the zero padding at zero
+    def layers():
+        return [Conv2D((3, 3, 1, 2), strides=1, padding=1), AveragePooling2D(pool_size=(2, 2)), Relu(order=3),
+                Conv2D((3, 3, 2, 2), strides=1, padding=1), Flatten(), Dense(10, 2 * 4 * 4), Reveal(),
+                SoftmaxStable()]
+
+    native = train_step(layers(), (4, 1, 8, 8), NativeTensor)
+    private = train_step(layers(), (4, 1, 8, 8), PrivateEncodedTensor)
+    for expected, layer in zip(native.layers, private.layers):
+        if isinstance(layer, Conv2D):
+            assert np.abs(expected.filters.values - layer.filters.unwrap()).max() < tolerance()
+
+
+def test_polynomial_activations_keep_precision(backend):
+    np.random.seed(0)
+    x = np.random.uniform(-1, 1, (16, 8))
+    for layer in (Sigmoid(), Relu(order=3)):
+        expected = layer.forward(NativeTensor(x)).values
+        assert np.abs(layer.forward(PrivateEncodedTensor(x)).unwrap() - expected).max() < tolerance()
+
+
+def test_single_round_polynomial_activation(backend):
+    np.random.seed(0)
+    x = np.random.uniform(-1, 1, (16, 8))
+    layer = Sigmoid(precision=pond.tensor.MAX_PRECISION // 9)
+    rounds = pond.tensor.COMMUNICATION_ROUNDS
+    y = layer.forward(PrivateEncodedTensor(x)).unwrap()
+    assert pond.tensor.COMMUNICATION_ROUNDS - rounds == 1
+    # only MAX_PRECISION // 9 fractional digits of x are left
+    assert np.abs(y - layer.forward(NativeTensor(x)).values).max() < 0.1
+
+
+def test_dense_sigmoid_step(backend):
+    def layers():
+        return [Dense(16, 32), Sigmoid(), Dense(10, 16), Reveal(), SoftmaxStable()]
+
+    native = train_step(layers(), (8, 32), NativeTensor)
+    private = train_step(layers(), (8, 32), PrivateEncodedTensor)
+    for expected, layer in zip(native.layers, private.layers):
+        if isinstance(layer, Dense):
+            assert np.abs(expected.weights.values - layer.weights.unwrap()).max() < tolerance()
+
+
+def parameters(model):
+    # trained values of the layers of `model`, in order
+    return [getattr(layer, name) for layer in model.layers for name in ('weights', 'filters', 'bias')
+            if getattr(layer, name, None) is not None]
+
+
+def dense_layers():
+    return [Dense(16, 32), Relu(order=3), Dense(10, 16), Reveal(), SoftmaxStable()], (8, 32)
+
+
+def conv_layers():
+    return [Conv2D((3, 3, 1, 4), strides=1, padding=1), AveragePooling2D(pool_size=(2, 2)), Relu(order=3),
+            Flatten(), Dense(10, 4 * 4 * 4), Reveal(), SoftmaxStable()], (4, 1, 8, 8)
+
+
+def conv_pooling_layers():
+    return [ConvAveragePooling2D((3, 3, 1, 4), strides=1, padding=1), Relu(order=3), Flatten(), Dense(10, 4 * 4 * 4),
+            Reveal(), SoftmaxStable()], (4, 1, 8, 8)
+
+
+@pytest.mark.parametrize('specialized', [False, True])
+@pytest.mark.parametrize('seed_compression', [False, True])
+@pytest.mark.parametrize('tensor', [PrivateEncodedTensor, LazyPrivateEncodedTensor])
+@pytest.mark.parametrize('model', [dense_layers, conv_layers, conv_pooling_layers])
+def test_training_step_matches_native(backend, model, tensor, seed_compression, specialized):
+    pond.tensor.SEED_COMPRESSION = seed_compression
+    pond.tensor.USE_SPECIALIZED_TRIPLE = pond.tensor.REUSE_MASK = specialized
+    native = train_step(*model(), tensor=NativeTensor)
+    private = train_step(*model(), tensor=tensor)
+    for expected, parameter in zip(parameters(native), parameters(private)):
+        assert np.abs(expected.values - parameter.unwrap()).max() < tolerance()
+
+
+@pytest.mark.parametrize('model', [dense_layers, conv_layers, conv_pooling_layers])
+def test_training_updates_parameters_in_place(backend, model):
+    def buffers(tensor):
+        shares = (tensor.shares0, tensor.shares1)
+        return [share.limbs if isinstance(share, LimbArray) else share for share in shares]
+
+    layers, input_shape = model()
+    np.random.seed(0)
+    xs = np.random.uniform(0, 1, (3 * input_shape[0],) + input_shape[1:])
+    ys = np.eye(10)[np.random.randint(0, 10, len(xs))]
+    private = Sequential(layers)
+    private.initialize(initializer=PrivateEncodedTensor, input_shape=list(input_shape))
+    before = [buffers(parameter) for parameter in parameters(private)]
+    private.fit(x_train=DataLoader(xs, wrapper=PrivateEncodedTensor),
+                y_train=DataLoader(ys, wrapper=PrivateEncodedTensor), loss=CrossEntropy(), epochs=1, batch_size=input_shape[0], learning_rate=0.01, verbose=0)
+    for parameter, shares in zip(parameters(private), before):
+        assert parameter.precision == pond.tensor.PRECISION_FRACTIONAL
+        assert all(a is b for a, b in zip(buffers(parameter), shares))
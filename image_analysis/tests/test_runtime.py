@@ -0,0 +1,30 @@
+import functools
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from pond import runtime
+from pond.tensor import PrivateEncodedTensor
+
+
+def product(seed):
+    np.random.seed(seed)
+    x = PrivateEncodedTensor(np.random.uniform(-1, 1, (4, 3)))
+    y = PrivateEncodedTensor(np.random.uniform(-1, 1, (3, 2)))
+    return (x.dot(y) * x.sum(axis=1, keepdims=True)).reveal().values
+
+
+@pytest.mark.parametrize('channel', [runtime.SocketChannel, runtime.AsyncChannel,
+                                     functools.partial(runtime.SocketChannel, headers=False)])
+def test_parties_match_local(backend, channel):
+    expected = product(0)
+    results = runtime.run(product, (0,), seed=b'0' * 16, channel=channel)
+    for result in results: assert np.array_equal(result, expected)
+
+
+def test_unix_socket():
+    address = os.path.join(tempfile.mkdtemp(), 'party.sock')
+    results = runtime.run(product, (0,), address=address)
+    assert np.array_equal(results[0], results[1])
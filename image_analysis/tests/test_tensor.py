@@ -0,0 +1,159 @@
+import numpy as np
+import pytest
+
+import pond.tensor
+from pond.arrays import LimbArray
+from pond.tensor import NativeTensor, PublicEncodedTensor, PublicFieldTensor, PrivateEncodedTensor, \
+    PrivateFieldTensor, LazyPrivateEncodedTensor, field_elements
+
+
+def values(tensor):
+    # plain values of any tensor, field elements taken as the integers they are
+    if isinstance(tensor, NativeTensor): return tensor.values
+    if isinstance(tensor, PrivateFieldTensor): return values(tensor.reveal(count_communication=False))
+    if isinstance(tensor, PublicFieldTensor): return integers(tensor.elements).astype(np.float64)
+    return tensor.unwrap()
+
+
+def tolerance():
+    # a few bits above the fixed-point resolution of the backend
+    return 2 ** (4 - pond.tensor.PRECISION_FRACTIONAL)
+
+
+def integers(elements):
+    return elements.to_ints() if isinstance(elements, LimbArray) else elements
+
+
+def test_shape_operations_return_new_tensors(backend):
+    x = np.arange(6).reshape(2, 3)
+    tensors = [NativeTensor(x), PublicEncodedTensor(x), PrivateEncodedTensor(x), LazyPrivateEncodedTensor(x),
+               PublicFieldTensor(field_elements(x)), PrivateFieldTensor(field_elements(x))]
+    operations = [lambda t: t.expand_dims(0), lambda t: t.repeat(2, axis=1), lambda t: t.flip(1)]
+    for tensor in tensors:
+        for operation in operations:
+            result = operation(tensor)
+            assert result is not tensor
+            assert tensor.shape == x.shape and np.allclose(values(tensor), x)
+            assert np.allclose(values(result), operation(NativeTensor(x)).values)
+
+
+def operands(shape, seed):
+    np.random.seed(seed)
+    return np.random.uniform(-2, 2, shape)
+
+
+def test_encoding_round_trip(backend):
+    x = operands((4, 5), 0)
+    assert np.abs(PublicEncodedTensor(x).unwrap() - x).max() < 2 ** -pond.tensor.PRECISION_FRACTIONAL
+    assert np.abs(PrivateEncodedTensor(x).unwrap() - x).max() < 2 ** -pond.tensor.PRECISION_FRACTIONAL
+    assert np.array_equal(integers(PrivateFieldTensor(field_elements(x.astype(int))).reveal().elements),
+                          integers(field_elements(x.astype(int))))
+
+
+@pytest.mark.parametrize('seed_compression', [False, True])
+@pytest.mark.parametrize('left', [PublicEncodedTensor, PrivateEncodedTensor, LazyPrivateEncodedTensor])
+@pytest.mark.parametrize('right', [NativeTensor, PublicEncodedTensor, PrivateEncodedTensor, LazyPrivateEncodedTensor])
+def test_arithmetic_matches_native(backend, seed_compression, left, right):
+    pond.tensor.SEED_COMPRESSION = seed_compression
+    x, y, w = operands((4, 5), 0), operands((4, 5), 1), operands((5, 3), 2)
+    operations = [lambda a, b: a + b, lambda a, b: a - b, lambda a, b: a * b, lambda a, b: (a * b) * a,
+                  lambda a, b: a.dot(b.transpose()), lambda a, b: (a + b).sum(axis=0),
+                  lambda a, b: a.neg() + b.square()]
+    for operation in operations:
+        expected = operation(NativeTensor(x), NativeTensor(y)).values
+        result = operation(left(x), right(y))
+        assert np.abs(result.unwrap() - expected).max() < tolerance(), operation
+    expected = NativeTensor(x).dot(NativeTensor(w)).values
+    assert np.abs(left(x).dot(right(w)).unwrap() - expected).max() < tolerance()
+
+
+def test_powers_match_native(backend):
+    x = operands((4, 5), 0) / 2
+    expected = NativeTensor(x).powers(4)
+    for tensor in (PublicEncodedTensor, PrivateEncodedTensor, LazyPrivateEncodedTensor):
+        for power, result in zip(expected, tensor(x).powers(4)):
+            assert np.abs(result.unwrap() - power.values).max() < tolerance()
+
+
+def test_field_arithmetic_matches_integers(backend):
+    x, y = np.arange(-6, 6).reshape(3, 4), np.arange(12).reshape(4, 3)
+
+    def elements(tensor):
+        if isinstance(tensor, PrivateFieldTensor): tensor = tensor.reveal(count_communication=False)
+        return integers(tensor.elements)
+
+    # products of two private field tensors need a triple, which the encoded tensors take care of
+    for left, right in ((PublicFieldTensor, PublicFieldTensor), (PublicFieldTensor, PrivateFieldTensor),
+                        (PrivateFieldTensor, PublicFieldTensor)):
+        a = left(field_elements(x))
+        assert np.array_equal(elements(a.dot(right(field_elements(y)))), integers(field_elements(x.dot(y))))
+        assert np.array_equal(elements(a.mul(right(field_elements(x)))), integers(field_elements(x * x)))
+        assert np.array_equal(elements(a.add(right(field_elements(x)))), integers(field_elements(x + x)))
+    a, b = PrivateFieldTensor(field_elements(x)), PrivateFieldTensor(field_elements(x))
+    assert np.array_equal(elements(a.add(b)), integers(field_elements(x + x)))
+
+
+def test_public_addition_leaves_private_operand_alone(backend):
+    # the unchanged share of the sum is a view of the operand's, which item assignment or += must not write into
+    x, v, w = operands((4, 5), 0), operands((4, 5), 1), operands((4, 5), 2)
+    for combine in (lambda a, b: a + b, lambda a, b: a - b, lambda a, b: b + a):
+        private = PrivateEncodedTensor(x)
+        result = combine(private, PublicEncodedTensor(v))
+        result += PrivateEncodedTensor(w)
+        result[:1] = PrivateEncodedTensor(w[:1])
+        assert np.abs(private.unwrap() - x).max() < tolerance()
+    x, v = np.arange(-6, 6).reshape(3, 4), np.arange(12).reshape(3, 4)
+    for combine in (lambda a, b: a + b, lambda a, b: b + a):
+        private = PrivateFieldTensor(field_elements(x))
+        result = combine(private, PublicFieldTensor(field_elements(v)))
+        result[:1] = PrivateFieldTensor(field_elements(v[:1]))
+        assert np.array_equal(values(private), integers(field_elements(x)).astype(np.float64))
+
+
+@pytest.mark.parametrize('tensor', [PrivateEncodedTensor, LazyPrivateEncodedTensor])
+def test_in_place_operations_leave_operands_alone(backend, tensor):
+    # in-place operations on a sum or difference with a public tensor must not write into the private operand
+    x, v, w = operands((4, 5), 0), operands((4, 5), 1), operands((4, 5), 2)
+    updates = [(lambda y: y.add_(tensor(w)), lambda y: y + w), (lambda y: y.sub_(tensor(w)), lambda y: y - w),
+               (lambda y: y.neg_(), lambda y: -y), (lambda y: y.__iadd__(PublicEncodedTensor(w)), lambda y: y + w),
+               (lambda y: y.__isub__(tensor(w)), lambda y: y - w),
+               (lambda y: tensor(w).add(PublicEncodedTensor(v), out=y), lambda y: w + v)]
+    for combine in (lambda a, b: a + b, lambda a, b: a - b, lambda a, b: b + a, lambda a, b: b - a):
+        for update, expected in updates:
+            private = tensor(x)
+            result = update(combine(private, PublicEncodedTensor(v)))
+            assert np.abs(result.unwrap() - expected(combine(x, v))).max() < tolerance()
+            assert np.abs(private.unwrap() - x).max() < tolerance()
+
+
+def test_views_keep_masks_valid_after_in_place_updates(backend):
+    x, y, z = operands((4, 5), 0), operands((4, 5), 1), operands((4, 5), 2)
+    private, other = PrivateEncodedTensor(x), PrivateEncodedTensor(y)
+    private.mul(other, reuse_mask=True)
+    views = [private.reshape(5, 4), private.transpose(), private[1:3]]
+    row = PrivateEncodedTensor(z[:1])
+    row.mul(PrivateEncodedTensor(y[:1]), reuse_mask=True)
+    private[:1] = row
+    private.add_(PrivateEncodedTensor(z))
+    for view, expected in zip(views, [x.reshape(5, 4), x.transpose(), x[1:3]]):
+        # the product reuses the cached mask of the view, which has to match its shares
+        factor = PrivateEncodedTensor(np.ones(expected.shape))
+        assert np.abs(view.mul(factor, reuse_mask=True).unwrap() - view.unwrap()).max() < tolerance()
+        assert np.abs(view.unwrap() - expected).max() < tolerance()
+    expected = x + z
+    expected[:1] = 2 * z[:1]
+    assert np.abs(private.mul(other, reuse_mask=True).unwrap() - expected * y).max() < tolerance()
+
+
+@pytest.mark.parametrize('tensor', [PublicEncodedTensor, PrivateEncodedTensor])
+def test_products_leave_factors_alone(backend, tensor):
+    # the factors of a product are truncated to fit, which must not change them for the caller
+    x, y = operands((4, 5), 0), operands((5, 4), 1)
+    products = [lambda a, b: a.mul(b.transpose()), lambda a, b: a.dot(b), lambda a, b: a.square(),
+                lambda a, b: a * 0.5, lambda a, b: b.transpose().dot(a.transpose())]
+    for product in products:
+        a, b = tensor(x) * tensor(np.ones(x.shape)), PrivateEncodedTensor(y) * PrivateEncodedTensor(np.ones(y.shape))
+        precisions = a.precision, b.precision
+        product(a, b)
+        assert (a.precision, b.precision) == precisions
+        assert np.abs(a.unwrap() - x).max() < tolerance() and np.abs(b.unwrap() - y).max() < tolerance()
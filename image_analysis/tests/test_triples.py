@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pytest
+
+import pond.tensor
+from pond import triples
+from pond.arrays import LimbArray
+from pond.tensor import NativeTensor, PrivateEncodedTensor
+from pond.nn import ConvAveragePooling2D, Relu, Flatten, Dense, Reveal, SoftmaxStable, CrossEntropy, Sequential, \
+    DataLoader
+
+BATCH_SIZE = 4
+
+
+def layers():
+    return [ConvAveragePooling2D((3, 3, 1, 4), strides=1, padding=1), Relu(order=3), Flatten(), Dense(10, 4 * 4 * 4),
+            Reveal(), SoftmaxStable()]
+
+
+def data(steps):
+    np.random.seed(0)
+    xs = np.random.uniform(0, 1, (steps * BATCH_SIZE, 1, 8, 8))
+    ys = np.eye(10)[np.random.randint(0, 10, steps * BATCH_SIZE)]
+    return xs, ys
+
+
+def model(tensor):
+    np.random.seed(1)
+    model = Sequential(layers())
+    model.initialize(initializer=tensor, input_shape=[BATCH_SIZE, 1, 8, 8])
+    return model
+
+
+def fit(model, xs, ys, tensor):
+    np.random.seed(2)
+    model.fit(x_train=DataLoader(xs, wrapper=tensor), y_train=DataLoader(ys, wrapper=tensor), loss=CrossEntropy(),
+              epochs=1, batch_size=BATCH_SIZE, learning_rate=0.01, verbose=0)
+    return [layer.filters if hasattr(layer, 'filters') else layer.weights for layer in model.layers
+            if isinstance(layer, (ConvAveragePooling2D, Dense))]
+
+
+def revealed(triple):
+    elements = [share.reveal(count_communication=False).elements for share in triple]
+    return [element.to_ints() if isinstance(element, LimbArray) else element for element in elements]
+
+
+@pytest.mark.parametrize('specialized', [False, True])
+@pytest.mark.parametrize('seed_compression', [False, True])
+@pytest.mark.parametrize('source', ['queue', 'store'])
+def test_triples_round_trip(backend, tmpdir, seed_compression, specialized, source):
+    pond.tensor.SEED_COMPRESSION = seed_compression
+    pond.tensor.USE_SPECIALIZED_TRIPLE = pond.tensor.REUSE_MASK = specialized
+    xs, ys = data(1)
+    calls = triples.trace(model(PrivateEncodedTensor), PrivateEncodedTensor(xs), PrivateEncodedTensor(ys),
+                          CrossEntropy()).plan.calls
+    assert calls
+    generated = triples.generate_step((calls, b'1' * 16, None))
+    queue = triples.TripleQueue() if source == 'queue' else triples.TripleStore(str(tmpdir))
+    assert queue.put(calls, generated) and len(queue) == len(calls)
+    taken = []
+    for (kind, params, inputs), triple in zip(calls, generated):
+        taken.append(queue.take(kind, params, [(name, taken[call][position]) for name, (call, position) in inputs]))
+        assert all(np.array_equal(a, b) for a, b in zip(revealed(taken[-1]), revealed(triple)))
+    assert len(queue) == 0
+    if source == 'store': assert not os.listdir(str(tmpdir.join('party0'))) + os.listdir(str(tmpdir.join('party1')))
+
+
+def test_precomputed_training_matches_native(backend):
+    pond.tensor.USE_SPECIALIZED_TRIPLE = pond.tensor.REUSE_MASK = True
+    xs, ys = data(2)
+    expected = fit(model(NativeTensor), xs, ys, NativeTensor)
+    private = model(PrivateEncodedTensor)
+    queue = triples.precompute(private, PrivateEncodedTensor(xs[:BATCH_SIZE]), PrivateEncodedTensor(ys[:BATCH_SIZE]),
+                               CrossEntropy(), steps=2, processes=2)
+    assert len(queue) > 0
+    result = fit(private, xs, ys, PrivateEncodedTensor)
+    assert len(queue) == 0
+    for a, b in zip(expected, result):
+        assert np.abs(a.values - b.unwrap()).max() < 2 ** (4 - pond.tensor.PRECISION_FRACTIONAL)
+
+
+@pytest.mark.parametrize('capacity', [None, 1])
+def test_stored_training_matches_native(backend, tmpdir, capacity):
+    pond.tensor.USE_SPECIALIZED_TRIPLE = pond.tensor.REUSE_MASK = True
+    xs, ys = data(2)
+    expected = fit(model(NativeTensor), xs, ys, NativeTensor)
+    private = model(PrivateEncodedTensor)
+    store = triples.TripleStore(str(tmpdir), capacity)
+    triples.precompute(private, PrivateEncodedTensor(xs[:BATCH_SIZE]), PrivateEncodedTensor(ys[:BATCH_SIZE]),
+                       CrossEntropy(), steps=2, processes=2, store=store)
+    # a store too small for a single step keeps nothing and the triples are generated inline
+    assert (len(store) == 0) == (capacity is not None)
+    result = fit(private, xs, ys, PrivateEncodedTensor)
+    assert len(store) == 0 and store.size == 0
+    for a, b in zip(expected, result):
+        assert np.abs(a.values - b.unwrap()).max() < 2 ** (4 - pond.tensor.PRECISION_FRACTIONAL)
+
+
+def test_store_serves_mapped_limbs(backend, tmpdir):
+    xs, ys = data(1)
+    calls = triples.trace(model(PrivateEncodedTensor), PrivateEncodedTensor(xs), PrivateEncodedTensor(ys),
+                          CrossEntropy()).plan.calls
+    store = triples.TripleStore(str(tmpdir))
+    store.put(calls[:1], triples.generate_step((calls[:1], b'1' * 16, None)))
+    kind, params, _ = calls[0]
+    for share in store.take(kind, params, []):
+        for shares in (share.shares0, share.shares1):
+            # only limbs are kept mapped, Python integers are converted when the triple is taken
+            if backend == 'object': assert shares.dtype == object
+            else: assert isinstance(shares.limbs, np.memmap)
+
+
+class FailingLoss(CrossEntropy):
+
+    def derive(self, y_pred, y_correct):
+        raise RuntimeError('derive')
+
+
+def test_failed_training_closes_prefetcher(backend):
+    xs, ys = data(1)
+    private = model(PrivateEncodedTensor)
+    prefetcher = triples.TriplePrefetcher(processes=1)
+    with pytest.raises(RuntimeError):
+        private.fit(x_train=DataLoader(xs, wrapper=PrivateEncodedTensor),
+                    y_train=DataLoader(ys, wrapper=PrivateEncodedTensor), loss=FailingLoss(), epochs=1,
+                    batch_size=BATCH_SIZE, prefetcher=prefetcher)
+    assert pond.tensor.TRIPLE_SOURCE is None
+    with pytest.raises(ValueError):
+        prefetcher.pool.apply_async(len, ([],))
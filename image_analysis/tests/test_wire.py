@@ -0,0 +1,74 @@
+import io
+import socket
+import asyncio
+
+import numpy as np
+
+import pond.tensor
+from pond import wire
+from pond.arrays import LimbArray
+from pond.tensor import SeededElements, sample
+
+
+def integers(array):
+    return array.to_ints() % pond.tensor.Q if isinstance(array, LimbArray) else array
+
+
+def test_pack_array_round_trip(backend):
+    for shape in ((1,), (5,), (3, 4, 2)):
+        array = sample(shape)
+        result = wire.read_array(io.BytesIO(wire.pack_array(array)))
+        assert type(result) is type(array) and result.shape == array.shape
+        assert np.array_equal(integers(result), integers(array))
+
+
+def test_seeded_elements_round_trip(backend):
+    seeded = SeededElements(pond.tensor.PRGS['dealer'].new_seed(), (2, 3, 4)).derive('transpose', 2, 0, 1)
+    result = wire.read_array(io.BytesIO(wire.pack_array(seeded)))
+    assert result.seed == seeded.seed and result.ops == seeded.ops and result.shape == (4, 2, 3)
+    assert np.array_equal(integers(result.expand()), integers(seeded.expand()))
+
+
+def test_headerless_round_trip(backend):
+    array = sample((3, 4))
+    stream = io.BytesIO(b''.join(wire.pack_buffers(array, header=False)))
+    assert np.array_equal(integers(wire.read_array(stream, like=sample((3, 4)))), integers(array))
+
+
+def test_receive_buffers_are_reused(backend):
+    buffers = wire.ReceiveBuffers()
+    first = wire.read_array(io.BytesIO(wire.pack_array(sample((3, 4)))), buffers)
+    if backend == 'object':
+        # Python integers are converted from the buffer, which is given back right away
+        assert not buffers.taken and sum(len(free) for free in buffers.free.values()) == 1
+        return
+    buffers.release(first)
+    array = sample((3, 4))
+    second = wire.read_array(io.BytesIO(wire.pack_array(array)), buffers)
+    assert second.limbs is first.limbs
+    assert np.array_equal(integers(second), integers(array))
+
+
+def test_send_buffers_over_socket(backend):
+    arrays = [sample((64, 32)), SeededElements(pond.tensor.PRGS['dealer'].new_seed(), (4,)), sample((7,))]
+    left, right = socket.socketpair()
+    with left, right, right.makefile('rb') as stream:
+        wire.send_buffers(left, [buffer for array in arrays for buffer in wire.pack_buffers(array)])
+        for array in arrays:
+            result = wire.read_array(stream)
+            if isinstance(array, SeededElements): result, array = result.expand(), array.expand()
+            assert np.array_equal(integers(result), integers(array))
+
+
+def test_read_array_async(backend):
+    array = sample((64, 32))
+    left, right = socket.socketpair()
+    loop = asyncio.new_event_loop()
+    try:
+        with left, right:
+            right.setblocking(False)
+            left.sendall(wire.pack_array(array))
+            result = loop.run_until_complete(wire.read_array_async(loop, right))
+            assert np.array_equal(integers(result), integers(array))
+    finally:
+        loop.close()